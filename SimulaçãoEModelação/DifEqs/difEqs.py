@@ -2,6 +2,22 @@
 %clear
 import numpy as np
 import matplotlib.pyplot as plt
+import os
+import sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import integradores as ig
+
+
+def gravAcel(r, out, GM = 4. * np.pi ** 2):
+    '''Aceleração gravítica do corpo central, fixo na origem (função de aceleração dos integradores)
+    r: Vector(es) posição, com as coordenadas no último eixo
+    out: Array onde é escrita a aceleração
+    GM: Parâmetro gravitacional do corpo central'''
+
+    rNorm = np.sqrt((r * r).sum(axis = -1, keepdims = True))
+    np.multiply(r, -GM / rNorm ** 3, out = out)
+
+
 def orbitCalEuler(t, r, v, deltaT, nPasso):
     '''Calcula nPasso da órbita
     t: tempo inicial
@@ -12,20 +28,11 @@ def orbitCalEuler(t, r, v, deltaT, nPasso):
     
     return: final values of t, r, v'''
     
-    GM = 4. * np.pi ** 2
-    
-    passo = 0
-    while passo < nPasso:
-        #Cálculo e actualização das variáveis
-        t += deltaT
-        rNorm = np.sqrt((r * r).sum())
-        a = -GM * r / rNorm ** 3
-        r = r + v * deltaT
-        v = v + a * deltaT
-
-        passo += 1
+    r = np.array(r, dtype = float)
+    v = np.array(v, dtype = float)
+    ig.euler(r, v, gravAcel, ig.initBuffers('Euler', r, v, gravAcel, deltaT), nPasso, deltaT)
         
-    return t, r, v
+    return t + nPasso * deltaT, r, v
 
 def inicializa(tamanho, inicial):
     '''Inicializa os arrays das variáveis do movimento
@@ -62,12 +69,11 @@ def orbitSimul(inicial, deltaT, tmax, grafTempos = 0.005):
     
     nPassos = int(grafTempos / deltaT)
     
-    im = 0
-    index = 1
-    while index < tamanho:
-        t[index], rData[index], vData[index] = orbitCalEuler(t[im],rData[im], vData[im], deltaT, nPassos)
-        im = index
-        index += 1
+    #Os valores são guardados directamente em rData e vData pelo integrador
+    r = rData[0].copy()
+    v = vData[0].copy()
+    res = ig.integrar(r, v, gravAcel, deltaT, nPassos, tamanho - 1, 'Euler', xOut = rData, vOut = vData)
+    t[:] = res.t
     
     return t, rData, vData
 
@@ -82,20 +88,11 @@ def orbitCalCromer(t, r, v, deltaT, nPasso):
     
     return: final values of t, r, v'''
     
-    GM = 4. * np.pi ** 2
-    
-    passo = 0
-    while passo < nPasso:
-        #Cálculo e actualização das variáveis
-        t += deltaT
-        rNorm = np.sqrt((r * r).sum())
-        a = -GM * r / rNorm ** 3
-        
-        v = v + a * deltaT
-        r = r + v * deltaT
-        passo += 1
+    r = np.array(r, dtype = float)
+    v = np.array(v, dtype = float)
+    ig.eulerCromer(r, v, gravAcel, ig.initBuffers('Euler-Cromer', r, v, gravAcel, deltaT), nPasso, deltaT)
         
-    return t, r, v
+    return t + nPasso * deltaT, r, v
 def orbitSimulCromer(inicial, deltaT, tmax, grafTempos = 0.005):
     '''Calcula a orbital de um dado corpo
     inicial: Tuple com valores de x, vx, y e vy iniciais
@@ -114,16 +111,186 @@ def orbitSimulCromer(inicial, deltaT, tmax, grafTempos = 0.005):
     
     nPassos = int(grafTempos / deltaT)
     
-    im = 0
-    index = 1
-    while index < tamanho:
-        t[index], rData[index], vData[index] = orbitCalCromer(t[im],rData[im], vData[im], deltaT, nPassos)
-        im = index
-        index += 1
+    #Os valores são guardados directamente em rData e vData pelo integrador
+    r = rData[0].copy()
+    v = vData[0].copy()
+    res = ig.integrar(r, v, gravAcel, deltaT, nPassos, tamanho - 1, 'Euler-Cromer', xOut = rData, vOut = vData)
+    t[:] = res.t
     
     return t, rData, vData
 
 
+def keplerUniversal(r0, v0, t, GM = 4. * np.pi ** 2, tol = 1e-12, maxIter = 100):
+    '''Propaga analiticamente órbitas keplerianas em variáveis universais
+    r0: Vector posição inicial, forma (2,) ou (nOrbitas, 2)
+    v0: Vector velocidade inicial, com a mesma forma de r0
+    t: Tempos (desde o instante inicial) onde se quer a solução, forma (nTempos,)
+    GM: Parâmetro gravitacional do corpo central, fixo na origem
+    tol: Tolerância relativa na variável universal
+    maxIter: Número máximo de iterações
+
+    Resolve a equação de Kepler universal para todos os tempos e órbitas ao mesmo
+    tempo com integradores.kepler (Newton protegido por bisseção, com aviso se não
+    convergir). Serve para órbitas elípticas, parabólicas e hiperbólicas.
+
+    return: Numpy arrays r, v com forma (nTempos, 2) ou (nTempos, nOrbitas, 2)'''
+
+    r0 = np.asarray(r0, dtype = float)
+    v0 = np.asarray(v0, dtype = float)
+    t = np.atleast_1d(np.asarray(t, dtype = float))
+    umaOrbita = r0.ndim == 1
+
+    r, v = ig.kepler(np.atleast_2d(r0)[None], np.atleast_2d(v0)[None], t[:, None], GM, tol, maxIter)
+
+    if umaOrbita:
+        return r[:, 0], v[:, 0]
+    return r, v
+
+
+def orbitSimulKepler(inicial, tmax, grafTempos = 0.005):
+    '''Calcula a órbita de um dado corpo com a solução analítica de Kepler
+    inicial: Tuple com valores de r, v iniciais
+    tmax: O tempo total a simular em unidades da simulação
+    grafTempos: O intervalo de tempos para guardar os valores
+
+    return: Numpy arrays com t, r, v'''
+
+    tamanho = int(tmax / grafTempos) + 1
+    t = np.arange(tamanho) * grafTempos
+    rData, vData = keplerUniversal(inicial[0], inicial[1], t)
+
+    return t, rData, vData
+
+
+def orbitErro(inicial, t, r, v):
+    '''Compara uma órbita calculada numericamente com a solução de Kepler
+    inicial: Tuple com valores de r, v iniciais
+    t, r, v: Numpy arrays devolvidos por orbitSimul ou orbitSimulCromer
+
+    return: Numpy arrays com o erro da posição e o erro relativo da energia em cada tempo'''
+
+    GM = 4. * np.pi ** 2
+
+    rK, vK = keplerUniversal(inicial[0], inicial[1], t)
+    erroR = np.sqrt(((r - rK) ** 2).sum(axis = 1))
+
+    energia = 0.5 * (v * v).sum(axis = 1) - GM / np.sqrt((r * r).sum(axis = 1))
+    erroE = np.abs((energia - energia[0]) / energia[0])
+
+    return erroR, erroE
+
+
+def keplerCheck(inicial, tmax, grafTempos = 0.005):
+    '''Verifica a solução de Kepler pela conservação da energia e do momento angular
+    inicial: Tuple com valores de r, v iniciais
+    tmax: O tempo total em unidades da simulação
+    grafTempos: O intervalo de tempos verificados
+
+    return: Excentricidade da órbita, erros relativos máximos da energia e do momento angular'''
+
+    GM = 4. * np.pi ** 2
+    r0, v0 = np.asarray(inicial[0], dtype = float), np.asarray(inicial[1], dtype = float)
+    t, r, v = orbitSimulKepler((r0, v0), tmax, grafTempos)
+
+    E0 = 0.5 * (v0 * v0).sum() - GM / np.sqrt((r0 * r0).sum())
+    L0 = r0[0] * v0[1] - r0[1] * v0[0]
+    E = 0.5 * (v * v).sum(axis = 1) - GM / np.sqrt((r * r).sum(axis = 1))
+    L = r[:, 0] * v[:, 1] - r[:, 1] * v[:, 0]
+    exc = np.sqrt(1 + 2 * E0 * L0 ** 2 / GM ** 2)
+
+    return exc, np.abs(E - E0).max() / max(abs(E0), 1e-300), np.abs(L - L0).max() / abs(L0)
+
+
+def orbitEventosCromer(inicial, deltaT, tmax, R = 100., guardarEventos = True):
+    '''Integra a órbita com Euler-Cromer detectando eventos sem guardar a trajectória
+    inicial: Tuple com valores de r, v iniciais
+    deltaT: Valor de intervalo de tempo entre passos
+    tmax: O tempo total a simular em unidades da simulação
+    R: Raio a partir do qual um corpo com energia positiva é considerado escapado
+    guardarEventos: Se False só são calculadas as estatísticas (memória constante)
+
+    Os eventos são passagens pelo periélio e afélio (mudança de sinal de r.v),
+    cruzamentos dos eixos x e y e o escape. O instante de cada evento é refinado
+    por interpolação linear dentro do passo onde ocorreu.
+
+    return: Lista de eventos (tipo, t, r, v) ou None, dicionário com o resumo'''
+
+    GM = 4. * np.pi ** 2
+
+    r = np.array(inicial[0], dtype = float)
+    v = np.array(inicial[1], dtype = float)
+    t = 0.
+
+    eventos = [] if guardarEventos else None
+    resumo = {'periélios': 0, 'afélios': 0, 'cruzamentosX': 0, 'cruzamentosY': 0,
+              'período': np.nan, 'rPeriMin': np.inf, 'rPeriMax': 0., 'rApoMax': 0.,
+              'tEscape': np.nan}
+    tPeriAnt = np.nan
+    somaPeriodos = 0.
+
+    #Funções cujas mudanças de sinal definem os eventos
+    g = np.array([(r * v).sum(), r[1], r[0]])
+    buf = ig.initBuffers('Euler-Cromer', r, v, gravAcel, deltaT)
+
+    nPassos = int(tmax / deltaT)
+    passo = 0
+    while passo < nPassos:
+        rAnt = r.copy()
+        vAnt = v.copy()
+        gAnt = g
+
+        #Passo de Euler-Cromer
+        ig.eulerCromer(r, v, gravAcel, buf, 1, deltaT)
+        t += deltaT
+        passo += 1
+
+        g = np.array([(r * v).sum(), r[1], r[0]])
+        mudou = (g * gAnt < 0) | ((g == 0) & (gAnt != 0))
+
+        if mudou.any():
+            for k in np.nonzero(mudou)[0]:
+                #Interpolação linear do instante em que g[k] passa por zero
+                s = gAnt[k] / (gAnt[k] - g[k])
+                tEv = t - deltaT + s * deltaT
+                rEv = rAnt + s * (r - rAnt)
+                vEv = vAnt + s * (v - vAnt)
+                rEvNorm = np.sqrt((rEv * rEv).sum())
+
+                if k == 0 and g[k] > 0:
+                    tipo = 'periélio'
+                    resumo['periélios'] += 1
+                    resumo['rPeriMin'] = min(resumo['rPeriMin'], rEvNorm)
+                    resumo['rPeriMax'] = max(resumo['rPeriMax'], rEvNorm)
+                    if not np.isnan(tPeriAnt):
+                        somaPeriodos += tEv - tPeriAnt
+                        resumo['período'] = somaPeriodos / (resumo['periélios'] - 1)
+                    tPeriAnt = tEv
+                elif k == 0:
+                    tipo = 'afélio'
+                    resumo['afélios'] += 1
+                    resumo['rApoMax'] = max(resumo['rApoMax'], rEvNorm)
+                elif k == 1:
+                    tipo = 'eixoX'
+                    resumo['cruzamentosX'] += 1
+                else:
+                    tipo = 'eixoY'
+                    resumo['cruzamentosY'] += 1
+
+                if guardarEventos:
+                    eventos.append((tipo, tEv, rEv, vEv))
+
+        #Escape: energia positiva para além do raio R
+        rNorm = np.sqrt((r * r).sum())
+        if rNorm > R and 0.5 * (v * v).sum() - GM / rNorm > 0:
+            #Interpolação do instante em que |r| = R
+            rAntNorm = np.sqrt((rAnt * rAnt).sum())
+            s = (R - rAntNorm) / (rNorm - rAntNorm) if rAntNorm < R else 0.
+            resumo['tEscape'] = t - deltaT + s * deltaT
+            if guardarEventos:
+                eventos.append(('escape', resumo['tEscape'], rAnt + s * (r - rAnt), vAnt + s * (v - vAnt)))
+            break
+
+    return eventos, resumo
 
 
 
@@ -131,6 +298,14 @@ def orbitSimulCromer(inicial, deltaT, tmax, grafTempos = 0.005):
 r0 = np.array([1.0, 0.0])
 v0 = np.array([0.0, .6 * np.pi]) 
 t, r, v = orbitSimulCromer((r0, v0), .001, 30)
+tK, rK, vK = orbitSimulKepler((r0, v0), 30)
+erroR, erroE = orbitErro((r0, v0), t, r, v)
+print('Euler-Cromer: erro máximo da posição ' + str(erroR.max()) + ', da energia ' + str(erroE.max()))
+eventos, resumo = orbitEventosCromer((r0, v0), .001, 30, guardarEventos = False)
+print('Período: ' + str(resumo['período']) + ', periélio mínimo: ' + str(resumo['rPeriMin']))
+for vExc in (np.array([0.0, 0.2 * np.pi]), np.array([5.0, 1.0])): #Órbitas com e >= 0.98
+    exc, erroEK, erroLK = keplerCheck((r0, vExc), 30)
+    print('Kepler (e = ' + str(round(exc, 3)) + '): erro da energia ' + str(erroEK) + ', do momento angular ' + str(erroLK))
 
 
 
@@ -139,5 +314,6 @@ t, r, v = orbitSimulCromer((r0, v0), .001, 30)
 
 fig, ax = plt.subplots(figsize = (12, 12))
 ax.plot(r[:, 0], r[:, 1])
+ax.plot(rK[:, 0], rK[:, 1], '--')
 #ax.set_box_aspect(1)
 
@@ -11,55 +11,217 @@
 %matplotlib qt
 %clear
 
+import os
+import sys
+import json
 import numpy as np
 import matplotlib.pyplot as plt
 import matplotlib.animation as animation
 from collections import deque
+sys.path.insert(0,os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import integradores as ig
+import kernels as kern
 plt.style.use('dark_background')
 class Planet:
-    def  __init__(self,name, mass, radius,period,color,size):
+    def  __init__(self,name, mass, radius,period,color,rng=None):
         self.name=name
         self.m = mass 
         self.color=color
-        tudo=randVals(radius, period)
+        tudo=randVals(radius, period, rng)
         self.coor=tudo[0]
         self.v = tudo[1]
-        self.rList=np.zeros((size,2))
-        self.rList[0]=self.coor
-        self.vList=np.zeros((size,2))
-        self.vList[0]=self.v
+        #As listas das amostragens são criadas pelo initLists (vistas de um array comum)
+        self.rList=None
+        self.vList=None
         self.energy=0
-        self.eList=np.zeros(size)
+        self.eList=None
     def __str__(self):
         return 'Planeta: '+str(self.name) + '       Coordenadas: ' + str(self.coor)
 
-def initialize(size):
-    t=np.zeros(size)
+class TestParticles:
+    #Partículas sem massa (asteróides, detritos) em arrays (n,2): sentem os corpos
+    #massivos mas não se atraem entre si nem os atraem a eles
+    def __init__(self,n,rMin,rMax,size,decim=1,save=True):
+        self.n=n
+        radius=rMin+(rMax-rMin)*np.random.rand(n)
+        theta=np.random.rand(n)*2*np.pi
+        v=2*np.pi/np.sqrt(radius) #Órbitas circulares à volta do Sol (período r^1.5)
+        self.coor=np.stack((radius*np.cos(theta),radius*np.sin(theta)),axis=1)
+        self.v=np.stack((-v*np.sin(theta),v*np.cos(theta)),axis=1)
+        self.decim=decim
+        #Só se guarda uma amostra em cada decim (ou nenhuma)
+        if save:
+            self.rList=np.zeros(((size-1)//decim+1,n,2))
+            self.rList[0]=self.coor
+        else:
+            self.rList=None
+    def load(self,i):
+        if self.rList is not None and (i+1)%self.decim==0:
+            self.rList[(i+1)//self.decim]=self.coor
+
+class Diagnostics:
+    #Grandezas conservadas do sistema em cada amostragem e o seu desvio relativo
+    #em relação ao estado inicial (energia, momento linear e momento angular)
+    def start(self,size):
+        self.eKin=np.zeros(size)
+        self.ePot=np.zeros(size)
+        self.p=np.zeros((size,2))
+        self.L=np.zeros(size)
+        self.eDrift=np.zeros(size)
+        self.pDrift=np.zeros(size)
+        self.LDrift=np.zeros(size)
+    def record(self,k,pos,vel,m,eps=0,U=None):
+        self.eKin[k],self.ePot[k],self.p[k],self.L[k]=diagnostics(pos,vel,m,eps,U)
+        #Só a amostragem k (somar os arrays inteiros em cada registo tornava a corrida O(size^2))
+        e0=self.eKin[0]+self.ePot[0]
+        self.eDrift[k]=abs((self.eKin[k]+self.ePot[k]-e0)/e0)
+        #O momento linear é comparado com a escala sum(m|v|) porque pode ser nulo
+        scale=(m*np.sqrt((vel*vel).sum(axis=1))).sum()
+        self.pDrift[k]=np.sqrt(((self.p[k]-self.p[0])**2).sum())/scale
+        self.LDrift[k]=abs((self.L[k]-self.L[0])/self.L[0]) if self.L[0]!=0 else abs(self.L[k])
+    def report(self):
+        print('Desvio relativo máximo: energia '+str(self.eDrift.max())+', momento linear '+str(self.pDrift.max())+', momento angular '+str(self.LDrift.max()))
+
+class BufferedField:
+    #Campo de amostragens com um buffer em memória de tamanho fixo: recebe as escritas
+    #como se fosse o array completo (field[k] ou field[k,idx]) e o TrajectoryWriter
+    #despeja o buffer no ficheiro mapeado quando fica cheio
+    def __init__(self,mm,block):
+        self.mm=mm
+        self.shape=mm.shape
+        self.buf=np.zeros((block,)+mm.shape[1:])
+        self.k0=0
+    def __setitem__(self,key,value):
+        if isinstance(key,tuple):
+            self.buf[(key[0]-self.k0,)+key[1:]]=value
+        else:
+            self.buf[key-self.k0]=value
+    def __getitem__(self,key):
+        #Leitura de uma amostragem: do buffer ou, se já foi despejada, do ficheiro
+        if key>=self.k0:
+            return self.buf[key-self.k0]
+        return self.mm[key]
+    def flush(self,n):
+        self.mm[self.k0:self.k0+n]=self.buf[:n]
+        self.mm.flush()
+        self.k0+=n
+
+class TrajectoryWriter:
+    #Guarda as amostragens em disco em vez de na RAM: um .npy mapeado em memória por
+    #campo (r, v, e, t) e um índice index.json com nomes, massas, cores e o número de
+    #amostragens já escritas (o que foi escrito não se perde se a sessão morrer)
+    def __init__(self,path,block=1000):
+        self.path=path
+        self.block=block
+    def start(self,planets,size,tStep):
+        os.makedirs(self.path,exist_ok=True)
+        n=planets.shape[0]
+        shapes={'r':(size,n,2),'v':(size,n,2),'e':(size,n),'t':(size,)}
+        self.fields={}
+        for name in shapes:
+            mm=np.lib.format.open_memmap(os.path.join(self.path,name+'.npy'),mode='w+',dtype=float,shape=shapes[name])
+            self.fields[name]=BufferedField(mm,min(self.block,size))
+        self.size=size
+        self.index={'names':[planet.name for planet in planets],
+                    'masses':[float(planet.m) for planet in planets],
+                    'colors':[planet.color for planet in planets],
+                    'tStep':tStep,'size':size,'nSaved':0}
+        self.writeIndex()
+        return self.fields['r'],self.fields['v'],self.fields['e'],self.fields['t']
+    def sampled(self,k,time):
+        self.fields['t'][k]=time
+        if k+1-self.fields['t'].k0==self.fields['t'].buf.shape[0] or k+1==self.size:
+            self.flush(k+1)
+    def flush(self,kEnd):
+        n=kEnd-self.fields['t'].k0
+        if n<=0:
+            return
+        for name in self.fields:
+            self.fields[name].flush(n)
+        self.index['nSaved']=kEnd
+        self.writeIndex()
+    def writeIndex(self):
+        with open(os.path.join(self.path,'index.json'),'w',encoding='utf-8') as f:
+            json.dump(self.index,f,ensure_ascii=False)
+    def close(self,planets):
+        #Os planetas passam a ler as listas directamente do disco
+        self.fields=None
+        reader=TrajectoryReader(self.path)
+        stored=reader.planets()
+        for p in range(planets.shape[0]):
+            planets[p].rList=stored[p].rList
+            planets[p].vList=stored[p].vList
+            planets[p].eList=stored[p].eList
+        return reader
+
+class StoredPlanet:
+    def __init__(self,name,mass,color,rList,vList,eList):
+        self.name=name
+        self.m=mass
+        self.color=color
+        self.rList=rList
+        self.vList=vList
+        self.eList=eList
+
+class TrajectoryReader:
+    #Leitura preguiçosa de uma corrida guardada pelo TrajectoryWriter: os arrays são
+    #abertos com mmap_mode='r' e só as fatias usadas são lidas do disco
+    def __init__(self,path):
+        with open(os.path.join(path,'index.json'),encoding='utf-8') as f:
+            self.index=json.load(f)
+        n=self.index['nSaved']
+        self.r=np.load(os.path.join(path,'r.npy'),mmap_mode='r')[:n]
+        self.v=np.load(os.path.join(path,'v.npy'),mmap_mode='r')[:n]
+        self.e=np.load(os.path.join(path,'e.npy'),mmap_mode='r')[:n]
+        self.t=np.load(os.path.join(path,'t.npy'),mmap_mode='r')[:n]
+    def planets(self):
+        #Objetos com a mesma interface que Planet para o makeFreqPlots e a animação
+        n=len(self.index['names'])
+        stored=np.zeros(n,dtype=object)
+        for p in range(n):
+            stored[p]=StoredPlanet(self.index['names'][p],self.index['masses'][p],self.index['colors'][p],
+                                   self.r[:,p],self.v[:,p],self.e[:,p])
+        return stored
+
+def initialize(nDisco=0,blackHole=True,rng=None):
+    #As listas das amostragens e os tempos são criados pelo initLists
     planets=np.zeros(0)
     '''Aqui devem ser inseridos os planetas do sistema Solar'''
-    planets=np.append(planets,Planet('Terra', 1/332946, 1,1,"blue", size))
+    planets=np.append(planets,Planet('Terra', 1/332946, 1,1,"blue", rng))
     
-    planets=np.append(planets,Planet('Júpiter', 1/1047.35, 5.2,11.9,"orange", size))
+    planets=np.append(planets,Planet('Júpiter', 1/1047.35, 5.2,11.9,"orange", rng))
     
-    planets=np.append(planets,Planet('Marte', 1/332946*0.107, 1.5,1.9,"red", size))
+    planets=np.append(planets,Planet('Marte', 1/332946*0.107, 1.5,1.9,"red", rng))
     
-    planets=np.append(planets,Planet('Mercury', 0.055*1/332946, 0.4,88/365,"grey", size))
+    planets=np.append(planets,Planet('Mercury', 0.055*1/332946, 0.4,88/365,"grey", rng))
     
-    planets=np.append(planets,Planet('Sun', 1, 0,0,"yellow", size))
+    planets=np.append(planets,Planet('Sun', 1, 0,0,"yellow", rng))
     
-    planets=np.append(planets,Planet('Venus',0.815*1/332946 , 0.7,225/365,"green", size))
+    planets=np.append(planets,Planet('Venus',0.815*1/332946 , 0.7,225/365,"green", rng))
     
-    planets=np.append(planets,Planet('Black Hole',1,5,0,"white", size))
+    if blackHole:
+        planets=np.append(planets,Planet('Black Hole',1,5,0,"white", rng))
 
+    if nDisco>0:
+        planets=np.concatenate((planets,initDisc(nDisco,rng=rng)))
     
-    return planets,t
+    return planets
 
-def randVals(radius,period):
+def initDisc(n,rMin=2,rMax=4,mTotal=1e-6,rng=None):
+    #Disco de detritos em órbitas circulares à volta do Sol
+    disc=np.zeros(n,dtype=object)
+    radius=rMin+(rMax-rMin)*(np.random.rand(n) if rng is None else rng.random(n))
+    for i in range(n):
+        disc[i]=Planet('Disco '+str(i),mTotal/n,radius[i],radius[i]**1.5,"lightgrey",rng)
+    return disc
+
+def randVals(radius,period,rng=None):
+    #rng: np.random.Generator próprio (corridas independentes); por omissão usa np.random
     if period==0 :
         v=0
     else:
         v=2*np.pi*radius/period
-    theta=np.random.rand()*2*np.pi
+    theta=(np.random.rand() if rng is None else rng.random())*2*np.pi
     x=radius*np.cos(theta)
     y=radius*np.sin(theta)
     vx=-v*np.sin(theta)
@@ -67,111 +229,782 @@ def randVals(radius,period):
     pos=np.array([x,y])
     vel=np.array([vx,vy])
     return pos,vel
-def orbitCalc(deltaT,Tmax,interaction,tStep=0.01):
+def orbitCalc(deltaT,Tmax,interaction,tStep=0.01,backend='direct',theta=0.5,nDisco=0,
+              nTest=0,testRange=(2,3.5),testDecim=10,testSave=True,
+              eps=0,rEnc=0,rCol=0,nSub=20,diag=None,writer=None,kernels=None):
+    #kernels: 'numba'/'numpy' para a soma directa das forças (ver aCalc e kernels.escolher)
+    size=int(Tmax/tStep)+1
+    nStep=int(tStep/deltaT)
     
+    planets=initialize(nDisco)
+    if nTest>0:
+        test=TestParticles(nTest,testRange[0],testRange[1],size,testDecim,testSave)
+    #O estado do sistema é guardado em arrays (N,2) e (N,)
+    pos,vel,m=planetsToArrays(planets)
+    rec=Sampler(planets,pos,vel,m,size,tStep,deltaT*nStep,eps,diag,writer)
+    #Índice do planeta correspondente a cada linha dos arrays (muda com as fusões)
+    idx=np.arange(m.size)
+    if interaction == 1 and backend == 'bh':
+        #Erro da força de Barnes-Hut em relação à soma directa numa amostra de corpos
+        med,maxi=bhError(pos,m,aCalcBH(pos,m,theta,eps),eps=eps)
+        print('Barnes-Hut (theta='+str(theta)+'): erro relativo da força mediano '+str(med)+', máximo '+str(maxi))
+    if rEnc==0:
+        #Sem encontros o número de corpos não muda e o passo de Euler-Cromer é o do módulo
+        #integradores, com as partículas de teste juntas ao estado dos corpos massivos
+        nM=m.size
+        X=np.concatenate((pos,test.coor)) if nTest>0 else pos
+        V=np.concatenate((vel,test.v)) if nTest>0 else vel
+        pos,vel=X[:nM],V[:nM]
+        if nTest>0:
+            test.coor,test.v=X[nM:],V[nM:]
+        if interaction == 1 and backend == 'bh':
+            force=lambda p:aCalcBH(p,m,theta,eps)
+        elif interaction == 1 :
+            force=lambda p:aCalc(p,m,eps,kernels)
+        else:
+            force=aCalcBasic
+        forceTest=(lambda q,p:aCalcTest(q,p,m,eps)) if interaction == 1 else (lambda q,p:aCalcBasic(q))
+        def aFun(x,out):
+            out[:nM]=force(x[:nM])
+            if nTest>0:
+                out[nM:]=forceTest(x[nM:],x[:nM])
+        def amostra(k,x,v):
+            rec.record(k,pos,vel,m,idx)
+            if nTest>0:
+                test.load(k-1)
+        #O integrador só guarda o último estado, as amostragens ficam no Sampler.
+        #Todos os corpos avançam ao mesmo tempo com as acelerações do início do passo;
+        #na versão original cada planeta era atualizado à vez e os seguintes já viam a
+        #sua nova posição, pelo que as trajectórias diferem ao nível do erro do método
+        #(e divergem com o tempo nas configurações caóticas)
+        ig.integrar(X,V,aFun,deltaT,nStep,size-1,'Euler-Cromer',amostra,np.zeros((1,)+X.shape),np.zeros((1,)+V.shape))
+    else:
+        for i in range(size-1):
+            step=0
+            while step<nStep:
+                pairs=np.zeros((0,2),dtype=np.int64)
+                if interaction == 1 and rEnc>0:
+                    pairs=encounterPairs(pos,rEnc)
+                    if rCol>0 and pairs.shape[0]>0:
+                        pos,vel,m,idx,merged=mergeCollisions(pos,vel,m,idx,pairs,rCol,planets,rec.t[i]+step*deltaT)
+                        if merged:
+                            pairs=encounterPairs(pos,rEnc)
+                if interaction == 1 and backend == 'bh':
+                    a=aCalcBH(pos,m,theta,eps)
+                elif interaction == 1 :
+                    a=aCalc(pos,m,eps,kernels)
+                else:
+                    a=aCalcBasic(pos)
+                if nTest>0:
+                    if interaction == 1 :
+                        aT=aCalcTest(test.coor,pos,m,eps)
+                    else:
+                        aT=aCalcBasic(test.coor)
+                    test.v+=aT*deltaT
+                    test.coor+=test.v*deltaT
+                if pairs.shape[0]>0:
+                    encounterStep(pos,vel,m,a,pairs,deltaT,nSub,eps)
+                else:
+                    vel+=a*deltaT #Actualização simultânea, como no ramo sem encontros
+                    pos+=vel*deltaT
+                step+=1
+            rec.record(i+1,pos,vel,m,idx)
+            if nTest>0:
+                test.load(i)
+    t=rec.close()
+    if nTest>0:
+        return planets,t,test
+    return planets,t
+
+def orbitCalcWH(deltaT,Tmax,tStep=0.01,blackHole=False,diag=None,writer=None,kernels=None):
+    #Mapa simplético de Wisdom-Holman em coordenadas heliocêntricas democráticas:
+    #cada passo é meio kick das interacções entre planetas, meio drift do Sol,
+    #drift kepleriano exacto à volta do corpo dominante, meio drift do Sol e meio kick.
+    #Só faz sentido com um corpo dominante (o buraco negro, com a massa do Sol, estraga isso)
+    #kernels: 'numba'/'numpy' para as forças e a equação de Kepler (ver kernels.escolher)
+    GM=4.*np.pi**2
     size=int(Tmax/tStep)+1
     nStep=int(tStep/deltaT)
     
-    planets,t=initialize(size)
-    eInit(planets)
+    planets=initialize(blackHole=blackHole)
+    pos,vel,m=planetsToArrays(planets)
+    rec=Sampler(planets,pos,vel,m,size,tStep,deltaT*nStep,diag=diag,writer=writer)
+    
+    c=np.argmax(m) #Corpo central
+    others=np.arange(m.size)!=c
+    mTot=m.sum()
+    m0=m[c]
+    mp=m[others]
+    rCM=(m[:,None]*pos).sum(axis=0)/mTot
+    vCM=(m[:,None]*vel).sum(axis=0)/mTot
+    #Posições heliocêntricas e velocidades baricêntricas dos planetas
+    Q=pos[others]-pos[c]
+    u=vel[others]-vCM
+    
     for i in range(size-1):
         step=0
         while step<nStep:
-            for p in range(planets.shape[0]):
-                if interaction == 1 :
-                    a=aCalc(planets[p],planets,p)
-                else:
-                    a=aCalcBasic(planets[p])
-                planets[p].v+=a*deltaT
-                planets[p].coor=planets[p].coor+planets[p].v*deltaT
-                planets[p].energy+=0.5*planets[p].m* (planets[p].v*planets[p].v).sum()
+            u+=0.5*deltaT*aCalc(Q,mp,0,kernels)
+            Q+=0.5*deltaT*(mp[:,None]*u).sum(axis=0)/m0
+            Q,u=kern.kepler(Q,u,deltaT,GM*m0,1e-13,kernels=kernels) #Drift kepleriano exacto (integradores, compilado com o Numba)
+            Q+=0.5*deltaT*(mp[:,None]*u).sum(axis=0)/m0
+            u+=0.5*deltaT*aCalc(Q,mp,0,kernels)
             step+=1
-        loadVnC(planets, i)
-        t[i+1]+=deltaT*nStep+t[i]
-    return planets,t
-            
-def eInit(pArray):
+        #Volta-se às coordenadas inerciais só nas amostragens
+        pos[c]=rCM+vCM*(rec.t[i]+rec.dtSample)-(mp[:,None]*Q).sum(axis=0)/mTot
+        pos[others]=Q+pos[c]
+        vel[others]=u+vCM
+        vel[c]=vCM-(mp[:,None]*u).sum(axis=0)/m0
+        rec.record(i+1,pos,vel,m)
+    return planets,rec.close()
+
+def orbitCalcBlock(deltaT,Tmax,tStep=0.01,eta=0.02,kMax=10,nDisco=0,blackHole=True,diag=None,writer=None):
+    #Passos individuais em blocos: cada corpo tem um passo tStep/2^k (k escolhido a partir
+    #da aceleração e do jerk) e só os corpos activos em cada instante recebem kicks.
+    #deltaT é o maior passo permitido; todos os corpos estão sincronizados em cada tStep.
+    #blackHole: inclui o buraco negro, como no orbitCalc (False dá só o sistema solar)
+    size=int(Tmax/tStep)+1
+    
+    planets=initialize(nDisco,blackHole)
+    pos,vel,m=planetsToArrays(planets)
+    rec=Sampler(planets,pos,vel,m,size,tStep,tStep,diag=diag,writer=writer)
+    
+    #O tempo é contado em ticks inteiros do menor passo possível
+    k0=max(0,int(np.ceil(np.log2(tStep/deltaT))))
+    maxTicks=2**kMax
+    nTicks=2**(k0+kMax)
+    dtMin=tStep/nTicks
+    
+    allBodies=np.arange(m.size)
+    a,j=ajCalc(pos,vel,m,allBodies)
+    stepT=blockSteps(a,j,eta,dtMin,maxTicks)
+    vel+=0.5*a*stepT[:,None]*dtMin
+    nForce=m.size
+    minStep=stepT.min()
+    
+    for i in range(size-1):
+        tick=0
+        while tick<nTicks:
+            #Drift de todos os corpos até ao próximo instante em que algum está activo
+            tNext=(((tick//stepT)+1)*stepT).min()
+            pos+=vel*(tNext-tick)*dtMin
+            tick=tNext
+            act=allBodies[tick%stepT==0]
+            a,j=ajCalc(pos,vel,m,act)
+            nForce+=act.size
+            vel[act]+=0.5*a*stepT[act,None]*dtMin
+            if tick==nTicks:
+                rec.record(i+1,pos,vel,m)
+            #Novo passo: só pode crescer para um passo que divida o instante actual
+            newStep=blockSteps(a,j,eta,dtMin,maxTicks)
+            stepT[act]=np.minimum(newStep,tick&-tick)
+            minStep=min(minStep,stepT[act].min())
+            vel[act]+=0.5*a*stepT[act,None]*dtMin
+    
+    #Comparação com um passo global igual ao menor passo usado
+    print('Avaliações de força: '+str(nForce)+' (com passo global: '+str(m.size*(size-1)*(nTicks//minStep))+')')
+    return planets,rec.close()
+
+def ajCalc(pos,vel,m,act):
+    #Aceleração e jerk dos corpos activos devidos a todos os corpos
     GM=4.*np.pi**2
-    for p in range(pArray.shape[0]):
-        for i in range(pArray.shape[0]-1):
-            r=pArray[p].coor-pArray[p-(i+1)].coor
-            rNorm=np.sqrt((r*r).sum())
-            energy=-GM*pArray[p].m*pArray[p-(i+1)].m/rNorm
-            energy+=0.5*pArray[p].m*(pArray[p].v*pArray[p].v).sum()
-            pArray[p].eList[0]=energy
-
-def aCalc(planet,pArray,p):
+    n=pos.shape[0]
+    a=np.zeros((act.size,2))
+    j=np.zeros((act.size,2))
+    bloco=blockSize(n)
+    for i0 in range(0,act.size,bloco):
+        i1=min(i0+bloco,act.size)
+        idx=act[i0:i1]
+        r=pos[idx,None,:]-pos[None,:,:]
+        vr=vel[idx,None,:]-vel[None,:,:]
+        r2=(r*r).sum(axis=2)
+        r2[np.arange(i1-i0),idx]=np.inf
+        w=m/(r2*np.sqrt(r2))
+        rv=3*(r*vr).sum(axis=2)/r2
+        a[i0:i1]=-GM*(r*w[:,:,None]).sum(axis=1)
+        j[i0:i1]=-GM*((vr-rv[:,:,None]*r)*w[:,:,None]).sum(axis=1)
+    return a,j
+
+def blockSteps(a,j,eta,dtMin,maxTicks):
+    #Critério dt = eta*|a|/|j| arredondado para baixo a uma potência de 2 de dtMin
+    aNorm=np.sqrt((a*a).sum(axis=1))
+    jNorm=np.sqrt((j*j).sum(axis=1))
+    dt=eta*np.divide(aNorm,jNorm,out=np.full(aNorm.shape,np.inf),where=jNorm>0)
+    k=np.floor(np.log2(np.maximum(dt/dtMin,1)))
+    return np.minimum(2**np.minimum(k,62).astype(np.int64),maxTicks)
+
+def planetsToArrays(planets):
+    pos=np.array([planet.coor for planet in planets],dtype=float)
+    vel=np.array([planet.v for planet in planets],dtype=float)
+    m=np.array([planet.m for planet in planets],dtype=float)
+    return pos,vel,m
+
+def initLists(planets,size,writer=None,tStep=0.01):
+    #Os rList/vList/eList de cada planeta passam a ser vistas de um array comum
+    #(ou, com um TrajectoryWriter, buffers que vão sendo escritos em disco; nesse
+    #caso também os tempos, e só os buffers do writer ficam na RAM).
+    n=planets.shape[0]
+    if writer is not None:
+        rList,vList,eList,t=writer.start(planets,size,tStep)
+        t[0]=0
+        for p in range(n):
+            rList[0,p]=planets[p].coor
+            vList[0,p]=planets[p].v
+        return rList,vList,eList,t
+    rList=np.zeros((size,n,2))
+    vList=np.zeros((size,n,2))
+    eList=np.zeros((size,n))
+    for p in range(n):
+        rList[0,p]=planets[p].coor
+        vList[0,p]=planets[p].v
+        planets[p].rList=rList[:,p]
+        planets[p].vList=vList[:,p]
+        planets[p].eList=eList[:,p]
+    return rList,vList,eList,np.zeros(size)
+
+class Sampler:
+    #Amostragens comuns a todos os integradores (orbitCalc, orbitCalcWH, orbitCalcBlock):
+    #listas dos planetas, tempos, energias, diagnósticos e escrita do TrajectoryWriter
+    def __init__(self,planets,pos,vel,m,size,tStep,dtSample,eps=0,diag=None,writer=None):
+        #dtSample: tempo que o integrador avança entre amostragens
+        self.planets=planets
+        self.dtSample=dtSample
+        self.eps=eps
+        self.diag=diag
+        self.writer=writer
+        self.rList,self.vList,self.eList,self.t=initLists(planets,size,writer,tStep)
+        self.eList[0]=eCalc(pos,vel,m,eps)
+        if diag is not None:
+            diag.start(size)
+            diag.record(0,pos,vel,m,eps)
+        if writer is not None:
+            writer.sampled(0,self.t[0])
+    def record(self,k,pos,vel,m,idx=None):
+        #Amostragem k (os planetas que já não estão em idx ficam a nan)
+        self.t[k]=self.t[k-1]+self.dtSample
+        loadVnC(self.rList,self.vList,self.eList,pos,vel,m,k-1,idx,self.eps,self.diag)
+        if self.writer is not None:
+            self.writer.sampled(k,self.t[k])
+    def close(self):
+        if self.writer is not None:
+            #Os tempos passam a ser lidos do disco, como as listas dos planetas
+            return self.writer.close(self.planets).t
+        return self.t
+
+def blockSize(n,maxPares=2**21):
+    #Número de corpos por bloco de modo a limitar a memória usada em cada bloco
+    return max(1,min(n,maxPares//max(n,1)))
+
+def aCalc(pos,m,eps=0,kernels=None,r2Min=None):
+    #eps: comprimento de suavização de Plummer
+    #r2Min: se dado, é actualizado com o menor r2 (+eps^2) de cada corpo, aproveitando os pares da força
+    #Com o Numba o ciclo sobre os pares é compilado (kernels.gravidade), sem os arrays (bloco,n,2)
+    if kern.escolher(kernels)=='numba':
+        return kern.gravidade(pos,m,eps,r2Min=r2Min)
     GM=4.*np.pi**2
+    n=pos.shape[0]
+    a=np.zeros_like(pos)
+    bloco=blockSize(n)
+    for i0 in range(0,n,bloco):
+        i1=min(i0+bloco,n)
+        r=pos[i0:i1,None,:]-pos[None,:,:]
+        r2=(r*r).sum(axis=2)+eps*eps
+        r2[np.arange(i1-i0),np.arange(i0,i1)]=np.inf #Um corpo não se atrai a si próprio
+        if r2Min is not None:
+            np.minimum(r2Min[i0:i1],r2.min(axis=1),out=r2Min[i0:i1])
+        w=m/(r2*np.sqrt(r2))
+        a[i0:i1]=-GM*(r*w[:,:,None]).sum(axis=1)
+    return a
 
-    a=0
-    for i in range(pArray.shape[0]-1):
-        r=planet.coor-pArray[p-(i+1)].coor
-        rNorm=np.sqrt((r*r).sum())
-        a += -GM* pArray[p-(i+1)].m * r / rNorm ** 3
-        planet.energy=-GM*planet.m*pArray[p-(i+1)].m/rNorm
+def bhTree(pos,m,maxLevel=20):
+    #Quadtree em arrays: para cada nível guardam-se as chaves das células ocupadas
+    #(ordenadas), a massa, o centro de massa, o número de corpos e a célula de cada corpo.
+    #Os níveis são construídos até cada célula ter um só corpo (ou até maxLevel)
+    lo=pos.min(axis=0)
+    side=(pos.max(axis=0)-lo).max()*1.0001
+    if side==0:
+        side=1.
+    ij=np.floor((pos-lo)/side*2**maxLevel).astype(np.int64)
+    ij=np.clip(ij,0,2**maxLevel-1)
+    levels=[]
+    for L in range(maxLevel+1):
+        c=ij>>(maxLevel-L)
+        keys,cell=np.unique(c[:,0]*2**L+c[:,1],return_inverse=True)
+        M=np.bincount(cell,weights=m,minlength=keys.size)
+        mx=np.bincount(cell,weights=m*pos[:,0],minlength=keys.size)
+        my=np.bincount(cell,weights=m*pos[:,1],minlength=keys.size)
+        com=np.divide(np.stack((mx,my),axis=1),M[:,None],out=np.zeros((keys.size,2)),where=M[:,None]>0)
+        count=np.bincount(cell,minlength=keys.size)
+        levels.append((keys,M,com,count,cell.ravel()))
+        if count.max()==1:
+            break
+    return levels,lo,side
+
+def aCalcBH(pos,m,theta=0.5,eps=0,maxPares=2**22):
+    GM=4.*np.pi**2
+    n=pos.shape[0]
+    levels,lo,side=bhTree(pos,m)
+    maxLevel=len(levels)-1
+    a=np.zeros_like(pos)
+    #Os corpos são percorridos em blocos para limitar o número de pares (corpo, célula)
+    bloco=max(1,maxPares//(64*(maxLevel+1)))
+    for i0 in range(0,n,bloco):
+        i1=min(i0+bloco,n)
+        body=np.arange(i0,i1)
+        cell=np.zeros(i1-i0,dtype=np.int64)
+        for L in range(maxLevel+1):
+            keys,M,com,count,bodyCell=levels[L]
+            h=side/2**L
+            own=bodyCell[body]==cell
+            Mc=M[cell]
+            d=com[cell]-pos[body]
+            if L==maxLevel:
+                #Folhas: a célula do próprio corpo conta sem ele
+                Mc=np.where(own,Mc-m[body],Mc)
+                cm=M[cell][:,None]*com[cell]-m[body][:,None]*pos[body]
+                d=np.where(own[:,None],np.divide(cm,Mc[:,None],out=np.zeros_like(cm),where=Mc[:,None]>0)-pos[body],d)
+                accept=Mc>0
+            else:
+                #Células com um só corpo são exactas e nunca precisam de ser abertas.
+                #A distância do critério é medida até ao bordo mais próximo da célula e não até
+                #ao centro de massa: uma célula assimétrica (massa longe do corpo) encostada ao
+                #corpo seria aceite como massa pontual e o erro da força não ficaria limitado
+                single=count[cell]==1
+                centre=lo+(np.stack((keys[cell]//2**L,keys[cell]%2**L),axis=1)+0.5)*h
+                e=np.maximum(np.abs(pos[body]-centre)-h/2,0)
+                accept=(~own)&(single|(h*h<theta*theta*(e*e).sum(axis=1)))
+            if accept.any():
+                da=d[accept]
+                r2=(da*da).sum(axis=1)+eps*eps
+                w=GM*Mc[accept]/(r2*np.sqrt(r2))
+                b=body[accept]-i0
+                a[i0:i1,0]+=np.bincount(b,weights=w*da[:,0],minlength=i1-i0)
+                a[i0:i1,1]+=np.bincount(b,weights=w*da[:,1],minlength=i1-i0)
+            if L==maxLevel:
+                break
+            #As células não aceites são abertas nos 4 filhos ocupados
+            keep=~(accept|(own&single))
+            body=body[keep]
+            cell=cell[keep]
+            if body.size==0:
+                break
+            cx=keys[cell]//2**L
+            cy=keys[cell]%2**L
+            childKeys=((2*cx[:,None]+np.array([0,0,1,1]))*2**(L+1)+2*cy[:,None]+np.array([0,1,0,1])).ravel()
+            nextKeys=levels[L+1][0]
+            idx=np.searchsorted(nextKeys,childKeys)
+            idx=np.minimum(idx,nextKeys.size-1)
+            found=nextKeys[idx]==childKeys
+            body=np.repeat(body,4)[found]
+            cell=idx[found]
     return a
 
-def aCalcBasic(planet):
+def bhError(pos,m,aBH,nSample=100,eps=0):
+    #Compara a aceleração de Barnes-Hut com a soma directa numa amostra de corpos
     GM=4.*np.pi**2
-    r=planet.coor
-    rNorm=np.sqrt((r*r).sum())
-    a = -GM*r/rNorm**3
+    n=pos.shape[0]
+    sample=np.random.choice(n,min(nSample,n),replace=False)
+    r=pos[sample,None,:]-pos[None,:,:]
+    r2=(r*r).sum(axis=2)+eps*eps
+    r2[np.arange(sample.size),sample]=np.inf
+    aD=-GM*(r*(m/(r2*np.sqrt(r2)))[:,:,None]).sum(axis=1)
+    erro=np.sqrt(((aBH[sample]-aD)**2).sum(axis=1)/(aD*aD).sum(axis=1))
+    return np.median(erro),erro.max()
+
+def bhCheck(n=2000,theta=0.5,tol=None,seed=0):
+    #Erro máximo (em todos os corpos, não só o mediano) de Barnes-Hut numa nuvem gaussiana e
+    #num disco uniforme. O erro de cada corpo é dividido pela soma dos módulos das forças de
+    #todos os pares, que não se anula como a força total no centro da distribuição.
+    #Devolve {distribuição: (erro máximo, erro máximo <= tol)}; por defeito tol=theta^2/8
+    tol=theta**2/8 if tol is None else tol
+    rng=np.random.default_rng(seed)
+    raio=np.sqrt(rng.random(n))
+    ang=2*np.pi*rng.random(n)
+    nuvens={'gaussiana':rng.normal(size=(n,2)),'disco':np.stack((raio*np.cos(ang),raio*np.sin(ang)),axis=1)}
+    m=np.full(n,1e-6)
+    testes={}
+    for nome,pos in nuvens.items():
+        r=pos[:,None,:]-pos[None,:,:]
+        r2=(r*r).sum(axis=2)
+        np.fill_diagonal(r2,np.inf)
+        escala=(4.*np.pi**2*m/r2).sum(axis=1)
+        erro=np.sqrt(((aCalcBH(pos,m,theta)-aCalc(pos,m,kernels='numpy'))**2).sum(axis=1))/escala
+        testes[nome]=(erro.max(),erro.max()<=tol)
+    return testes
+
+def aCalcTest(posT,pos,m,eps=0):
+    #Acelerações das partículas de teste devidas só aos corpos massivos (nTeste x nMassivos).
+    #Há poucos corpos massivos, por isso o ciclo é sobre eles e cada iteração é vectorial
+    #em todas as partículas
+    GM=4.*np.pi**2
+    x=posT[:,0]
+    y=posT[:,1]
+    a=np.zeros_like(posT)
+    for j in range(pos.shape[0]):
+        dx=x-pos[j,0]
+        dy=y-pos[j,1]
+        w=dx*dx+dy*dy+eps*eps
+        w*=np.sqrt(w)
+        np.divide(-GM*m[j],w,out=w)
+        a[:,0]+=w*dx
+        a[:,1]+=w*dy
     return a
 
-def loadVnC(pArray,i):
-    for p in range(pArray.shape[0]):
-        pArray[p].rList[i+1]=pArray[p].coor
-        pArray[p].vList[i+1]=pArray[p].v
-        pArray[p].eList[i+1]=pArray[p].energy
-    
-def initPlots(planets,ax):
-    size=planets.shape[0]
-    plots=np.zeros((size,4),dtype=object)
-    for i in range(size):
-        a, =ax.plot([],[],'o',color=planets[i].color,label=planets[i].name)
-        b, =ax.plot([],[],'-',color=planets[i].color)
-        datax=[]
-        datay=[]
-        plots[i]=np.array([a,b,datax,datay],dtype=object)
-        
-    return plots
-def makeAnimation2(i):
-    for j in range(p.shape[0]):
-        if i == 0 :
-            plots[j][2].clear
-            plots[j][3].clear
-        pos=p[j].rList
-        plots[j][2].append(pos[i,0])
-        plots[j][3].append(pos[i,1])
-        plots[j][1].set_data(plots[j][2],plots[j][3])
-        plots[j][0].set_data(pos[i,0],pos[i,1])
-        time_text.set_text(time_template % (t[i]))
-
-def makeFreqPlots(p,p0):
+def aCalcBasic(pos):
+    GM=4.*np.pi**2
+    r2=(pos*pos).sum(axis=1)
+    #Um corpo na origem (o Sol) não sente força
+    w=np.divide(1,r2*np.sqrt(r2),out=np.zeros_like(r2),where=r2>0)
+    a = -GM*pos*w[:,None]
+    return a
+
+def potCalc(pos,m,eps=0):
+    #Energia potencial de cada corpo com todos os outros, numa só passagem pelos pares
+    GM=4.*np.pi**2
+    n=pos.shape[0]
+    U=np.zeros(n)
+    bloco=blockSize(n)
+    for i0 in range(0,n,bloco):
+        i1=min(i0+bloco,n)
+        r=pos[i0:i1,None,:]-pos[None,:,:]
+        rNorm=np.sqrt((r*r).sum(axis=2)+eps*eps)
+        rNorm[np.arange(i1-i0),np.arange(i0,i1)]=np.inf
+        U[i0:i1]=-GM*m[i0:i1]*(m/rNorm).sum(axis=1)
+    return U
+
+def eCalc(pos,vel,m,eps=0,U=None):
+    #Energia cinética de cada corpo mais a energia potencial com todos os outros
+    if U is None:
+        U=potCalc(pos,m,eps)
+    return 0.5*m*(vel*vel).sum(axis=1)+U
+
+def diagnostics(pos,vel,m,eps=0,U=None):
+    #Energias cinética e potencial totais, momento linear e momento angular (z) do sistema
+    if U is None:
+        U=potCalc(pos,m,eps)
+    eKin=0.5*(m*(vel*vel).sum(axis=1)).sum()
+    ePot=0.5*U.sum() #Cada par aparece duas vezes em U
+    p=(m[:,None]*vel).sum(axis=0)
+    L=(m*(pos[:,0]*vel[:,1]-pos[:,1]*vel[:,0])).sum()
+    return eKin,ePot,p,L
+
+def loadVnC(rList,vList,eList,pos,vel,m,i,idx=None,eps=0,diag=None):
+    #idx: planetas ainda existentes (os que foram absorvidos ficam a nan)
+    U=potCalc(pos,m,eps)
+    if idx is None or idx.size==rList.shape[1]:
+        rList[i+1]=pos
+        vList[i+1]=vel
+        eList[i+1]=eCalc(pos,vel,m,eps,U)
+    else:
+        rList[i+1]=np.nan
+        vList[i+1]=np.nan
+        eList[i+1]=np.nan
+        rList[i+1,idx]=pos
+        vList[i+1,idx]=vel
+        eList[i+1,idx]=eCalc(pos,vel,m,eps,U)
+    if diag is not None:
+        diag.record(i+1,pos,vel,m,eps,U)
+
+def encounterPairs(pos,rEnc):
+    #Pares de corpos a menos de rEnc, com uma tabela de dispersão numa grelha uniforme
+    #de lado rEnc: só se comparam corpos na mesma célula ou em células vizinhas
+    cell=np.floor(pos/rEnc).astype(np.int64)
+    cell-=cell.min(axis=0)
+    ny=cell[:,1].max()+3
+    key=(cell[:,0]+1)*ny+cell[:,1]+1
+    order=np.argsort(key,kind='stable')
+    sortedKeys=key[order]
+    pairs=[]
+    #Só metade das células vizinhas, para não contar cada par duas vezes
+    for dx,dy in ((0,0),(1,-1),(1,0),(1,1),(0,1)):
+        target=key+dx*ny+dy
+        start=np.searchsorted(sortedKeys,target,side='left')
+        end=np.searchsorted(sortedKeys,target,side='right')
+        count=end-start
+        if count.sum()==0:
+            continue
+        i=np.repeat(np.arange(pos.shape[0]),count)
+        offset=np.arange(count.sum())-np.repeat(np.cumsum(count)-count,count)
+        j=order[np.repeat(start,count)+offset]
+        if dx==0 and dy==0:
+            keep=j>i
+            i=i[keep]
+            j=j[keep]
+        pairs.append(np.stack((i,j),axis=1))
+    if len(pairs)==0:
+        return np.zeros((0,2),dtype=np.int64)
+    pairs=np.concatenate(pairs)
+    d=pos[pairs[:,0]]-pos[pairs[:,1]]
+    return pairs[(d*d).sum(axis=1)<rEnc*rEnc]
+
+def encounterStep(pos,vel,m,a,pairs,deltaT,nSub,eps=0):
+    #Passo de Euler-Cromer em que a força mútua de cada par próximo é retirada do kick
+    #global e integrada com nSub sub-passos; os restantes corpos dão o passo normal
+    GM=4.*np.pi**2
+    i=pairs[:,0]
+    j=pairs[:,1]
+    d=pos[i]-pos[j]
+    r2=(d*d).sum(axis=1)+eps*eps
+    w=GM*d/(r2*np.sqrt(r2))[:,None]
+    np.add.at(a,i,m[j,None]*w)
+    np.add.at(a,j,-m[i,None]*w)
+    vel+=a*deltaT
+    inPair=np.zeros(m.size,dtype=bool)
+    inPair[i]=True
+    inPair[j]=True
+    pos[~inPair]+=vel[~inPair]*deltaT
+    h=deltaT/nSub
+    for s in range(nSub):
+        d=pos[i]-pos[j]
+        r2=(d*d).sum(axis=1)+eps*eps
+        w=GM*d/(r2*np.sqrt(r2))[:,None]
+        np.add.at(vel,i,-m[j,None]*w*h)
+        np.add.at(vel,j,m[i,None]*w*h)
+        pos[inPair]+=vel[inPair]*h
+
+def mergeCollisions(pos,vel,m,idx,pairs,rCol,planets,time):
+    #Funde os pares a menos de rCol conservando a massa e o momento linear;
+    #o corpo resultante fica com o nome do mais massivo
+    d=pos[pairs[:,0]]-pos[pairs[:,1]]
+    col=pairs[(d*d).sum(axis=1)<rCol*rCol]
+    if col.shape[0]==0:
+        return pos,vel,m,idx,False
+    alive=np.ones(m.size,dtype=bool)
+    for i,j in col:
+        if not (alive[i] and alive[j]):
+            continue
+        if m[j]>m[i]:
+            i,j=j,i
+        mTot=m[i]+m[j]
+        pos[i]=(m[i]*pos[i]+m[j]*pos[j])/mTot
+        vel[i]=(m[i]*vel[i]+m[j]*vel[j])/mTot
+        m[i]=mTot
+        planets[idx[i]].m=mTot
+        alive[j]=False
+        print('Colisão em t='+str(round(time,4))+': '+planets[idx[j]].name+' absorvido por '+planets[idx[i]].name)
+    return pos[alive],vel[alive],m[alive],idx[alive],True
+    
+class TrailAnimation:
+    #Animação com rastos de comprimento fixo: cada posição é escrita duas vezes num
+    #buffer circular de tamanho 2*trail (em k e k+trail), de modo que o rasto ordenado
+    #é sempre a vista buf[:,k+1:k+1+trail] sem cópias. As amostragens são dizimadas para
+    #fps imagens por segundo a speed anos de simulação por segundo
+    def __init__(self,fig,ax,planets,t,trail=200,fps=30,speed=1.):
+        self.fig=fig
+        self.planets=planets
+        self.t=t
+        self.fps=fps
+        self.trail=trail
+        step=max(1,int(round(speed/(fps*(t[1]-t[0])))))
+        self.frames=np.arange(0,t.size,step)
+        n=planets.shape[0]
+        self.buf=np.full((n,2*trail,2),np.nan)
+        self.points=[ax.plot([],[],'o',color=planet.color,label=planet.name)[0] for planet in planets]
+        self.lines=[ax.plot([],[],'-',color=planet.color)[0] for planet in planets]
+        self.text=ax.text(0.05,0.9,'',transform=ax.transAxes)
+    def init(self):
+        self.buf[:]=np.nan
+        for line in self.points+self.lines:
+            line.set_data([],[])
+        self.text.set_text('')
+        return self.points+self.lines+[self.text]
+    def update(self,f):
+        if f==0:
+            self.buf[:]=np.nan
+        i=self.frames[f]
+        k=f%self.trail
+        for j in range(self.planets.shape[0]):
+            pos=self.planets[j].rList[i]
+            self.buf[j,k]=pos
+            self.buf[j,k+self.trail]=pos
+            self.points[j].set_data([pos[0]],[pos[1]])
+        trail=self.buf[:,k+1:k+1+self.trail]
+        for j in range(self.planets.shape[0]):
+            self.lines[j].set_data(trail[j,:,0],trail[j,:,1])
+        self.text.set_text('%.2f years' % self.t[i])
+        return self.points+self.lines+[self.text]
+    def run(self):
+        self.ani=animation.FuncAnimation(self.fig,self.update,frames=self.frames.size,init_func=self.init,
+                                         interval=1000/self.fps,blit=True)
+        return self.ani
+    def save(self,filename,dpi=100):
+        #Exporta as imagens uma a uma para o ficheiro, sem as guardar em memória
+        if filename.endswith('.gif'):
+            writer=animation.PillowWriter(fps=self.fps)
+        else:
+            writer=animation.FFMpegWriter(fps=self.fps)
+        self.init()
+        with writer.saving(self.fig,filename,dpi):
+            for f in range(self.frames.size):
+                self.update(f)
+                writer.grab_frame()
+
+def ensembleRun(seed,deltaT,Tmax,tCheck=0.1,rEsc=50.,eps=0,kernels=None):
+    #Uma corrida do conjunto sem guardar trajectórias: devolve só o instante de ejecção
+    #de cada corpo (nan se não foi ejectado), a menor distância a outro corpo e os
+    #elementos orbitais finais (a, e) relativos ao Sol
+    from functools import partial
+    rng=np.random.default_rng(seed)
+    planets=initialize(rng=rng)
+    pos,vel,m=planetsToArrays(planets)
+    n=m.size
+    c=[planet.name for planet in planets].index('Sun')
+    tEject=np.full(n,np.nan)
+    r2Min=np.full(n,np.inf) #Actualizado pela força em todos os passos
+    nCheck=max(1,int(tCheck/deltaT))
+    nSteps=int(Tmax/deltaT)
+    passos=[0]
+    def aFun(x,out):
+        out[:]=aCalc(x,m,eps,kernels,r2Min)
+    def amostra(nPasso,k,x,v):
+        #Ejecções verificadas a cada nCheck passos (e no último); nPasso é o da chamada ao integrador
+        passos[0]+=nPasso
+        a,e,energy=orbitalElements(x,v,m,c)
+        ejected=(energy>0)&(np.sqrt(((x-x[c])**2).sum(axis=1))>rEsc)&np.isnan(tEject)
+        tEject[ejected]=passos[0]*deltaT
+    #Mesmo Euler-Cromer do orbitCalc (integradores), só com o último estado em memória
+    buf=ig.initBuffers('Euler-Cromer',pos,vel,aFun,deltaT)
+    for nPasso,nAmostras in ((nCheck,nSteps//nCheck),(nSteps%nCheck,1)):
+        if nPasso>0 and nAmostras>0:
+            ig.integrar(pos,vel,aFun,deltaT,nPasso,nAmostras,'Euler-Cromer',partial(amostra,nPasso),np.zeros((1,)+pos.shape),np.zeros((1,)+vel.shape),buf=buf)
+    a,e,energy=orbitalElements(pos,vel,m,c)
+    minSep=np.sqrt(np.maximum(r2Min-eps*eps,0))
+    return {'tEject':tEject,'minSep':minSep,'a':a,'e':e}
+
+def orbitalElements(pos,vel,m,c):
+    #Semi-eixo maior, excentricidade e energia específica de cada corpo em relação ao corpo c
+    GM=4.*np.pi**2
+    mu=GM*(m[c]+m)
+    r=pos-pos[c]
+    v=vel-vel[c]
+    rNorm=np.sqrt((r*r).sum(axis=1))
+    energy=np.full(m.size,np.nan)
+    ok=rNorm>0
+    energy[ok]=0.5*(v[ok]*v[ok]).sum(axis=1)-mu[ok]/rNorm[ok]
+    h=r[:,0]*v[:,1]-r[:,1]*v[:,0]
+    with np.errstate(divide='ignore',invalid='ignore'):
+        a=-mu/(2*energy)
+        e=np.sqrt(np.maximum(0,1+2*energy*h*h/mu**2))
+    return a,e,energy
+
+def ensemble(nRuns,deltaT,Tmax,seed=0,nWorkers=None,nT=200,**kwargs):
+    #Corre nRuns sementes independentes (SeedSequence.spawn) num conjunto de processos e
+    #agrega as ejecções em curvas de sobrevivência: fracção das corridas em que cada corpo
+    #ainda não foi ejectado no instante tGrid. Com nWorkers=1 corre tudo no processo
+    #actual; se os processos não estiverem disponíveis (p.ex. no Windows/Spyder, onde os
+    #processos novos não vêem estas funções) também, como a pool de threads do mola
+    import pickle
+    from concurrent.futures import ProcessPoolExecutor
+    from concurrent.futures.process import BrokenProcessPool
+    from functools import partial
+    seeds=np.random.SeedSequence(seed).spawn(nRuns)
+    run=partial(ensembleRun,deltaT=deltaT,Tmax=Tmax,**kwargs)
+    results=None
+    paralelo=nWorkers!=1
+    if paralelo:
+        #Os processos recebem a função e os argumentos por pickle: testa-se antes de começar
+        try:
+            pickle.dumps((run,seeds[0]))
+        except (pickle.PicklingError,AttributeError,TypeError):
+            paralelo=False
+    if paralelo:
+        try:
+            with ProcessPoolExecutor(nWorkers) as pool:
+                results=list(pool.map(run,seeds))
+        except (BrokenProcessPool,OSError,NotImplementedError):
+            #A pool já terminou todos os processos; as corridas são deterministas, repetem-se aqui
+            print('Processos indisponíveis: o conjunto corre no processo actual')
+    if results is None:
+        results=[run(s) for s in seeds]
+    outcomes={key:np.stack([res[key] for res in results]) for key in results[0]}
+    tGrid=np.linspace(0,Tmax,nT)
+    tEject=np.where(np.isnan(outcomes['tEject']),np.inf,outcomes['tEject'])
+    survival=(tEject[:,:,None]>tGrid[None,None,:]).mean(axis=0)
+    #Nomes com um gerador próprio, para não consumir o estado global do np.random.
+    #O Sol é a referência das ejecções (nunca é ejectado) e sai das curvas e dos resultados
+    names=[planet.name for planet in initialize(rng=np.random.default_rng(seed))]
+    keep=[j for j in range(len(names)) if names[j]!='Sun']
+    outcomes={key:val[:,keep] for key,val in outcomes.items()}
+    return [names[j] for j in keep],tGrid,survival[keep],outcomes
+
+def plotSurvival(names,tGrid,survival):
+    fig,ax=plt.subplots()
+    for j in range(len(names)):
+        ax.plot(tGrid,survival[j],label=names[j])
+    ax.set_xlabel('Tempo (anos)')
+    ax.set_ylabel('Fracção de corridas sem ejecção')
+    ax.legend()
+
+def spectra(x,dt,window='hann',nSeg=1):
+    #Espectro de potência de várias séries de uma vez: x tem forma (nCorpos, nAmostras).
+    #Com nSeg>1 usa-se o método de Welch (segmentos com 50% de sobreposição)
+    x=np.asarray(x,dtype=float)
+    x=x-x.mean(axis=1,keepdims=True)
+    n=x.shape[1]
+    segLen=n if nSeg<=1 else 2*n//(nSeg+1)
+    hop=max(1,segLen//2)
+    if window=='hann':
+        w=np.hanning(segLen)
+    elif window=='blackman':
+        w=np.blackman(segLen)
+    else:
+        w=np.ones(segLen)
+    segs=np.lib.stride_tricks.sliding_window_view(x,segLen,axis=1)[:,::hop]
+    X=np.fft.rfft(segs*w,axis=-1)
+    P=(np.abs(X)**2).mean(axis=1)/(w*w).sum()
+    freq=np.fft.rfftfreq(segLen,dt)
+    return freq,P
+
+def spectralPeaks(freq,P,nPeaks=3):
+    #Picos de cada espectro com interpolação parabólica do log da potência entre bins
+    lp=np.log(np.maximum(P,1e-300))
+    a=lp[:,:-2]
+    b=lp[:,1:-1]
+    c=lp[:,2:]
+    isPeak=(b>a)&(b>=c)
+    score=np.where(isPeak,b,-np.inf)
+    k=np.argsort(-score,axis=1)[:,:nPeaks]
+    rows=np.arange(P.shape[0])[:,None]
+    ak=a[rows,k]
+    bk=b[rows,k]
+    ck=c[rows,k]
+    den=ak-2*bk+ck
+    delta=np.divide(0.5*(ak-ck),den,out=np.zeros_like(den),where=den!=0)
+    df=freq[1]-freq[0]
+    fPeaks=freq[k+1]+delta*df
+    pPeaks=np.exp(bk-0.25*(ak-ck)*delta)
+    valid=np.isfinite(score[rows,k])
+    return np.where(valid,fPeaks,np.nan),np.where(valid,pPeaks,np.nan)
+
+def makeFreqPlots(p,p0,t,window='hann',nSeg=1):
+    dt=t[1]-t[0]
     figfreq=plt.figure()
     figfreq.suptitle('Frequências')
     figen=plt.figure()
     figen.suptitle('Energias')
+    nRows=(p.shape[0]+1)//2
     freqplots=np.zeros(p.shape[0],dtype=object)
     enplots=np.zeros(p.shape[0],dtype=object)
+    #Uma só rfft para as coordenadas x de todos os corpos das duas corridas
+    x=np.stack([planet.rList[:,0] for planet in p]+[planet.rList[:,0] for planet in p0])
+    freq,P=spectra(x,dt,window,nSeg)
+    fPeaks,pPeaks=spectralPeaks(freq,P)
     for i in range(p.shape[0]):
-        freqplots[i]=figfreq.add_subplot(4,2,i+1)
-        x=np.fft.rfftfreq(p[i].rList[:,0].shape[0],0.01)
-        y=abs(np.fft.rfft(p[i].rList[:,0]))
-        freqplots[i].plot(x,y)
-        x0=np.fft.rfftfreq(p0[i].rList[:,0].shape[0],0.01)
-        y0=abs(np.fft.rfft(p0[i].rList[:,0]))
-        freqplots[i].plot(x0,y0)
+        freqplots[i]=figfreq.add_subplot(nRows,2,i+1)
+        freqplots[i].plot(freq,P[i])
+        freqplots[i].plot(freq,P[p.shape[0]+i])
+        freqplots[i].plot(fPeaks[i],pPeaks[i],'x')
         freqplots[i].set_yscale('log')
         freqplots[i].set_xlim(0,20)
         freqplots[i].set_title(p[i].name)
         
-        enplots[i]=figen.add_subplot(4,2,i+1)
-        enplots[i].plot(p[i].eList)
+        enplots[i]=figen.add_subplot(nRows,2,i+1)
+        enplots[i].plot(t,p[i].eList)
         enplots[i].set_title(p[i].name)
 
     figfreq.tight_layout()
     figen.tight_layout()
+    return fPeaks
             
 
             
@@ -184,20 +1017,19 @@ ax.set_aspect('equal')
 
     
     
-p,t=orbitCalc(0.001, 50,1)
+diag=Diagnostics()
+p,t=orbitCalc(0.001, 50,1,diag=diag)
+diag.report()
 p0,tlixo=orbitCalc(0.001,50,0)
-time_template = '%.2f years'
-time_text = ax.text(0.05, 0.9, '', transform=ax.transAxes)
-plots=initPlots(p,ax)
+trails=TrailAnimation(fig,ax,p,t,trail=300,fps=30,speed=1.)
 
 plt.legend()
 rt=p[0].rList
 
-makeFreqPlots(p, p0)
+makeFreqPlots(p, p0, t)
 
-t0=t/t[1]
-t0=t0.astype(int)
-ani=animation.FuncAnimation(fig, makeAnimation2,frames=t0, interval=.1)
+ani=trails.run()
+#trails.save('orbitas.mp4')
 
 
 
@@ -26,6 +26,10 @@ import matplotlib.animation as animation
 import random
 import copy
 import time
+import os
+import sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import kernels as kern
 #import multiprocessing as mp
 
 st = time.time()
@@ -297,6 +301,56 @@ def iteration(tudo):
         tudo[1].append(tudo[4][i])
     tudo[4].clear()
 
+#%%
+
+'''A classe RedeArrays contém o estado de uma simulação em arrays, para o backend compilado dos turnos (ver kernels.turno): o tipo e o nível de cada célula e as posições de cada tipo de ser vivo. É este o estado entre iterações; a rede de Bichos só é reconstruída no fim (toObjects). As ordens aleatórias são geradas pelo numpy em vez do módulo random.
+    turn: "joga" o turno de um tipo de ser vivo, com as regras de turn
+    iteration: faz uma iteração da rede, como iteration
+    stats: guarda as estatísticas e a rede de tipos da iteração, como stats e ecosystems
+    toObjects: escreve o estado final na rede de Bichos e nas listas de tudo'''
+
+class RedeArrays:
+    def __init__(self, tudo, kernels = None):
+        grid = tudo[0]
+        self.typ = np.array([[grid[i, j].type for j in range(grid.shape[1])] for i in range(grid.shape[0])])
+        self.siz = np.array([[grid[i, j].size for j in range(grid.shape[1])] for i in range(grid.shape[0])])
+        self.listas = [np.array(lista, dtype = np.int64).reshape(-1, 2) for lista in (tudo[4], tudo[1], tudo[2], tudo[3])] #Pela ordem dos tipos
+        self.buffers = kern.turnoBuffers(grid.shape[0], grid.shape[1]) #Alocados uma única vez
+        self.kernels = kernels
+    
+    def turn(self, bichoType):
+        self.listas = kern.turno(self.typ, self.siz, self.listas, bichoType, self.kernels, self.buffers)
+    
+    def iteration(self):
+        self.turn(2)
+        self.turn(3)
+        self.listas[2] = np.random.permutation(self.listas[2])
+        self.listas[3] = np.random.permutation(self.listas[3])
+        
+        plantas = self.listas[1] #As plantas crescem todas
+        self.siz[plantas[:, 0], plantas[:, 1]] = np.minimum(self.siz[plantas[:, 0], plantas[:, 1]] + 1, 2)
+        vazias = self.listas[0] #E nascem nas células vazias
+        self.typ[vazias[:, 0], vazias[:, 1]] = 1
+        self.siz[vazias[:, 0], vazias[:, 1]] = 0
+        self.listas[1] = np.concatenate((plantas, vazias))
+        self.listas[0] = vazias[:0]
+    
+    def stats(self, tudo, iteration, nx, ny):
+        tudo[11].append(self.typ.astype(float)) #Já é a rede de tipos que ecosystems guarda
+        for c in range(1, 4):
+            lista = self.listas[c]
+            tudo[4 + c][iteration] = len(lista)/(nx * ny) * 100
+            tudo[7 + c][iteration] = np.bincount(self.siz[lista[:, 0], lista[:, 1]], minlength = 3)/len(lista) * 100
+    
+    def toObjects(self, tudo):
+        grid = tudo[0]
+        for i in range(grid.shape[0]):
+            for j in range(grid.shape[1]):
+                grid[i, j].type = int(self.typ[i, j])
+                grid[i, j].size = int(self.siz[i, j])
+        for lista, nova in zip((tudo[4], tudo[1], tudo[2], tudo[3]), self.listas):
+            lista[:] = nova.tolist()
+
 #%%
 
     '''Esta função conta, para um determinado ser vivo, o número de indivíduos de cada nível.
@@ -421,11 +475,22 @@ def ecosystems(tudo, nx, ny, nIterations):
     nx: número de linhas da rede
     ny: número de colunas da rede
     nIterations: número de iterações a ser executadas por simulação
+    kernels: 'numba' para as iterações em RedeArrays, 'numpy' para a rede de Bichos em Python (por defeito, ver kernels.escolher)
     Return: tuples com as informações relativas às duas simulações e listas com cópias da rede após cada iteração'''
 
-def circleOfLife(nx, ny, nIterations, p1, p2, p3):
+def circleOfLife(nx, ny, nIterations, p1, p2, p3, kernels = None):
     #Simulação com carnívoros
     tudo = initGrid(nx, ny, p1, p2, p3, nIterations)
+    
+    if kern.escolher(kernels) == 'numba':
+        rede = RedeArrays(tudo, kernels)
+        rede.stats(tudo, 0, nx, ny)
+        for i in range(nIterations):
+            rede.iteration()
+            rede.stats(tudo, i + 1, nx, ny)
+        rede.toObjects(tudo)
+        return tudo
+    
     stats(tudo, 0, nx, ny)
             
     for i in range(nIterations):
@@ -439,15 +504,37 @@ def circleOfLife(nx, ny, nIterations, p1, p2, p3):
 #%%
 
 
-def simulations(nx, ny, nIterations):
+def simulations(nx, ny, nIterations, kernels = None):
     
-    tudo = circleOfLife(nx, ny, nIterations, 9, 3, 1)
-    tudo2 = circleOfLife(nx, ny, nIterations, 9, 3, 0)
+    tudo = circleOfLife(nx, ny, nIterations, 9, 3, 1, kernels)
+    tudo2 = circleOfLife(nx, ny, nIterations, 9, 3, 0, kernels)
     
     drawGraphs(tudo, tudo2)
     
     return tudo, tudo2
 
+#%%
+
+    '''Compara as populações médias obtidas com os dois backends dos turnos (ciclo em Python e kernel compilado), em várias simulações independentes. As sementes são diferentes em cada backend, por isso só se comparam as estatísticas.
+    nx, ny: dimensões da rede
+    nIterations: número de iterações por simulação
+    nSeeds: número de simulações por backend
+    tol: diferença máxima entre as médias, em erros padrão
+    Return: True se as populações médias de plantas, herbívoros e carnívoros coincidirem'''
+
+def compararBackends(nx = 30, ny = 30, nIterations = 50, nSeeds = 8, tol = 4):
+    def populacoes(kernels, s):
+        random.seed(s + (kernels == 'numba') * nSeeds)
+        np.random.seed(s + (kernels == 'numba') * nSeeds)
+        tudo = circleOfLife(nx, ny, nIterations, 9, 3, 1, kernels)
+        return tudo[5].mean(), tudo[6].mean(), tudo[7].mean()
+    
+    d, ok = kern.compararMedias(populacoes, nSeeds, tol)
+    for nome, di in zip(('Plantas', 'Herbívoros', 'Carnívoros'), d):
+        print(nome + ': diferença de ' + str(round(di, 2)) + ' erros padrão')
+    
+    return bool(np.all(ok))
+
 #%%
 
 tudo, tudo2 = simulations(50, 50, 500)
@@ -2,7 +2,10 @@
 %matplotlib qt
 import numpy as np
 import os
+import sys
 import matplotlib.pyplot as plt
+sys.path.insert(0,os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import kernels as kern
 tipo = float
 
 class GridDot:
@@ -108,6 +111,15 @@ def runCycleRnd(dots,t,h):
         delta=deltaCalc(dots,allPos[z][0],allPos[z][1])
         deltaE=enVar(dots,delta,h,allPos[z][0],allPos[z][1])
         flipper(dots,allPos[z][0],allPos[z][1],deltaE,delta,t,h)
+
+def runCycleArr(state,t,h,kernels=None):
+    #O mesmo ciclo que runCycleRnd sobre o array dos estados, compilado se houver Numba
+    #(kernels='numba'/'numpy', ver kernels.metropolis)
+    kern.metropolis(state,t,h,kernels)
+
+def enCalcArr(state,h):
+    delta=np.roll(state,1,0)+np.roll(state,-1,0)+np.roll(state,1,1)+np.roll(state,-1,1)
+    return -state*(delta+2*h)
             
 def dataPlots(enMed,state0,state,avg,std):
 
@@ -147,12 +159,13 @@ def enCalc(dots,h):
             E=-dots[i][j].state*(deltaCalc(dots,i,j)+2*h)
             dots[i][j].newEn(E)
     
-def ferroMag(nx,ny,N,t,h):
+def ferroMag(nx,ny,N,t,h,kernels=None):
     dots=initGrid2(nx,ny)
     enCalc(dots,0)
     en0=getValEn(dots)
     #print(getValEn(dots))
     state0=getValState(dots)
+    state=state0.copy()
     enMed=np.zeros(N+1)
     std=np.zeros(N+1)
     avg=np.zeros(N+1)
@@ -161,10 +174,8 @@ def ferroMag(nx,ny,N,t,h):
     std[0]=np.std(state0)
     for i in range(N):
         i+=1
-        runCycleRnd(dots, t,h)
-        enCalc(dots,h)
-        state=getValState(dots)
-        enCurrent=getValEn(dots)
+        runCycleArr(state,t,h,kernels)
+        enCurrent=enCalcArr(state,h)
         enMed[i]=0.5*np.average(enCurrent)
         avg[i]=np.average(state)
         std[i]=np.std(state)
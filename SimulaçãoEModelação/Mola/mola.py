@@ -9,58 +9,83 @@ Objetivo de Programação:
 import numpy as np
 import matplotlib.pyplot as plt
 import scipy.fft as sc
+import scipy.linalg as la
+import scipy.sparse as sp
 import matplotlib.animation as animation
-import copy
+from matplotlib.collections import LineCollection
 from matplotlib.widgets import Slider, Button, RangeSlider, TextBox, CheckButtons, RadioButtons
+import os
 import sys
+import json
+import csv
+import hashlib
+from collections import OrderedDict
 import time as ti
+import multiprocessing as mp
+import pickle
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__)))) # Pasta com os módulos partilhados
+import integradores as ig
+import kernels as kern
 
 #%%
 
 class Body:                 #   Cada corpo possui associado a si uma mola à esquerda
-    def __init__(self, mass, k, xEq, x0, v0, size):
+    def __init__(self, mass, k, xEq, x, v, xList, vList):
         self.mass = mass    #   Massa do corpo
         self.k = k          #   Constante de mola associada ao corpo
         self.xEq = xEq      #   Distância de equilíbrio da mola associada ao corpo
-        self.x = x0         #   Posição instantânea
-        self.v = v0         #   Velocidade instantânea
-        
-        self.xList = np.zeros(size) # Vetor da amostragens das posições
-        self.vList = np.zeros(size) # Vetor da amostragens das velocidades
+        self.x = x          #   Posição instantânea
+        self.v = v          #   Velocidade instantânea
         
-        self.xList[0] = x0          # Guarda-se a posição inicial
-        self.vList[0] = v0          # Guarda-se a posição inicial
+        self.xList = xList  # Vetor da amostragens das posições (vista de uma coluna da matriz de todos os corpos)
+        self.vList = vList  # Vetor da amostragens das velocidades
         
    
 #%%
 
-def initSimul(Tmax, dt, tSample, sArray, alg = 'CromerRK4'):
+def initSimul(Tmax, dt, tSample, sArray, store = True):
     
     size = int(Tmax/tSample)    # Calcula o número de amostragens que serão feitas
     saveSteps = int(tSample/dt) # Calcula o número de passos realizados até ocorrer amostragem
-    n = len(sArray)             # Número de corpos/molas no sistema
-    
-    springs = np.zeros(n, dtype = object) # Inicializa o array que vai conter os objetos
-    sForce = np.zeros(n + 1, dtype = float) # Inicializa o array que irá conter as forças exercidas por cada mola
-    sAcce = np.zeros(n, dtype = float) # Inicializa o array que irá conter as acelerações sentidas por cada corpo
-    sAcce1 = np.zeros(n, dtype = float)
-    sAcce2 = np.zeros(n, dtype = float)
-    xLast = np.zeros(n, dtype = float)
-    xPos = np.zeros(n, dtype = float)
+    sArray = np.asarray(sArray, dtype = float) # (n, 5), ou (B, n, 5) para B cadeias em simultâneo
+    n = sArray.shape[-2]        # Número de corpos/molas no sistema
+    
+    m = sArray[..., 0].copy()     # Massas dos corpos
+    k = sArray[..., 1].copy()     # Constantes das molas
+    xEq = sArray[..., 2].copy()   # Distâncias de equilíbrio das molas
+    x = sArray[..., 3].copy()     # Posições instantâneas
+    v = sArray[..., 4].copy()     # Velocidades instantâneas
+    
     time = np.zeros(size + 1, dtype = float) # Inicializa o array que irá conter o tempo de cada amostragem. Será útil nas FFTs.
-    energy = np.zeros(size + 1, dtype = float) # Inicializa o array que irá conter as energias do sistema a cada amostragem.
+    energy = np.zeros((size + 1,) + x.shape[:-1], dtype = float) # Inicializa o array que irá conter as energias do sistema a cada amostragem.
+    rows = size + 1 if store else 1 # Sem armazenamento guarda-se apenas o estado mais recente
+    xList = np.zeros((rows,) + x.shape, dtype = float) # Matriz das posições amostradas (uma coluna por corpo)
+    vList = np.zeros((rows,) + x.shape, dtype = float) # Matriz das velocidades amostradas
+    xList[0] = x
+    vList[0] = v
     
-    if alg == 'Verlet':
-        return size, saveSteps, n, springs, sForce, sAcce, time, energy, xLast, xPos
-    elif alg == 'Beeman':
-        return size, saveSteps, n, springs, sForce, sAcce, sAcce1, sAcce2, time, energy
-    else:
-        return size, saveSteps, n, springs, sForce, sAcce, time, energy
+    return size, saveSteps, n, x, v, m, k, xEq, time, energy, xList, vList
     
+#%%
+
+def makeBodies(m, k, xEq, x, v, xList, vList):
+    """
+    Função
+    ---------
+    Cria os objetos Body devolvidos pelas simulações, cujos xList/vList são vistas das colunas das matrizes de amostragens
+    """
+    n = m.size
+    springs = np.zeros(n, dtype = object)
+    for i in range(n):
+        springs[i] = Body(m[i], k[i], xEq[i], x[i], v[i], xList[:, i], vList[:, i])
+    return springs
 
 #%%
 
-def energyCalc(springs):
+def energyCalc(x, v, m, k, xEq):
     """
     Função
     ---------
@@ -68,41 +93,36 @@ def energyCalc(springs):
 
     Parameters
     ----------
-    springs : Array de objetos
-        Array onde tem as várias molas/corpos do sistema
+    x, v : Arrays de floats
+        Posições e velocidades de cada corpo (o último eixo percorre os corpos)
+    m, k, xEq : Arrays de floats
+        Massas, constantes e distâncias de equilíbrio das molas
 
     Returns
     -------
     energy : float
         Energia total do sistema.
     """
-    n = springs.size
-    energy = 0
+    ext = np.diff(x, axis = -1, prepend = 0) - xEq # Na mola da esquerda, a posição do corpo já é a distância total.
     
-    for i in range(n):
-        if i == 0: # Neste caso na mola da esquerda, a posição do corpo já é a distância total.
-            energy += 0.5 * springs[i].mass * springs[i].v ** 2 + 0.5 * springs[i].k * (springs[i].x - springs[i].xEq) ** 2
-        else:               
-            energy += 0.5 * springs[i].mass * springs[i].v ** 2 + 0.5 * springs[i].k * (springs[i].x - springs[i - 1].x - springs[i].xEq) ** 2
-    
-    return energy
+    return 0.5 * (m * v ** 2).sum(axis = -1) + 0.5 * (k * ext ** 2).sum(axis = -1)
         
 #%%
         
-def acceCalc(springs, sSize, sForce, sAcce): 
+def acceCalc(x, k, xEq, m, sForce, sAcce): 
     """
     Função:
     ---------
-    Calcula as forças e acelerações para todos os corpos do sistema.
+    Calcula as forças e acelerações para todos os corpos do sistema, sem ciclos nem alocações.
     
     Parameters
     ----------
-    springs : Array de objetos
-        Array com as várias molas/corpos do sistema
-    sSize : Int
-        Indicador do número de molas/corpos
+    x : Array de floats
+        Posições dos corpos (o último eixo percorre os corpos)
+    k, xEq, m : Arrays de floats
+        Constantes, distâncias de equilíbrio das molas e massas dos corpos
     sForce : Array de floats
-        Array de Forças sentidas exercidas pelo corpo da esquerda
+        Array de Forças exercidas por cada mola (tamanho n + 1, a última é sempre 0)
     sAcce : Array de floats
         Array com as acelerações sentidas por cada corpo. Necessário para o cálculo do próximo passo
         
@@ -110,528 +130,1375 @@ def acceCalc(springs, sSize, sForce, sAcce):
     -------
     Não retorna nada. Apenas modifica Arrays já existentes.
     """
-    for i in range(sSize): # Calcula-se a força que cada mola está a exercer
-        if i == 0:
-            sForce[i] = springs[i].k * (springs[i].x - springs[i].xEq)
-        else:
-            sForce[i] = springs[i].k * (springs[i].x - springs[i - 1].x - springs[i].xEq)
-            
-    for i in range(sSize): # Somam-se as forças da mola da esquerda e da direita para cada corpo e calcula-se a aceleração dividindo pela massa do corpo
-        sAcce[i] = - sForce[i] / springs[i].mass + sForce[i + 1] / springs[i].mass
+    np.subtract(x[..., 1:], x[..., :-1], out = sForce[..., 1:-1]) # Extensão de cada mola
+    sForce[..., 0] = x[..., 0]
+    sForce[..., :-1] -= xEq
+    sForce[..., :-1] *= k
+    np.subtract(sForce[..., 1:], sForce[..., :-1], out = sAcce) # Força da mola da direita menos a da esquerda
+    sAcce /= m
+        
+#%%
+
+def chainAcce(k, xEq, m):
+    """
+    Função:
+    ---------
+    Cria a função de aceleração da cadeia de molas, aFun(x, out), usada pelos integradores
+
+    Returns
+    -------
+    aFun : Função
+        Escreve em out as acelerações para as posições x
+    """
+    sForce = np.zeros(k.shape[:-1] + (k.shape[-1] + 1,), dtype = float)
+    
+    def aFun(x, out):
+        acceCalc(x, k, xEq, m, sForce, out)
         
+    return aFun
+
 #%%
+
+bandCache = {} # Fatorizações de Cholesky já calculadas, indexadas pelas massas, constantes e dt
+
+def midpointFactor(m, k, dt):
+    """
+    Função:
+    ---------
+    Fatoriza (Cholesky em banda) a matriz tridiagonal M + dt^2/4 K do Ponto Médio implícito.
+    A fatorização é feita uma única vez por configuração e reutilizada em todos os passos.
+
+    Returns
+    -------
+    cf : Array 2D de floats
+        Fator de Cholesky na forma em banda (superior) de scipy.linalg.cholesky_banded
+    """
+    key = (m.tobytes(), k.tobytes(), float(dt))
+    
+    if key not in bandCache:
+        c = dt * dt / 4
+        ab = np.zeros((2, m.size), dtype = float)
+        ab[1] = m + c * (k + np.append(k[1:], 0)) # Diagonal
+        ab[0, 1:] = -c * k[1:] # Diagonal superior
+        bandCache[key] = la.cholesky_banded(ab)
         
-def acceCalcRK4(springs, sSize, sForce, sAcce, dx):
+    return bandCache[key]
+
+#%%
+
+def midpointSolve(cf, rhs):
+    """
+    Função:
+    ---------
+    Resolve o sistema do Ponto Médio com a fatorização já calculada. O último eixo de rhs percorre os corpos;
+    se cf for 3D (várias cadeias), contém a inversa da matriz de cada cadeia.
+    """
+    if cf.ndim == 3:
+        return np.matmul(cf, rhs[..., None])[..., 0]
+    
+    return la.cho_solve_banded((cf, False), rhs.T).T
+
+#%%
+
+def springCalcMidpoint(x, v, aFun, buf, saveSteps, dt):
     """
     Função:
     ---------
-    Calcula as forças e acelerações para todos os corpos do sistema nos passos intermédios do RK4
+    Calcula as novas posições e velocidades para cada mola com o método do Ponto Médio implícito.
+    Para a cadeia (linear) cada passo é a solução de (M + dt^2/4 K) u1 = M (u0 + dt v0 + dt^2/4 a0),
+    com u o deslocamento em relação ao equilíbrio. É estável para qualquer dt e conserva a energia,
+    pelo que dt pode ser escolhido pelos modos lentos de interesse e não pelo mais rápido.
 
     Parameters
     ----------
+    x, v : Arrays de floats
+        Posições e velocidades instantâneas, atualizadas no lugar
+    aFun : Função
+        Função de aceleração aFun(x, out)
+    buf : Lista de arrays
+        [a, u, rhs, xRest, m, cf], criada por midpointBuffers
+    saveSteps : Int
+        Número de passos que devem ser executados até se guardar os dados para amostragem.
+    dt : float
+        Tempo entre passos
+
+    Returns
+    -------
+    Nada. Apenas atualiza as coordenadas e velocidades instantâneas para cada corpo
+    """
+    a, u, rhs, xRest, m, cf = buf
+    passo = 0
+    
+    while passo < saveSteps:
+        aFun(x, a)
+        np.subtract(x, xRest, out = u)
+        np.multiply(a, dt * dt / 4, out = rhs) # Lado direito: M (u0 + dt v0 + dt^2/4 a0)
+        np.multiply(v, dt, out = a)
+        rhs += a
+        rhs += u
+        rhs *= m
+        u1 = midpointSolve(cf, rhs)
+        np.subtract(u1, u, out = a) # v1 = 2 (u1 - u0) / dt - v0
+        a *= 2 / dt
+        np.subtract(a, v, out = v)
+        np.add(u1, xRest, out = x)
+        passo += 1
+
+#%%
+
+def midpointBuffers(x, v, aFun, dt, chain):
+    """
+    Função:
+    ---------
+    Cria os arrays auxiliares do Ponto Médio para a cadeia (m, k, xEq): [a, u, rhs, xRest, m, cf]
+    """
+    m, k, xEq = chain
+    if m.ndim == 1:
+        cf = midpointFactor(m, k, dt)
+    else: # Várias cadeias: guarda-se a inversa de cada uma, aplicada a todas com um único produto
+        eye = np.eye(m.shape[-1])
+        cf = np.stack([la.cho_solve_banded((midpointFactor(m[b], k[b], dt), False), eye) for b in range(m.shape[0])])
+    return [np.zeros_like(x), np.zeros_like(x), np.zeros_like(x), np.cumsum(xEq, axis = -1), m, cf]
+
+ig.registar('Ponto Médio', springCalcMidpoint, midpointBuffers)
+
+#%%
+
+def springCalcRK4Jit(x, v, aFun, buf, saveSteps, dt):
+    """
+    Função:
+    ---------
+    RK4 da cadeia compilado com o Numba (kernels.rk4Cadeia): a aceleração é calculada dentro do mesmo ciclo,
+    corpo a corpo, em vez de chamar aFun. Usado por chainIntegrate no lugar de 'RK4' quando o backend é 'numba'.
+
+    Parameters
+    ----------
+    buf : Lista de arrays
+        [x, v, m, k, xEq] como arrays (B, n), criada por rk4JitBuffers (x e v são vistas do estado)
+    Restantes: ver springCalcMidpoint
+    """
+    x2, v2, m, k, xEq = buf
+    kern.rk4Cadeia(x2, v2, m, k, xEq, saveSteps, dt)
+
+def rk4JitBuffers(x, v, aFun, dt, chain):
+    """
+    Função:
+    ---------
+    Prepara o estado e a cadeia (m, k, xEq) como arrays contíguos (B, n) para springCalcRK4Jit
+    """
+    forma = (-1, x.shape[-1])
+    return [x.reshape(forma), v.reshape(forma)] + [np.ascontiguousarray(np.broadcast_to(c, x.shape)).reshape(forma) for c in chain]
+
+ig.registar('RK4 (numba)', springCalcRK4Jit, rk4JitBuffers)
+springCalc = ig.steppers # Integradores da cadeia: os de integradores.py, o Ponto Médio e o RK4 compilado
+
+#%%
+
+
+class ModeTracker:           #   Banco de filtros de Goertzel para seguir as frequências dos modos durante a simulação
+    def __init__(self, freqs, tSample, xRest, largura = 0.05, nZoom = 21):
+        self.freqs = np.asarray(freqs, dtype = float) #   Frequências esperadas dos modos (Hz)
+        self.nZoom = nZoom
+        self.grid = (self.freqs[:, None] + largura * np.linspace(-1, 1, nZoom)).ravel() #   Frequências de cada filtro, zoom à volta de cada modo
+        self.step = 2 * largura / (nZoom - 1)
+        self.w = 2 * np.pi * self.grid * tSample   #   Frequência de cada filtro em rad/amostra
+        self.coef = 2 * np.cos(self.w)
+        self.xRest = np.asarray(xRest, dtype = float) #   As oscilações são medidas em relação ao equilíbrio
+        
+        shape = (self.xRest.size, self.grid.size) #   Um filtro por corpo e por frequência
+        self.s1 = np.zeros(shape)
+        self.s2 = np.zeros(shape)
+        self.tmp = np.zeros(shape)
+        self.u = np.zeros(self.xRest.size)
+        self.N = 0 #   Número de amostras já processadas
+        
+    def update(self, x):
+        # Recorrência de Goertzel: s[n] = u[n] + 2 cos(w) s[n-1] - s[n-2], sem alocações
+        np.subtract(x, self.xRest, out = self.u)
+        np.multiply(self.s1, self.coef, out = self.tmp)
+        self.tmp -= self.s2
+        self.tmp += self.u[:, None]
+        self.s1, self.s2, self.tmp = self.tmp, self.s1, self.s2
+        self.N += 1
+        
+    def spectrum(self):
+        # Amplitude de cada filtro até agora: 2 |s[n] - exp(-i w) s[n-1]| / N
+        return 2 * np.abs(self.s1 - np.exp(-1j * self.w) * self.s2) / max(self.N, 1)
+    
+    def report(self):
+        """
+        Estimativa atual das frequências dos modos e das amplitudes de cada corpo em cada modo.
+        Pode ser chamada a meio da simulação.
+
+        Returns
+        -------
+        freqs : Array de floats
+            Frequência de cada modo (Hz), com interpolação parabólica à volta do máximo do zoom
+        amps : Array 2D de floats
+            Amplitude de cada corpo (linhas) em cada modo (colunas)
+        """
+        mag = self.spectrum().reshape(-1, self.freqs.size, self.nZoom)
+        total = (mag ** 2).sum(axis = 0) # Potência somada em todos os corpos
+        j = np.clip(total.argmax(axis = 1), 1, self.nZoom - 2)
+        modo = np.arange(self.freqs.size)
+        a, b, c = total[modo, j - 1], total[modo, j], total[modo, j + 1]
+        den = a - 2 * b + c
+        desvio = np.where(den != 0, 0.5 * (a - c) / np.where(den != 0, den, 1), 0)
+        freqs = self.grid.reshape(self.freqs.size, self.nZoom)[modo, j] + np.clip(desvio, -1, 1) * self.step
+        
+        return freqs, mag[:, modo, j]
+
+#%%
+
+def chainTracker(sArray, tSample, largura = 0.05, nZoom = 21):
+    """
+    Função:
+    ---------
+    Cria um ModeTracker para a cadeia, centrado nas frequências exatas dos modos normais (normalModes)
+    """
+    sArray = np.asarray(sArray, dtype = float)
+    w, modes = normalModes(sArray[:, 0].copy(), sArray[:, 1].copy())
+    
+    return ModeTracker(w / (2 * np.pi), tSample, np.cumsum(sArray[:, 2]), largura, nZoom)
+
+#%%
+
+def chainIntegrate(Tmax, dt, tSample, sArray, alg, progress = None, cancel = None, tracker = None, store = True, kernels = None):
+    """
+    Função:
+    ---------
+    Ciclo de integração comum a springSimul e springSimulBatch. sArray pode ter forma (n, 5) ou (B, n, 5);
+    neste caso as B cadeias avançam juntas como arrays (B, n). Com o backend 'numba' (ver kernels.escolher)
+    o RK4 usa o ciclo compilado springCalcRK4Jit.
+
+    Returns
+    -------
+    res : Tuplo ou None
+        (x, v, m, k, xEq, time, energy, xList, vList), ou None se for cancelada
+    """
+    size, saveSteps, n, x, v, m, k, xEq, time, energy, xList, vList = initSimul(Tmax, dt, tSample, sArray, store)
+    aFun = chainAcce(k, xEq, m)
+    step = 'RK4 (numba)' if alg == 'RK4' and kern.escolher(kernels) == 'numba' else alg
+    buf = ig.initBuffers(step, x, v, aFun, dt, (m, k, xEq))
+    
+    energy[0] = energyCalc(x, v, m, k, xEq) # Adiciona a energia do sistema no estado inicial
+    check = max(size // 100, 1) # O progresso e o cancelamento são verificados a cada 1% da simulação
+    
+    def amostra(i, x, v): # Chamada pelo integrador em cada amostragem
+        energy[i] = energyCalc(x, v, m, k, xEq)
+        if tracker is not None:
+            tracker.update(x)
+        if i % check == 0:
+            if progress is not None:
+                progress[alg] = i / size
+            if cancel is not None and cancel.is_set():
+                return False
+    
+    res = ig.integrar(x, v, aFun, dt, saveSteps, size, step, amostra, xList, vList, buf = buf)
+    if res.n < size: # Cancelada
+        return None
+    time[:] = res.t
+    
+    return x, v, m, k, xEq, time, energy, xList, vList
+
+#%%
+
+def springSimul(Tmax, dt, tSample, sArray, alg, progress = None, cancel = None, tracker = None, store = True, kernels = None):
+    """
+    Função:
+    ---------
+    Executa a simulação segundo o algoritmo indicado, com o estado da cadeia guardado em arrays
+
+    Parameters
+    ----------
+    Tmax : Float
+        Tempo total da simulação
+    dt : Float
+        Tempo entre passos
+    tSample : Float
+        Tempo entre cada amostragem
+    sArray : Array de strings
+        Array com as características de inicialização de cada corpo indicadas pelo usuário na GUI.
+    alg : String
+        'Euler-Cromer', 'Verlet', 'Beeman', 'RK4' ou 'Ponto Médio'
+    progress : Dicionário (opcional)
+        Se indicado, progress[alg] é atualizado com a fração da simulação já feita
+    cancel : Event (opcional)
+        Se for ativado, a simulação termina e devolve (None, None, None)
+    tracker : ModeTracker (opcional)
+        Banco de filtros atualizado a cada amostragem, ver ModeTracker
+    store : Bool
+        Se False, xList/vList de cada corpo guardam apenas o estado final (útil com tracker em simulações longas)
+    kernels : String (opcional)
+        'numba' ou 'numpy', ver kernels.escolher. Só muda o RK4.
+
+    Returns
+    -------
     springs : Array de objetos
         Array com as várias molas/corpos do sistema
-    sSize : Int
-        Indicador do número de molas/corpos
-    sForce : Array de floats
-        Array de Forças sentidas exercidas pelo corpo da esquerda
-    sAcce : Array de floats
-        Array com as acelerações sentidas por cada corpo. Necessário para o cálculo do próximo passo
-    dx : Array de floats
-        Array com os deslocamentos adicionais para cada corpo usados no cálculo das acelerações intermédias no RK4
+    energy : Array de floats
+        Array com as energias do sistema a cada amostragem
+    time : Array de floats
+        Array com os tempos de cada amostragem
+    """
+    t0 = ti.time()
+    res = chainIntegrate(Tmax, dt, tSample, sArray, alg, progress, cancel, tracker, store, kernels)
+    
+    if res is None:
+        return None, None, None
+    
+    x, v, m, k, xEq, time, energy, xList, vList = res
+        
+    t1 = ti.time()
+    print(alg + ' time: ' + str(t1 - t0))
+        
+    return makeBodies(m, k, xEq, x, v, xList, vList), energy, time
+
+#%%
+
+def springSimulCromer(Tmax, dt, tSample, sArray):
+    """
+    Função:
+    ---------
+    Executa a simulação segundo o algoritmo de Euler-Cromer (ver springSimul)
+    """
+    return springSimul(Tmax, dt, tSample, sArray, 'Euler-Cromer')
+
+#%%
+
+def springSimulVerlet(Tmax, dt, tSample, sArray):
+    """
+    Função:
+    ---------
+    Executa a simulação segundo o algoritmo de Verlet (ver springSimul)
+    """
+    return springSimul(Tmax, dt, tSample, sArray, 'Verlet')
+
+#%%
+
+def springSimulBeeman(Tmax, dt, tSample, sArray):
+    """
+    Função:
+    ---------
+    Executa a simulação segundo o algoritmo de Beeman (ver springSimul)
+    """
+    return springSimul(Tmax, dt, tSample, sArray, 'Beeman')
+
+#%%
+
+def springSimulRK4(Tmax, dt, tSample, sArray):
+    """
+    Função:
+    ---------
+    Executa a simulação segundo o algoritmo de Runge-Kutta de Ordem 4 (ver springSimul)
+    """
+    return springSimul(Tmax, dt, tSample, sArray, 'RK4')
+
+#%%
+
+def springSimulMidpoint(Tmax, dt, tSample, sArray):
+    """
+    Função:
+    ---------
+    Executa a simulação segundo o método implícito do Ponto Médio (ver springSimul e springCalcMidpoint)
+    """
+    return springSimul(Tmax, dt, tSample, sArray, 'Ponto Médio')
+
+#%%
+
+def sweepArray(sArray, body, col, values):
+    """
+    Função:
+    ---------
+    Cria B cópias da tabela de uma cadeia, variando um parâmetro de um corpo
+
+    Parameters
+    ----------
+    sArray : Array 2D
+        Tabela base [massa, k, xEq, x0, v0] de cada corpo
+    body : Int
+        Índice do corpo cujo parâmetro varia
+    col : Int
+        Coluna do parâmetro (0 massa, 1 k, 2 xEq, 3 x0, 4 v0)
+    values : Array de floats
+        Valores do parâmetro, um por cadeia
 
     Returns
     -------
-    Nada. Atualiza o array das acelerações
+    sArrays : Array 3D de floats
+        Tabelas das B cadeias, de forma (B, n, 5)
     """
-    for i in range(sSize):
-        if i == 0:
-            sForce[i] = springs[i].k * (springs[i].x + dx[i] - springs[i].xEq)
-        else:
-            sForce[i] = springs[i].k * (springs[i].x + dx[i] - springs[i - 1].x - dx[i-1] - springs[i].xEq)
+    values = np.asarray(values, dtype = float)
+    sArrays = np.repeat(np.asarray(sArray, dtype = float)[None], values.size, axis = 0)
+    sArrays[:, body, col] = values
+    
+    return sArrays
+
+#%%
+
+def springSimulBatch(Tmax, dt, tSample, sArrays, alg = 'RK4', spectra = False, kernels = None):
+    """
+    Função:
+    ---------
+    Integra B cadeias com o mesmo número de corpos, mas parâmetros diferentes, num único ciclo sobre arrays (B, n).
+    Útil para varrer parâmetros (razão de massas, rigidez, ...) sem repetir o custo do interpretador por cadeia.
+
+    Parameters
+    ----------
+    Tmax, dt, tSample : Floats
+        Tempo total, entre passos e entre amostragens
+    sArrays : Array 3D de floats
+        Tabelas das B cadeias, de forma (B, n, 5), por exemplo criadas por sweepArray
+    alg : String
+        Algoritmo, como em springSimul
+    spectra : Bool
+        Se True, calcula também o espetro das posições de cada corpo de cada cadeia
+    kernels : String (opcional)
+        Backend do RK4, ver chainIntegrate
+
+    Returns
+    -------
+    xList, vList : Arrays 3D de floats
+        Posições e velocidades, de forma (amostragens, B, n)
+    energy : Array 2D de floats
+        Energia de cada cadeia a cada amostragem, de forma (amostragens, B)
+    time : Array de floats
+        Tempo de cada amostragem
+    fourierfreq, fourier : Arrays (apenas se spectra)
+        Frequências e módulo da transformada de Fourier, este de forma (frequências, B, n)
+    """
+    t0 = ti.time()
+    x, v, m, k, xEq, time, energy, xList, vList = chainIntegrate(Tmax, dt, tSample, sArrays, alg, kernels = kernels)
+    t1 = ti.time()
+    print(alg + ' (' + str(x.shape[0]) + ' cadeias) time: ' + str(t1 - t0))
+    
+    if not spectra:
+        return xList, vList, energy, time
+    
+    fourier = np.abs(sc.rfft(xList - xList.mean(axis = 0), axis = 0))
+    fourierfreq = sc.rfftfreq(xList.shape[0], tSample)
+    
+    return xList, vList, energy, time, fourierfreq, fourier
+
+#%%
+
+modeCache = {} # Modos normais já calculados, indexados pelas massas e constantes das molas
+
+def normalModes(m, k):
+    """
+    Função:
+    ---------
+    Diagonaliza a matriz de rigidez pesada pelas massas, M^(-1/2) K M^(-1/2), que é tridiagonal.
+    Usa o solver tridiagonal (banda) do scipy e guarda o resultado em cache para cada configuração.
+
+    Parameters
+    ----------
+    m, k : Arrays de floats
+        Massas dos corpos e constantes das molas
+
+    Returns
+    -------
+    w : Array de floats
+        Frequências angulares de cada modo normal (rad/s)
+    modes : Array 2D de floats
+        M^(-1/2) Q, cuja coluna j é o deslocamento de cada corpo no modo j
+    """
+    key = (m.tobytes(), k.tobytes())
+    
+    if key not in modeCache:
+        kDir = np.append(k[1:], 0) # Constante da mola à direita de cada corpo (o último está livre)
+        sm = np.sqrt(m)
+        diag = (k + kDir) / m
+        off = -k[1:] / (sm[:-1] * sm[1:])
+        w2, Q = la.eigh_tridiagonal(diag, off)
+        modeCache[key] = (np.sqrt(np.maximum(w2, 0)), Q / sm[:, None])
+        
+    return modeCache[key]
+
+#%%
+
+def springSimulExact(Tmax, dt, tSample, sArray):
+    """
+    Função:
+    ---------
+    Calcula a solução exata do sistema através dos modos normais. Como o sistema é linear,
+    o estado inicial é projetado nos modos e x(t), v(t) são avaliados em todas as amostragens
+    com um único produto de matrizes. O resultado não depende de dt.
+
+    Parameters
+    ----------
+    Tmax : Float
+        Tempo total da simulação
+    dt : Float
+        Não é usado; existe para manter a mesma assinatura das restantes simulações
+    tSample : Float
+        Tempo entre cada amostragem
+    sArray : Array de strings
+        Array com as características de inicialização de cada corpo indicadas pelo usuário na GUI.
+
+    Returns
+    -------
+    springs : Array de objetos
+        Array com as várias molas/corpos do sistema
+    energy : Array de floats
+        Array com as energias do sistema a cada amostragem
+    time : Array de floats
+        Array com os tempos de cada amostragem
+    freqs : Array de floats
+        Frequências de cada modo normal (Hz)
+    """
+    t0 = ti.time()
+    size, saveSteps, n, x, v, m, k, xEq, time, energy, xList, vList = initSimul(Tmax, dt, tSample, sArray)
+    w, modes = normalModes(m, k)
+    
+    xRest = np.cumsum(xEq) # Posições de equilíbrio dos corpos
+    proj = modes.T * m # Projeção nos modos: Q^T M^(1/2) = (M^(-1/2) Q)^T M
+    a = proj @ (x - xRest) # Amplitudes iniciais de cada modo
+    b = proj @ v / w # Velocidades iniciais de cada modo, divididas pela frequência
+    
+    time[:] = np.arange(size + 1) * tSample
+    wt = np.outer(time, w)
+    c = np.cos(wt)
+    s = np.sin(wt)
+    np.matmul(c * a + s * b, modes.T, out = xList)
+    xList += xRest
+    np.matmul((c * b - s * a) * w, modes.T, out = vList)
+    
+    energy[:] = energyCalc(xList, vList, m, k, xEq)
+    
+    t1 = ti.time()
+    print('Exata time: ' + str(t1 - t0))
+    
+    return makeBodies(m, k, xEq, xList[-1], vList[-1], xList, vList), energy, time, w / (2 * np.pi)
+
+#%%
+
+class Network:              #   Rede 2D de corpos ligados por molas arbitrárias (lista de arestas)
+    def __init__(self, pos, m, edges, k, L0 = None, fixed = None, vel = None):
+        self.pos = np.asarray(pos, dtype = float)       #   Posições iniciais dos nós (N, 2)
+        self.vel = np.zeros_like(self.pos) if vel is None else np.asarray(vel, dtype = float) #   Velocidades iniciais (N, 2)
+        self.N = self.pos.shape[0]
+        self.m = np.broadcast_to(np.asarray(m, dtype = float), (self.N,)).copy() #   Massa de cada nó
+        self.edges = np.asarray(edges, dtype = np.int64)   #   Pares (i, j) ligados por uma mola (E, 2)
+        self.E = self.edges.shape[0]
+        self.k = np.broadcast_to(np.asarray(k, dtype = float), (self.E,)).copy() #   Constante de cada mola
+        
+        # Matriz de incidência esparsa (E, N): +1 no nó j e -1 no nó i de cada aresta, B @ pos dá pos[j] - pos[i]
+        rows = np.repeat(np.arange(self.E), 2)
+        cols = self.edges[:, ::-1].ravel()
+        vals = np.tile([1., -1.], self.E)
+        self.B = sp.csr_matrix((vals, (rows, cols)), shape = (self.E, self.N))
+        self.BT = self.B.T.tocsr()
+        
+        if L0 is None: # Por defeito as molas estão em repouso na configuração inicial
+            L0 = np.linalg.norm(self.B @ self.pos, axis = 1)
+        self.L0 = np.broadcast_to(np.asarray(L0, dtype = float), (self.E,)).copy() #   Comprimento de repouso de cada mola
+        
+        self.free = np.ones(self.N, dtype = bool) #   Nós que se podem mover (os fixos funcionam como paredes)
+        if fixed is not None:
+            self.free[fixed] = False
+
+#%%
+
+def latticeNetwork(nx, ny, a = 1., m = 1., k = 10., diagonals = False, fixedBorder = True, ruido = 0., rng = None):
+    """
+    Função:
+    ---------
+    Cria uma rede quadrada de nx por ny nós (membrana), com molas entre vizinhos e, opcionalmente, nas diagonais
+
+    Parameters
+    ----------
+    nx, ny : Ints
+        Número de nós em cada direção
+    a : Float
+        Distância entre nós, também o comprimento de repouso das molas
+    m, k : Floats
+        Massa dos nós e constante das molas
+    diagonals : Bool
+        Se True, junta molas nas diagonais de cada quadrado (rede rígida ao corte)
+    fixedBorder : Bool
+        Se True, os nós da borda ficam fixos
+    ruido : Float
+        Desvio padrão do deslocamento aleatório inicial dos nós livres
+    rng : Generator
+        Gerador de números aleatórios para o deslocamento inicial
+
+    Returns
+    -------
+    net : Network
+        Rede criada
+    """
+    idx = np.arange(nx * ny).reshape(ny, nx)
+    gx, gy = np.meshgrid(np.arange(nx) * a, np.arange(ny) * a)
+    pos = np.column_stack((gx.ravel(), gy.ravel()))
+    
+    pares = [(idx[:, :-1], idx[:, 1:]), (idx[:-1, :], idx[1:, :])]
+    if diagonals:
+        pares += [(idx[:-1, :-1], idx[1:, 1:]), (idx[:-1, 1:], idx[1:, :-1])]
+    edges = np.concatenate([np.column_stack((i.ravel(), j.ravel())) for i, j in pares])
+    L0 = np.linalg.norm(pos[edges[:, 1]] - pos[edges[:, 0]], axis = 1)
+    
+    fixed = None
+    if fixedBorder:
+        borda = np.zeros((ny, nx), dtype = bool)
+        borda[[0, -1], :] = True
+        borda[:, [0, -1]] = True
+        fixed = borda.ravel()
+        
+    net = Network(pos, m, edges, k, L0, fixed)
+    
+    if ruido > 0:
+        rng = np.random.default_rng() if rng is None else rng
+        net.pos[net.free] += rng.normal(0, ruido, (net.free.sum(), 2))
+        
+    return net
+
+#%%
+
+def networkAcce(net):
+    """
+    Função:
+    ---------
+    Cria a função de aceleração da rede, aFun(x, out), sobre o estado achatado (2N,).
+    As forças são calculadas com a matriz de incidência: extensões por aresta (gather) e soma nos nós (scatter).
+
+    Returns
+    -------
+    aFun : Função
+        Escreve em out as acelerações para as posições x, para usar com os integradores da cadeia
+    """
+    invM = (net.free / net.m)[:, None] # Nós fixos têm aceleração nula
+    
+    def aFun(x, out):
+        d = net.B @ x.reshape(net.N, 2) # pos[j] - pos[i] de cada aresta
+        L = np.sqrt((d * d).sum(axis = 1))
+        d *= (net.k * (L - net.L0) / L)[:, None] # Força exercida pela mola sobre o nó i
+        np.multiply(net.BT @ d, invM, out = out.reshape(net.N, 2))
+        out *= -1
+        
+    return aFun
+
+#%%
+
+def networkEnergy(net, x, v):
+    """
+    Função:
+    ---------
+    Energia total da rede: cinética dos nós e potencial de todas as molas, para o estado achatado (2N,)
+    """
+    L = np.linalg.norm(net.B @ x.reshape(net.N, 2), axis = 1)
+    
+    return 0.5 * (net.m * (v.reshape(net.N, 2) ** 2).sum(axis = 1)).sum() + 0.5 * (net.k * (L - net.L0) ** 2).sum()
+
+#%%
+
+def networkSimul(Tmax, dt, tSample, net, alg = 'Verlet', record = None):
+    """
+    Função:
+    ---------
+    Simula a rede com os mesmos integradores da cadeia, aplicados ao estado achatado (2N,)
+
+    Parameters
+    ----------
+    Tmax, dt, tSample : Floats
+        Tempo total, entre passos e entre amostragens
+    net : Network
+        Rede a simular (as posições e velocidades iniciais não são alteradas)
+    alg : String
+        'Euler-Cromer', 'Verlet', 'Beeman' ou 'RK4'
+    record : Array de ints (opcional)
+        Nós cujas posições e velocidades são guardadas em cada amostragem. Por defeito, todos.
+        Em redes grandes permite limitar a memória usada.
+
+    Returns
+    -------
+    xList, vList : Arrays de floats
+        Posições e velocidades dos nós registados, de forma (amostragens, nós registados, 2)
+    energy : Array de floats
+        Energia total da rede a cada amostragem
+    time : Array de floats
+        Tempo de cada amostragem
+    """
+    t0 = ti.time()
+    size = int(Tmax/tSample)
+    saveSteps = int(tSample/dt)
+    record = np.arange(net.N) if record is None else np.asarray(record)
+    
+    x = net.pos.ravel().copy()
+    v = net.vel.ravel().copy()
+    aFun = networkAcce(net)
+    
+    energy = np.zeros(size + 1, dtype = float)
+    energy[0] = networkEnergy(net, x, v)
+    
+    def amostra(i, x, v):
+        energy[i] = networkEnergy(net, x, v)
+    
+    res = ig.integrar(x, v, aFun, dt, saveSteps, size, alg, amostra, proj = lambda y: y.reshape(net.N, 2)[record])
+    xList, vList, time = res.x, res.v, res.t
+        
+    t1 = ti.time()
+    print('Rede (' + alg + ') time: ' + str(t1 - t0))
+    
+    return xList, vList, energy, time
+
+#%%
+
+def chainArray(n, m = 1., k = 10., xEq = 5., dx = 0.5):
+    """
+    Função:
+    ---------
+    Cria a tabela de uma cadeia uniforme de n corpos em repouso, com o primeiro deslocado de dx
+
+    Returns
+    -------
+    sArray : Array 2D de floats
+        Uma linha [massa, k, xEq, x0, v0] por corpo, como na GUI
+    """
+    sArray = np.zeros((n, 5), dtype = float)
+    sArray[:, 0] = m
+    sArray[:, 1] = k
+    sArray[:, 2] = xEq
+    sArray[:, 3] = xEq * np.arange(1, n + 1)
+    sArray[0, 3] += dx
+    
+    return sArray
+
+#%%
+
+def modalAmplitudes(xList, vList, m, k, xEq):
+    """
+    Função:
+    ---------
+    Amplitudes complexas de cada modo normal, z = q - i q'/w, ao longo do tempo.
+    Na solução exata |z| é constante e a fase avança w t, por isso z mede diretamente os erros de amplitude e fase.
+    """
+    w, modes = normalModes(m, k)
+    proj = modes.T * m
+    q = (xList - np.cumsum(xEq)) @ proj.T
+    qv = vList @ proj.T
+    
+    return q - 1j * qv / w
+
+#%%
+
+def benchmark(dts, ns, Tmax = 20., tSample = 0.1, algs = ('Euler-Cromer', 'Verlet', 'Beeman', 'RK4', 'Ponto Médio'), path = 'benchMola.csv'):
+    """
+    Função:
+    ---------
+    Compara o custo e a precisão dos integradores para vários dt e comprimentos da cadeia.
+    A referência é a solução exata por modos normais (springSimulExact).
+
+    Parameters
+    ----------
+    dts : Lista de floats
+        Passos de tempo a testar
+    ns : Lista de ints
+        Número de corpos da cadeia
+    Tmax, tSample : Floats
+        Duração e tempo entre amostragens de cada simulação
+    algs : Tuplo de strings
+        Algoritmos a comparar
+    path : String
+        Ficheiro CSV onde é escrita a tabela (None para não escrever)
+
+    Returns
+    -------
+    rows : Lista de dicionários
+        Uma linha por (algoritmo, n, dt) com: wall (s), stepsPerSec, energyDrift (máximo de |E - E0|/E0),
+        phaseErr (rad), ampErr (relativo) e xErr (m), estes três os máximos ao longo da simulação
+    """
+    rows = []
+    
+    for n in ns:
+        sArray = chainArray(n)
+        m, k, xEq = sArray[:, 0], sArray[:, 1], sArray[:, 2]
+        ex, eEx, tEx, freqs = springSimulExact(Tmax, dts[0], tSample, sArray)
+        xEx = np.column_stack([b.xList for b in ex])
+        zEx = modalAmplitudes(xEx, np.column_stack([b.vList for b in ex]), m, k, xEq)
+        usados = np.abs(zEx[0]) > 1e-8 * np.abs(zEx[0]).max() # Modos que estão de facto excitados
+        
+        for dt in dts:
+            for alg in algs:
+                t0 = ti.perf_counter()
+                springs, energy, time = springSimul(Tmax, dt, tSample, sArray, alg)
+                wall = ti.perf_counter() - t0
+                
+                xList = np.column_stack([b.xList for b in springs])
+                z = modalAmplitudes(xList, np.column_stack([b.vList for b in springs]), m, k, xEq)
+                ratio = z[:, usados] / zEx[:, usados]
+                
+                rows.append({'alg': alg, 'n': n, 'dt': dt, 'wall': wall,
+                             'stepsPerSec': (time.size - 1) * int(tSample/dt) / wall,
+                             'energyDrift': float(np.abs(energy / energy[0] - 1).max()),
+                             'phaseErr': float(np.abs(np.angle(ratio)).max()),
+                             'ampErr': float(np.abs(np.abs(ratio) - 1).max()),
+                             'xErr': float(np.abs(xList - xEx).max())})
+                
+    if path is not None:
+        with open(path, 'w', newline = '') as f:
+            writer = csv.DictWriter(f, fieldnames = list(rows[0].keys()))
+            writer.writeheader()
+            writer.writerows(rows)
             
-    for i in range(sSize):
-        sAcce[i] = - sForce[i] / springs[i].mass + sForce[i + 1] / springs[i].mass 
+    return rows
 
 #%%
 
-def springCalcCromer(springs, sForce, sAcce, saveSteps, dt):
+def cheapest(rows, tol, metric = 'xErr'):
     """
     Função:
     ---------
-    Calcula as novas posições e velocidades para cada mola com base no algoritmo de Euler-Cromer
+    Escolhe, de entre as linhas do benchmark, a mais rápida cujo erro (metric) não excede tol. None se nenhuma servir.
+    """
+    boas = [r for r in rows if r[metric] <= tol]
+    
+    return min(boas, key = lambda r: r['wall']) if boas else None
+
+#%%
+
+def plotPareto(rows, metric = 'xErr'):
+    """
+    Função:
+    ---------
+    Gráfico do tempo de execução vs erro de cada simulação do benchmark, com a fronteira de Pareto
+    (pontos para os quais nenhum outro é simultaneamente mais rápido e mais preciso).
+    """
+    fig, ax = plt.subplots(figsize = (10, 6))
+    ax.set_title('Custo vs Precisão dos Integradores')
+    ax.set_xlabel('Tempo de execução (s)')
+    ax.set_ylabel(metric)
+    
+    for alg in algColors:
+        pts = [r for r in rows if r['alg'] == alg]
+        if pts:
+            ax.scatter([r['wall'] for r in pts], [r[metric] for r in pts], color = algColors[alg], label = alg)
+            
+    ordem = sorted(rows, key = lambda r: (r['wall'], r[metric]))
+    frente = []
+    for r in ordem: # Percorre por tempo crescente e guarda os pontos que melhoram o erro
+        if not frente or r[metric] < frente[-1][metric]:
+            frente.append(r)
+    ax.step([r['wall'] for r in frente], [r[metric] for r in frente], where = 'post', color = 'gray', linestyle = '--', label = 'Fronteira de Pareto')
+    
+    ax.set_xscale('log')
+    ax.set_yscale('log')
+    ax.legend()
+    
+    return fig, ax
+
+#%%
+
+nsprings = 20 # Indica quantos nodos cada mola terá
+zigU = np.arange(nsprings + 1) / nsprings # Molde da mola: posição relativa de cada vértice entre os dois corpos
+zigY = 0.2 * np.sin(np.arange(nsprings + 1) * np.pi/2) # Usa-se o sin(k pi/2) de modo ao valor do Y alternar entre positivo e negativo
+aniFps = 30 # Imagens por segundo da animação
+
+def initPlots(springs, ax):
+    """
+    Função:
+    ---------
+    Inicia os objetos gráficos utilizados para animação da simulação: todas as molas numa única LineCollection
+    e todos os corpos num único scatter
 
     Parameters
     ----------
     springs : Array de objetos
         Array com as várias molas/corpos do sistema
-    sForce : Array de floats
-        Array de Forças sentidas exercidas pelo corpo da esquerda
-    sAcce : Array de floats
-        Array com as acelerações sentidas por cada corpo. Necessário para o cálculo do próximo passo
-    saveSteps : Int
-        Número de passos que devem ser executados até se guardar os dados para amostragem.
-    dt : float
-        Tempo entre passos
+    ax : Axes
+        Eixos da animação
+
+    Returns
+    -------
+    plots : Tuplo
+        (molas, corpos, vértices das molas, posições dos corpos), estes dois últimos atualizados no lugar em cada imagem
+    """
+    size = springs.size # Indicador do número de corpos/molas
+    segs = np.zeros((size, nsprings + 1, 2), dtype = float) # Vértices de cada mola
+    segs[..., 1] = zigY # O Y do molde não muda durante a animação
+    offs = np.zeros((size, 2), dtype = float) # Posições dos corpos
+    
+    lines = LineCollection(segs, colors = 'black', zorder = 0) # Traços pretos, na layer inferior
+    ax.add_collection(lines)
+    balls = ax.scatter(offs[:, 0], offs[:, 1], s = 20 ** 2, color = 'red', zorder = 1) # Bolas vermelhas, na layer superior
+        
+    return lines, balls, segs, offs
+
+#%%
+
+def aniFrames(xList, tSample, fps = aniFps, speed = 1.):
+    """
+    Função:
+    ---------
+    Escolhe as amostragens a animar, de modo a mostrar a simulação a speed vezes a velocidade real com fps imagens por segundo
 
     Returns
     -------
-    Nada. Apenas atualiza as coordenadas e velocidades instantâneas para cada corpo.
+    frames : Array 2D de floats
+        Linhas de xList (posições de todos os corpos) a usar como imagens da animação
     """
-    n = springs.size
-    passo = 0
+    passo = max(int(round(speed / (fps * tSample))), 1)
     
-    while passo < saveSteps: # executa várias iterações e atualiza as posições e velocidades instantâneas até ser necessário recolher amostragem
-        acceCalc(springs, n, sForce, sAcce)
-        for i in range(n):
-            springs[i].v += sAcce[i] * dt
-            springs[i].x += springs[i].v * dt
-        passo += 1
+    return xList[::passo]
 
-#%%        
-        
-def springCalcVerlet(springs, sForce, sAcce, saveSteps, dt, xLast, xPos):
+#%%
+
+def makeAnimation(i):
     """
     Função:
     ---------
-    Calcula as novas posições e velocidades para cada mola com base no algoritmo de Verlet
+    Função chamada pela função FuncAnimation, responsável pela animação da simulação.
+    As molas são obtidas do molde por uma transformação afim vetorizada (sem ciclos por corpo ou vértice).
 
     Parameters
     ----------
-    springs : Array de objetos
-        Array com as várias molas/corpos do sistema
-    sForce : Array de floats
-        Array de Forças sentidas exercidas pelo corpo da esquerda
-    sAcce : Array de floats
-        Array com as acelerações sentidas por cada corpo. Necessário para o cálculo do próximo passo
-    saveSteps : Int
-        Número de passos que devem ser executados até se guardar os dados para amostragem.
-    dt : float
-        Tempo entre passos
-    xLast : Array de floats
-        Posição do passo anterior para cada corpo.
-    xPos : Array de floats
-        Posição atual para cada corpo
+    i : Objeto do array de frames
+        Contém as posições de certa iteração para todos os corpos
 
     Returns
     -------
-    xLast : Array de floats
-        Posição do passo anterior para cada corpo.
+    artists : Tuplo
+        Objetos gráficos alterados, necessários para o blit
     """
-    n = springs.size
-    passo = 0
+    lines, balls, segs, offs = plotsAni
     
-    while passo < saveSteps:
-        acceCalc(springs, n, sForce, sAcce) # Atualiza a nova aceleração
-        for i in range(n):
-            xPos[i] = copy.deepcopy(springs[i].x) # Atualiza a posição atual
-            springs[i].x = 2 * springs[i].x - xLast[i] + sAcce[i] * dt ** 2 # Calcula a nova posição segundo o método de Verlet
-            springs[i].v = (springs[i].x - xLast[i]) / (2 * dt) # Calcula a nova velocidade segundo o método de Verlet
+    segs[0, :, 0] = i[0] * zigU # A primeira mola começa na parede, em x = 0
+    np.multiply.outer(i[1:] - i[:-1], zigU, out = segs[1:, :, 0]) # As restantes começam no corpo anterior
+    segs[1:, :, 0] += i[:-1, None]
+    offs[:, 0] = i
+    
+    lines.set_segments(segs)
+    balls.set_offsets(offs)
+    
+    return lines, balls
+    
+#%%
 
-        xLast = copy.deepcopy(xPos) # Atualiza a posição anterior
-        passo += 1
-        
-    return xLast
+algNames = ['Euler-Cromer', 'Verlet', 'Beeman', 'RK4', 'Ponto Médio', 'Exata'] # Pela ordem das checkboxes
+algColors = {'Euler-Cromer': 'blue', 'Verlet': 'darkorange', 'Beeman': 'seagreen', 'RK4': 'r', 'Ponto Médio': 'purple', 'Exata': 'black'}
+algTitles = {'Euler-Cromer': 'Animação: Método de Euler-Cromer', 'Verlet': 'Animação: Método de Verlet', 'Beeman': 'Animação: Método de Beeman',
+             'RK4': 'Animação: Runge-Kutta de Ordem 4', 'Ponto Médio': 'Animação: Ponto Médio Implícito', 'Exata': 'Animação: Solução Exata (Modos Normais)'}
+
+pool = None         # Pool de processos onde correm as simulações
+threadPool = None   # Alternativa com threads, caso os processos não estejam disponíveis
+sharedManager = None # Gestor dos objetos partilhados (progresso e cancelamento)
+usarProcessos = True
+run = None          # Estado da execução em curso
+
+memCache = OrderedDict() # Cache em memória dos resultados (LRU)
+memCacheMax = 8          # Número máximo de resultados guardados em memória
+cacheDir = os.path.join(os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache'), 'mola') # Pasta da cache em disco (ficheiros .npz), fora do repositório
+cacheBytes = 500e6       # Espaço máximo ocupado pela cache em disco
 
 #%%
 
-def springCalcBeeman(springs, sForce, sAcce0, sAcce1, sAcce2, saveSteps, dt):
+def simulWorker(alg, Tmax, dt, tSample, sArray, progress = None, cancel = None):
     """
     Função:
     ---------
-    Calcula as novas posições e velocidades para cada mola com base no algoritmo de Beeman
+    Executa uma simulação num processo (ou thread) separado e devolve apenas arrays
 
     Parameters
     ----------
-    springs : Array de objetos
-        Array com as várias molas/corpos do sistema
-    sForce : Array de floats
-        Array de Forças sentidas exercidas pelo corpo da esquerda.
-    sAcce0 : Array de floats
-        Array com as acelerações do passo anterior
-    sAcce1 : Array de floats
-        Array com as acelerações  do passo atual
-    sAcce2 : Array de floats
-        Array com as acelerações do próximo passo
-    saveSteps : Int
-        Número de passos que devem ser executados até se guardar os dados para amostragem.
-    dt : float
-        Tempo entre passos
+    alg : String
+        Um dos algoritmos de algNames
+    Tmax, dt, tSample, sArray :
+        Ver springSimul
+    progress, cancel :
+        Objetos partilhados do gestor, ver springSimul
 
     Returns
     -------
-    sAcce0 : Array de floats
-        Array com as acelerações do passo anterior
-    sAcce1 : Array de floats
-        Array com as acelerações  do passo atual
-    sAcce2 : Array de floats
-        Array com as acelerações do próximo passo
-    """
-    n = springs.size
-    passo = 0
+    res : Tuplo ou None
+        (xList, vList, energy, time, freqs), com xList/vList de forma (amostragens, corpos). None se for cancelada.
+    """
+    freqs = None
     
-    while passo < saveSteps: 
-        for i in range(n):
-            springs[i].x += springs[i].v * dt + 2/3 * sAcce1[i] * dt ** 2 - 1/6 * sAcce0[i] * dt ** 2 # Cálculo das posições segundo o método de Beeman
-        acceCalc(springs, n, sForce, sAcce2) # Atualiza a nova aceleração
-        for i in range(n):
-            springs[i].v += 1/3 * sAcce2[i] * dt + 5/6 * sAcce1[i] * dt - 1/6 * sAcce0[i] * dt     # Cálculo das velocidades segundo o método de Beeman
-
-        sAcce0 = copy.deepcopy(sAcce1)  # Atualiza a aceleração anterior
-        sAcce1 = copy.deepcopy(sAcce2)  # Atualiza a aceleração atual
-        
-        passo += 1
+    if alg == 'Exata':
+        springs, energy, time, freqs = springSimulExact(Tmax, dt, tSample, sArray)
+    else:
+        springs, energy, time = springSimul(Tmax, dt, tSample, sArray, alg, progress, cancel)
         
-    return sAcce0, sAcce1, sAcce2
-       
+    if springs is None:
+        return None
+    
+    if progress is not None:
+        progress[alg] = 1.
+    
+    return np.column_stack([s.xList for s in springs]), np.column_stack([s.vList for s in springs]), energy, time, freqs
+
 #%%
 
-def springCalcRK4(springs, sForce, sAcce, saveSteps, dt):
+def codeHash(h, code):
     """
     Função:
     ---------
-    Calcula as novas posições e velocidades para cada mola com base no algoritmo de Runge-Kutta de Ordem 4
+    Junta ao hash h o bytecode, os nomes e as constantes de um objeto de código e, recursivamente,
+    das funções nele definidas. O repr de um objeto de código inclui o seu endereço de memória e a
+    ordem de um frozenset depende da aleatorização dos hashes, por isso nenhum dos dois entra no hash
+    diretamente: assim o resultado é o mesmo em todos os processos.
+    """
+    h.update(code.co_code)
+    h.update(repr(code.co_names).encode())
+    for c in code.co_consts:
+        if hasattr(c, 'co_code'):
+            codeHash(h, c)
+        elif isinstance(c, frozenset):
+            h.update(repr(sorted(repr(x) for x in c)).encode())
+        else:
+            h.update(repr(c).encode())
 
-    Parameters
-    ----------
-    springs : Array de objetos
-        Array com as várias molas/corpos do sistema
-    sForce : Array de floats
-        Array de Forças sentidas exercidas pelo corpo da esquerda
-    sAcce : Array de floats
-        Array com as acelerações sentidas por cada corpo. Necessário para o cálculo do próximo passo
-    saveSteps : Int
-        Número de passos que devem ser executados até se guardar os dados para amostragem.
-    dt : float
-        Tempo entre passos
+#%%
 
-    Returns
-    -------
-    Nada. Apenas atualiza as coordenadas e velocidades instantâneas para cada corpo
+def codeVersion(alg):
     """
-    n = springs.size
-    passo = 0
-    sForceRK = np.zeros(n + 1, dtype = float) #Array que guarda as forças de cada mola durante os passos intermédios do algoritmo
-    sAcceRK = np.zeros(n, dtype = float) #Array que guarda as acelerações de cada corpo durante os passos intermédios do algoritmo
-    x1 = np.zeros(n)  # Array dos dx1
-    v1 = np.zeros(n)  # Array dos dv1
-    x2 = np.zeros(n)  # Array dos dx2
-    v2 = np.zeros(n)  # Array dos dv2
-    x3 = np.zeros(n)  # Array dos dx3
-    v3 = np.zeros(n)  # Array dos dv3
-    x4 = np.zeros(n)  # Array dos dx4
-    v4 = np.zeros(n)  # Array dos dv4
+    Função:
+    ---------
+    Hash do código das funções usadas por um algoritmo, para invalidar resultados guardados com código antigo
+    """
+    if alg == 'Exata':
+        funcs = [springSimulExact, normalModes, initSimul, energyCalc]
+    else:
+        funcs = [springSimul, chainIntegrate, springCalc[alg], ig.integrar, ig.bufferMakers[alg], chainAcce, acceCalc, initSimul, energyCalc]
+        if alg == 'Ponto Médio':
+            funcs += [midpointFactor, midpointSolve]
+        if alg == 'RK4':
+            funcs += [springCalcRK4Jit, rk4JitBuffers] + [getattr(f, 'py_func', f) for f in (kern.rk4Cadeia, kern._aCadeia)]
     
-    while passo < saveSteps:
-        acceCalc(springs, n, sForce, sAcce)
+    h = hashlib.sha1()
+    for f in funcs:
+        codeHash(h, f.__code__)
         
-        for i in range(n):  # Calcula os dx e dv da 1a iteração RK
-            x1[i] = dt * springs[i].v
-            v1[i] = sAcce[i] * dt
-        
-        acceCalcRK4(springs, n, sForceRK, sAcceRK, x1/2) # Calcula a nova aceleração intermédia
-        for i in range(n):  # Calcula os dx e dv da 2a iteração RK
-            x2[i] = dt * (springs[i].v + v1[i]/2)
-            v2[i] = sAcceRK[i] * dt
-            
-        acceCalcRK4(springs, n, sForceRK, sAcceRK, x2/2) # Calcula a nova aceleração intermédia
-        for i in range(n):  # Calcula os dx e dv da 3a iteração RK
-            x3[i] = dt * (springs[i].v + v2[i]/2)
-            v3[i] = sAcceRK[i] * dt
-    
-        acceCalcRK4(springs, n, sForceRK, sAcceRK, x3)   # Calcula a nova aceleração intermédia
-        for i in range(n):  # Calcula os dx e dv da 4a iteração RK
-            x4[i] = dt * (springs[i].v + v3[i])
-            v4[i] = sAcceRK[i] * dt
-         
-        for i in range(n):  # Calcula e atualiza para cada mola a nova velocidade e posição da nova iteração
-            springs[i].v += 1/6 * (v1[i] + 2 * v2[i] + 2 * v3[i] + v4[i])
-            springs[i].x += 1/6 * (x1[i] + 2 * x2[i] + 2 * x3[i] + x4[i])
-            
-        passo += 1
+    return h.hexdigest()
 
 #%%
 
-def springSimulCromer(Tmax, dt, tSample, sArray):
+def cacheKey(alg, dt, tSample, sArray):
     """
     Função:
     ---------
-    Executa a simulação segundo o algoritmo de Euler-Cromer
+    Chave de um resultado: hash do algoritmo, dt, tSample, parâmetros de cada corpo e versão do código.
+    Tmax não faz parte da chave, uma simulação mais longa serve também pedidos mais curtos.
+    A solução exata não depende de dt, que também não entra na sua chave.
+    """
+    dtChave = None if alg == 'Exata' else float(dt)
+    dados = [alg, dtChave, float(tSample), np.asarray(sArray, dtype = float).tolist(), codeVersion(alg)]
+    
+    return hashlib.sha1(json.dumps(dados).encode()).hexdigest()
 
-    Parameters
-    ----------
-    Tmax : Float
-        Tempo total da simulação
-    dt : Float
-        Tempo entre passos
-    tSample : Float
-        Tempo entre cada amostragem
-    sArray : Array de strings
-        Array com as características de inicialização de cada corpo indicadas pelo usuário na GUI.
+#%%
 
-    Returns
-    -------
-    springs : Array de objetos
-        Array com as várias molas/corpos do sistema
-    energy : Array de floats
-        Array com as energias do sistema a cada amostragem
-    time : Array de floats
-        Array com os tempos de cada amostragem
+def sliceResult(res, Tmax, tSample):
     """
-    t0 = ti.time()
-    size, saveSteps, n, springs, sForce, sAcce, time, energy = initSimul(Tmax, dt, tSample, sArray)
-    
-    for i in range(n):
-        springs[i] = Body(sArray[i][0], sArray[i][1], sArray[i][2], sArray[i][3], sArray[i][4], size + 1) # Cria os objetos com as características de cada corpo/mola especificadas pelo utilizador na GUI
+    Função:
+    ---------
+    Corta um resultado guardado às amostragens até Tmax. Devolve None se o resultado for mais curto que o pedido.
+    """
+    n = int(Tmax/tSample) + 1 # Igual ao número de amostragens de initSimul
+    xList, vList, energy, time, freqs = res
     
-    energy[0] = energyCalc(springs) # Adiciona a energia do sistema no estado inicial
+    if time.size < n:
+        return None
     
-    for i in range(size): # Executa todas as amostragens
-        time[i + 1] = time[i] + tSample # Adiciona o tempo da nova amostragem
-        springCalcCromer(springs, sForce, sAcce, saveSteps, dt) # Executa o cálculo de várias iterações até ocorrer amostragem segundo o algorítmo de Euler-Cromer
-        for j in range(n):
-            springs[j].vList[i + 1] = springs[j].v # Guarda o valor atual da velocidade
-            springs[j].xList[i + 1] = springs[j].x # Guarda o valor atual da posição
-        energy[i + 1] = energyCalc(springs)
-        
-    t1 = ti.time()
-    print('Euler-Cromer time: ' + str(t1 - t0))
-        
-    return springs, energy, time
+    return xList[:n], vList[:n], energy[:n], time[:n], freqs
 
 #%%
 
-def springSimulVerlet(Tmax, dt, tSample, sArray):
+def cacheGet(alg, Tmax, dt, tSample, sArray):
     """
     Função:
     ---------
-    Executa a simulação segundo o algoritmo de Verlet
-
-    Parameters
-    ----------
-    Tmax : Float
-        Tempo total da simulação
-    dt : Float
-        Tempo entre passos
-    tSample : Float
-        Tempo entre cada amostragem
-    sArray : Array de strings
-        Array com as características de inicialização de cada corpo indicadas pelo usuário na GUI.
+    Procura um resultado na cache em memória e, a seguir, na cache em disco
 
     Returns
     -------
-    springs : Array de objetos
-        Array com as várias molas/corpos do sistema
-    energy : Array de floats
-        Array com as energias do sistema a cada amostragem
-    time : Array de floats
-        Array com os tempos de cada amostragem
+    res : Tuplo ou None
+        (xList, vList, energy, time, freqs) como em simulWorker, ou None se não existir
     """
-    t0 = ti.time()   
-    size, saveSteps, n, springs, sForce, sAcce, time, energy, xLast, xPos = initSimul(Tmax, dt, tSample, sArray, alg = 'Verlet')
+    key = cacheKey(alg, dt, tSample, sArray)
     
-    for i in range(n):
-        springs[i] = Body(sArray[i][0], sArray[i][1], sArray[i][2], sArray[i][3], sArray[i][4], size + 1)
-        xLast[i] = springs[i].x - springs[i].v * dt
+    if key in memCache:
+        memCache.move_to_end(key)
+        return sliceResult(memCache[key], Tmax, tSample)
     
-    energy[0] = energyCalc(springs)
+    path = os.path.join(cacheDir, key + '.npz')
+    if not os.path.exists(path):
+        return None
     
-    for i in range(size):
-        time[i + 1] = time[i] + tSample
-        xLast = springCalcVerlet(springs, sForce, sAcce, saveSteps, dt, xLast, xPos)
-            
-        for j in range(n):
-            springs[j].vList[i + 1] = springs[j].v
-            springs[j].xList[i + 1] = springs[j].x
-        energy[i + 1] = energyCalc(springs)
-        
-    t1 = ti.time()
-    print('Verlet time: ' + str(t1 - t0))
-        
-    return springs, energy, time
+    with np.load(path) as f:
+        res = (f['xList'], f['vList'], f['energy'], f['time'], f['freqs'] if 'freqs' in f else None)
+    os.utime(path) # Marca o ficheiro como usado recentemente
+    memPut(key, res)
+    
+    return sliceResult(res, Tmax, tSample)
 
 #%%
 
-def springSimulBeeman(Tmax, dt, tSample, sArray):
+def memPut(key, res):
+    memCache[key] = res
+    memCache.move_to_end(key)
+    while len(memCache) > memCacheMax: # Retira o resultado usado há mais tempo
+        memCache.popitem(last = False)
+
+#%%
+
+def cachePut(alg, dt, tSample, sArray, res):
     """
     Função:
     ---------
-    Executa a simulação segundo o algoritmo de Beeman
+    Guarda um resultado nas duas caches, e retira da cache em disco os ficheiros mais antigos se exceder cacheBytes
+    """
+    key = cacheKey(alg, dt, tSample, sArray)
+    old = memCache.get(key)
+    if old is not None and old[3].size >= res[3].size: # Já existe um resultado pelo menos tão longo
+        return
+    memPut(key, res)
+    
+    os.makedirs(cacheDir, exist_ok = True)
+    xList, vList, energy, time, freqs = res
+    dados = {'xList': xList, 'vList': vList, 'energy': energy, 'time': time}
+    if freqs is not None:
+        dados['freqs'] = freqs
+    np.savez(os.path.join(cacheDir, key + '.npz'), **dados)
+    
+    ficheiros = [os.path.join(cacheDir, f) for f in os.listdir(cacheDir) if f.endswith('.npz')]
+    ficheiros.sort(key = os.path.getmtime)
+    total = sum(os.path.getsize(f) for f in ficheiros)
+    while total > cacheBytes and len(ficheiros) > 1:
+        total -= os.path.getsize(ficheiros[0])
+        os.remove(ficheiros.pop(0))
 
-    Parameters
-    ----------
-    Tmax : Float
-        Tempo total da simulação
-    dt : Float
-        Tempo entre passos
-    tSample : Float
-        Tempo entre cada amostragem
-    sArray : Array de strings
-        Array com as características de inicialização de cada corpo indicadas pelo usuário na GUI.
+#%%
+
+def cachedRun(alg, Tmax, dt, tSample, sArray):
+    """
+    Função:
+    ---------
+    Executa simulWorker, usando a cache sempre que possível
 
     Returns
     -------
-    springs : Array de objetos
-        Array com as várias molas/corpos do sistema
-    energy : Array de floats
-        Array com as energias do sistema a cada amostragem
-    time : Array de floats
-        Array com os tempos de cada amostragem
+    res : Tuplo
+        (xList, vList, energy, time, freqs) como em simulWorker
     """
-    t0 = ti.time()
-    size, saveSteps, n, springs, sForce, sAcce0, sAcce1, sAcce2, time, energy = initSimul(Tmax, dt, tSample, sArray, alg = 'Beeman')
-    
-    for i in range(n):
-        springs[i] = Body(sArray[i][0], sArray[i][1], sArray[i][2], sArray[i][3], sArray[i][4], size + 1)
+    res = cacheGet(alg, Tmax, dt, tSample, sArray)
     
-    energy[0] = energyCalc(springs)
-    
-    for i in range(size):
-        if i == 0 :
-            acceCalc(springs, n, sForce, sAcce1)
-            sAcce0 = copy.deepcopy(sAcce1)
-        time[i + 1] = time[i] + tSample
-        sAcce0, sAcce1, sAcce2 = springCalcBeeman(springs, sForce, sAcce0, sAcce1, sAcce2, saveSteps, dt)
-            
-        for j in range(n):
-            springs[j].vList[i + 1] = springs[j].v
-            springs[j].xList[i + 1] = springs[j].x
-        energy[i + 1] = energyCalc(springs)
-        
-    t1 = ti.time()
-    print('Beeman time: ' + str(t1 - t0))
+    if res is None:
+        res = simulWorker(alg, Tmax, dt, tSample, sArray)
+        cachePut(alg, dt, tSample, sArray, res)
         
-    return springs, energy, time
+    return res
 
 #%%
 
-def springSimulRK4(Tmax, dt, tSample, sArray):
+def getPool(teste = None):
     """
     Função:
     ---------
-    Executa a simulação segundo o algoritmo de Runge-Kutta de Ordem 4
+    Cria (uma única vez) a pool de execução e o gestor dos objetos partilhados
 
     Parameters
     ----------
-    Tmax : Float
-        Tempo total da simulação
-    dt : Float
-        Tempo entre passos
-    tSample : Float
-        Tempo entre cada amostragem
-    sArray : Array de strings
-        Array com as características de inicialização de cada corpo indicadas pelo usuário na GUI.
+    teste : Tuplo (opcional)
+        Função e argumentos de uma tarefa. Se não puderem ser enviados para outro processo
+        (pickle) passa a usar-se a pool de threads
 
     Returns
     -------
-    springs : Array de objetos
-        Array com as várias molas/corpos do sistema
-    energy : Array de floats
-        Array com as energias do sistema a cada amostragem
-    time : Array de floats
-        Array com os tempos de cada amostragem
+    pool : Executor
+        Pool de processos, ou de threads se os processos não estiverem disponíveis
     """
-    t0 = ti.time()
-    size, saveSteps, n, springs, sForce, sAcce, time, energy = initSimul(Tmax, dt, tSample, sArray)
+    global pool
+    global threadPool
+    global sharedManager
+    global usarProcessos
     
-    for i in range(n):
-        springs[i] = Body(sArray[i][0], sArray[i][1], sArray[i][2], sArray[i][3], sArray[i][4], size + 1)
+    if sharedManager is None:
+        sharedManager = mp.Manager()
     
-    energy[0] = energyCalc(springs)
+    if usarProcessos and teste is not None:
+        try:
+            pickle.dumps(teste)
+        except (pickle.PicklingError, AttributeError, TypeError):
+            usarProcessos = False
     
-    for i in range(size):
-        time[i + 1] = time[i] + tSample
-        springCalcRK4(springs, sForce, sAcce, saveSteps, dt)
-        
-        for j in range(n):
-            springs[j].vList[i + 1] = springs[j].v
-            springs[j].xList[i + 1] = springs[j].x
-        energy[i + 1] = energyCalc(springs)
-        
-    t1 = ti.time()
-    print('RK4 time: ' + str(t1 - t0))
-        
-    return springs, energy, time
+    if usarProcessos and pool is None:
+        try:
+            pool = ProcessPoolExecutor(max_workers = min(len(algNames), os.cpu_count() or 1))
+        except (OSError, NotImplementedError):
+            usarProcessos = False
+            
+    if not usarProcessos:
+        if threadPool is None:
+            threadPool = ThreadPoolExecutor(max_workers = len(algNames))
+        return threadPool
+    
+    return pool
 
 #%%
 
-def initPlots(springs):
+def plotResult(alg, res):
     """
     Função:
     ---------
-    Inicia a figura e os plots utilizados para animação da simulação
+    Adiciona aos gráficos da execução em curso o resultado de um algoritmo
 
     Parameters
     ----------
-    springs : Array de objetos
-        Array com as várias molas/corpos do sistema
-
-    Returns
-    -------
-    plots : Array de plots
-        Array com 2 plots para a animação: um para representação gráfica dos corpos, e outro das molas
+    alg : String
+        Algoritmo que produziu o resultado
+    res : Tuplo
+        Resultado devolvido por simulWorker
     """
-    size = springs.size # Indicador do número de corpos/molas
-    plots = np.zeros((size, 2), dtype = object) # Cria 2 plots para cada corpo. Um com bolas vermelhas indicadoras de posição, outro com traços da mola
+    xList, vList, energy, t, freqs = res
+    ax, ax2, ax3 = run['axes']
+    estilo = '--' if alg == 'Exata' else '-'
     
-    for i in range(size):
-        plots[i, 0], = plt.plot([], [], "o", color = "red", markersize = 20, zorder = 1) # Bolas vermelhas, na layer superior
-        plots[i, 1], = plt.plot([], [], "-", color = "black", zorder = 0) # Traços pretos, na layer inferior
+    for i in range(xList.shape[1]):
+        ax.plot(t, xList[:, i], estilo, color = algColors[alg], label = 'Mola ' + str(i + 1) + ' - ' + alg)
+        fourier = sc.rfft(xList[:, i])
+        fourierfreq = sc.rfftfreq(xList.shape[0], run['tSample'])
+        ax2.plot(fourierfreq, abs(fourier), estilo, color = algColors[alg], label = 'Mola ' + str(i + 1) + ' - ' + alg)
         
-    return plots
+    if freqs is not None:
+        for f in freqs:
+            ax2.axvline(f, color = 'gray', linestyle = ':') # Frequências exatas dos modos normais
+            
+    ax3.plot(t, energy, estilo, color = algColors[alg], label = alg)
+    
+    for a in run['axes']:
+        a.legend()
+        a.figure.canvas.draw_idle()
 
 #%%
 
-def makeAnimation(i):
+def erroDosProcessos(erro):
     """
     Função:
     ---------
-    Função chamada pela função FuncAnimation, responsável pela animação da simulação
+    Distingue as falhas da pool de processos (processos que morrem, p.ex. por não encontrarem
+    simulWorker, ou argumentos que não podem ser enviados) dos erros das próprias simulações.
+    As tarefas que não passam no pickle já são detetadas antes de submeter, em getPool
 
     Parameters
     ----------
-    i : Objeto do array de frames
-        Contém as posições de certa iteração para todos os corpos
+    erro : Exception
+        Exceção devolvida por uma future
 
     Returns
     -------
-    Nada. Apenas trata de atualizar os dados durante a animação
-    """
-    s = i.size
-
-    if s == 1:
-        plotsAni[0, 0].set_data(i, 0) # Atualiza o valor da posição do corpo
-        springsx = [] # Inicia o array de coordenadas X para cada vértice das molas
-        springsy = [] # Inicia o array de coordenadas Y para cada vértice das molas
-        nsprings = 20 # Indica quantos nodos cada mola terá
-        for k in range(nsprings + 1):
-            springsx.append(k * i/nsprings)
-            springsy.append(0.2 * np.sin(k * np.pi/2)) # Usa-se o sin(k pi/2) de modo ao valor do Y alternar entre positivo e negativo
-        plotsAni[0, 1].set_data(springsx, springsy) # Desenha a mola
-        
-    else: # Neste caso, a posição do nodo das molas deve ter em conta a posição do corpo anterior
-        for j in range(i.size):
-            plotsAni[j, 0].set_data(i[j], 0)
-            springsx = []
-            springsy = []
-            nsprings = 20
-            if j == 0 :
-                for k in range(nsprings + 1):
-                    springsx.append(k * i[j]/nsprings)
-                    springsy.append(0.2 * np.sin(k * np.pi/2))
+    Bool
+        True se a simulação deve ser repetida com threads
+    """
+    return isinstance(erro, (BrokenProcessPool, pickle.PicklingError))
+
+#%%
+
+def pollRuns():
+    """
+    Função:
+    ---------
+    Chamada periodicamente pelo timer da GUI. Desenha os resultados que já chegaram,
+    atualiza o indicador de progresso e, no fim, inicia a animação.
+    """
+    global usarProcessos
+    global pool
+    
+    if run is None:
+        return
+    
+    for alg, fut in list(run['futures'].items()):
+        if run['futures'].get(alg) is not fut or not fut.done(): # Já substituída por uma future das threads
+            continue
+        del run['futures'][alg]
+        
+        if fut.cancelled():
+            continue
+        
+        try:
+            res = fut.result()
+        except Exception as erro:
+            if run['processos'] and erroDosProcessos(erro):
+                # Os processos não funcionam neste ambiente: fecha a pool e repete com threads
+                # esta e todas as simulações que ainda estavam na pool. As que ainda correm num
+                # processo param com o evento de cancelamento antigo; as threads recebem novos
+                usarProcessos = False
+                run['cancel'].set()
+                if pool is not None:
+                    pool.shutdown(wait = False, cancel_futures = True)
+                pool = None
+                run['processos'] = False
+                run['cancel'] = sharedManager.Event()
+                run['progress'] = sharedManager.dict()
+                for a in [alg] + list(run['futures']):
+                    run['futures'][a] = getPool().submit(simulWorker, a, *run['args'], run['progress'], run['cancel'])
             else:
-                for k in range(nsprings + 1):
-                    springsx.append(i[j - 1] + k * (i[j] - i[j - 1])/nsprings)
-                    springsy.append(0.2 * np.sin(k * np.pi/2))
-            plotsAni[j, 1].set_data(springsx, springsy)
+                run['erros'].append(alg + ': ' + type(erro).__name__ + ': ' + str(erro))
+            continue
+        
+        if res is not None:
+            cachePut(alg, *run['args'][1:], res)
+            run['results'][alg] = res
+            plotResult(alg, res)
+    
+    if run['futures']:
+        estado = ' | '.join(alg + ' ' + str(int(100 * run['progress'].get(alg, 0))) + '%' for alg in run['futures'])
+        progressText.set_text('A simular: ' + estado)
+    else:
+        timer.stop()
+        finishRun()
+        
+    gui.canvas.draw_idle()
+
+#%%
+
+def finishRun():
+    """
+    Função:
+    ---------
+    Termina a execução em curso e inicia a animação do último algoritmo escolhido
+    """
+    global ani
+    global plotsAni
+    global run
+    
+    ax, ax2, ax3 = run['axes']
+    ax2.set_xlim([0.1, 2])
+    ax2.set_ylim([0, 20000])
+    
+    if run['cancel'].is_set():
+        progressText.set_text('Simulação cancelada')
+    elif run['erros']:
+        progressText.set_text('Erro: ' + '; '.join(run['erros']))
+    else:
+        progressText.set_text('Simulação concluída')
     
+    feitos = [alg for alg in algNames if alg in run['results']]
+    
+    if feitos:  #A animação começa a ser executada a partir desta linha
+        xList, vList, energy, t, freqs = run['results'][feitos[-1]]
+        an = makeBodies(run['m'], run['k'], run['xEq'], xList[-1], vList[-1], xList, vList)
+        r = aniFrames(xList, run['tSample'])
+        
+        figAni, axAni = plt.subplots(figsize = (10, 4))
+        axAni.set_xlim(0, np.amax(r) * 1.1)
+        axAni.set_ylim(-5, 5)
+        axAni.set_xlabel('x (m)')
+        axAni.get_yaxis().set_visible(False)
+        plotsAni = initPlots(an, axAni)
+        figAni.suptitle(algTitles[feitos[-1]], fontsize = 16)
+        ani = animation.FuncAnimation(figAni, makeAnimation, frames = r, interval = 1000 / aniFps, blit = True)
+        
+    run = None
+
 #%%
 
 def runGui(*args):
     """
     Função:
     ---------
-    Inicia as simulações com as características selecionadas após se premir o botão Run da GUI
+    Submete as simulações selecionadas à pool em segundo plano após se premir o botão Run da GUI.
+    A GUI continua a responder e cada gráfico é preenchido à medida que os resultados chegam.
 
     Parameters
     ----------
@@ -642,10 +1509,12 @@ def runGui(*args):
     -------
     None.
     """
-    global ani
-    global plotsAni
+    global run
     global springTextArray
     
+    if run is not None: # Já existe uma execução em curso
+        return
+    
     alg = algcb.get_status()
     
     tmax = float(tmaxtb.text) # Vai buscar o valor introduzido pelo utilizador
@@ -678,76 +1547,47 @@ def runGui(*args):
     ax3.set_xlabel('Tempo (s)')
     ax3.set_ylabel('Energia (J)')
     
+    executor = getPool((simulWorker, tmax, dt, tSample, molas))
+    progress = sharedManager.dict()
+    cancel = sharedManager.Event()
     
-    # Consoante os algorítmos escolhidos, o programa irá fazer os cálculos e gráficos.
-    if alg[0] == True:  
-        a, b, t = springSimulCromer(tmax, dt, tSample, molas)
-        for i in range(a.size):
-            ax.plot(t, a[i].xList, color = 'blue', label = 'Mola ' + str(i + 1) + ' - Euler-Cromer')
-            fourier = sc.rfft(a[i].xList)
-            fourierfreq = sc.rfftfreq(a[0].xList.size, tSample)
-            ax2.plot(fourierfreq, abs(fourier), color = 'blue', label = 'Mola ' + str(i + 1) + ' - Euler-Cromer')
-        ax3.plot(t, b, color = 'blue', label = 'Euler-Cromer')
-        an = a
-        nome = 'Animação: Método de Euler-Cromer'
-        
-    if alg[1] == True:
-        a2, b2, t2 = springSimulVerlet(tmax, dt, tSample, molas)
-        for i in range(a2.size):
-            ax.plot(t2, a2[i].xList, color = 'darkorange', label = 'Mola ' + str(i + 1) + ' - Verlet')
-            fourier2 = sc.rfft(a2[i].xList)
-            fourierfreq = sc.rfftfreq(a2[0].xList.size, tSample)
-            ax2.plot(fourierfreq, abs(fourier2), color = 'darkorange', label = 'Mola ' + str(i + 1) + ' - Verlet')
-        ax3.plot(t2, b2, color = 'darkorange', label = 'Verlet')
-        an = a2
-        nome = 'Animação: Método de Verlet'
-        
-    if alg[2] == True:
-        a3, b3, t3 = springSimulBeeman(tmax, dt, tSample, molas)
-        for i in range(a3.size):
-            ax.plot(t3, a3[i].xList, color = 'seagreen', label ='Mola ' + str(i + 1)+ ' - Beeman')
-            fourier3 = sc.rfft(a3[i].xList)
-            fourierfreq = sc.rfftfreq(a3[0].xList.size, tSample)
-            ax2.plot(fourierfreq, abs(fourier3), color = 'seagreen', label = 'Mola ' + str(i + 1) + ' - Beeman')
-        ax3.plot(t3, b3, color = 'seagreen', label = 'Beeman')
-        an = a3
-        nome = 'Animação: Método de Beeman'
-            
-    if alg[3] == True:
-        a4, b4, t4 = springSimulRK4(tmax, dt, tSample, molas)
-        for i in range(a4.size):
-            ax.plot(t4, a4[i].xList, color = 'r', label = 'Mola ' + str(i + 1) + ' - RK4')
-            fourier4 = sc.rfft(a4[i].xList)
-            fourierfreq = sc.rfftfreq(a4[0].xList.size, tSample)
-            ax2.plot(fourierfreq, abs(fourier4), color = 'r', label = 'Mola ' + str(i + 1) + ' - RK4')
-        ax3.plot(t4, b4, color = 'r', label = 'RK4')
-        an = a4
-        nome = 'Animação: Runge-Kutta de Ordem 4'
-            
-    ax.legend()
-    ax2.legend()
-    ax3.legend()
-    ax2.set_xlim([0.1, 2])
-    ax2.set_ylim([0, 20000])
-        
-    #A animação começa a ser executada a partir desta linha
-    if an.size == 1:
-        r = an[0].xList
-    else:
-        for i in range(an.size - 1):
-            if i == 0:
-                r = np.column_stack((an[0].xList, an[1].xList))
+    # Cada algoritmo escolhido é submetido de forma independente; os resultados chegam por qualquer ordem.
+    # Os que já existem na cache são desenhados logo.
+    futures = {}
+    guardados = {}
+    for j in range(len(algNames)):
+        if alg[j] == True:
+            res = cacheGet(algNames[j], tmax, dt, tSample, molas)
+            if res is None:
+                futures[algNames[j]] = executor.submit(simulWorker, algNames[j], tmax, dt, tSample, molas, progress, cancel)
             else:
-                r = np.column_stack((r, an[i + 1].xList))
-            
-    figAni, axAni = plt.subplots(figsize = (10, 4))
-    axAni.set_xlim(0, np.amax(r) * 1.1)
-    axAni.set_ylim(-5, 5)
-    axAni.set_xlabel('x (m)')
-    axAni.get_yaxis().set_visible(False)
-    plotsAni = initPlots(an)
-    figAni.suptitle(nome, fontsize = 16)
-    ani = animation.FuncAnimation(figAni, makeAnimation, frames = r, interval = .1)
+                guardados[algNames[j]] = res
+    
+    sArray = np.asarray(molas, dtype = float)
+    run = {'futures': futures, 'results': {}, 'erros': [], 'axes': (ax, ax2, ax3), 'args': (tmax, dt, tSample, molas),
+           'tSample': tSample, 'progress': progress, 'cancel': cancel, 'processos': usarProcessos,
+           'm': sArray[:, 0], 'k': sArray[:, 1], 'xEq': sArray[:, 2]}
+    
+    for nome, res in guardados.items():
+        run['results'][nome] = res
+        plotResult(nome, res)
+    
+    progressText.set_text('A simular...')
+    timer.start()
+
+#%%
+
+def cancelRun(*args):
+    """
+    Função:
+    ---------
+    Cancela a execução em curso: as simulações ainda na fila não começam e as que estão a correr param na próxima verificação
+    """
+    if run is not None:
+        run['cancel'].set()
+        for fut in run['futures'].values():
+            fut.cancel()
+        progressText.set_text('A cancelar...')
 
 #%%
 
@@ -868,7 +1708,7 @@ springTextArray.append(sA0)
 
 #Checkboxes
 algax = plt.axes([0.65, 0.65, 0.12, 0.2])
-algcb = CheckButtons(algax, ['Euler-Cromer', 'Verlet', 'Beeman', 'RK4'])
+algcb = CheckButtons(algax, algNames)
 
 #Botões
 runax = plt.axes([0.70, 0.3, 0.2, 0.2])
@@ -887,6 +1727,15 @@ fScreenax = plt.axes([0.70, 0.2, 0.08, 0.05])
 FSbut = Button(fScreenax,'Full Screen')
 FSbut.on_clicked(fullScreen)
 
+cancelax = plt.axes([0.70, 0.12, 0.2, 0.05])
+cancelbut = Button(cancelax, 'Cancelar')
+cancelbut.on_clicked(cancelRun)
+
+progressText = gui.text(0.70, 0.53, '') # Indicador de progresso das simulações
+
+timer = gui.canvas.new_timer(interval = 200) # Verifica periodicamente os resultados das simulações
+timer.add_callback(pollRuns)
+
 closeax = plt.axes([0.82, 0.2, 0.08, 0.05])
 closebut = Button(closeax, 'Exit')
 closebut.on_clicked(exitSim)
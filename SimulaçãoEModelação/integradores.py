@@ -0,0 +1,491 @@
+"""
+Integradores partilhados pelas simulações (difEqs, multiPlanetas e mola)
+
+Todos os métodos trabalham sobre arrays de estado x, v de qualquer forma, atualizados no lugar,
+e recebem uma função de aceleração vetorizada aFun(x, out) que escreve em out as acelerações
+para as posições x. Os arrays auxiliares de cada método são criados uma vez por initBuffers,
+pelo que os passos não fazem alocações.
+
+Inclui também a propagação kepleriana exata em variáveis universais (kepler), usada pela
+solução analítica de difEqs e pelo drift do mapa de Wisdom-Holman de multiPlanetas.
+"""
+import warnings
+import numpy as np
+
+#%%
+
+def euler(x, v, aFun, buf, nPassos, dt):
+    """
+    Função:
+    ---------
+    Executa nPassos do método de Euler: x e v avançam com a velocidade e aceleração do início do passo
+
+    Parameters
+    ----------
+    x, v : Arrays de floats
+        Posições e velocidades instantâneas, atualizadas no lugar
+    aFun : Função
+        Função de aceleração aFun(x, out)
+    buf : Lista de arrays
+        [a, tmp], criada por initBuffers
+    nPassos : Int
+        Número de passos a executar
+    dt : float
+        Tempo entre passos
+    """
+    a, tmp = buf
+    passo = 0
+
+    while passo < nPassos:
+        aFun(x, a)
+        np.multiply(v, dt, out = tmp)
+        x += tmp
+        a *= dt
+        v += a
+        passo += 1
+
+#%%
+
+def eulerCromer(x, v, aFun, buf, nPassos, dt):
+    """
+    Função:
+    ---------
+    Executa nPassos do método de Euler-Cromer: a velocidade é atualizada primeiro e usada para a posição
+
+    Parameters
+    ----------
+    Ver euler. buf = [a, tmp]
+    """
+    a, tmp = buf
+    passo = 0
+
+    while passo < nPassos:
+        aFun(x, a)
+        a *= dt
+        v += a
+        np.multiply(v, dt, out = tmp)
+        x += tmp
+        passo += 1
+
+#%%
+
+def verlet(x, v, aFun, buf, nPassos, dt):
+    """
+    Função:
+    ---------
+    Executa nPassos do método de Verlet (posições), com a velocidade dada pela diferença central
+
+    Parameters
+    ----------
+    Ver euler. buf = [a, xLast], sendo xLast a posição do passo anterior
+    """
+    a, xLast = buf
+    passo = 0
+
+    while passo < nPassos:
+        aFun(x, a) # Atualiza a nova aceleração
+        a *= dt * dt
+        np.subtract(x, xLast, out = v)
+        xLast[...] = x # Atualiza a posição anterior
+        x += v # Nova posição: 2x - xLast + a dt^2
+        x += a
+        v *= 2 # Nova velocidade: (xNovo - xLast) / (2 dt)
+        v += a
+        v /= 2 * dt
+        passo += 1
+
+#%%
+
+def beeman(x, v, aFun, buf, nPassos, dt):
+    """
+    Função:
+    ---------
+    Executa nPassos do método de Beeman
+
+    Parameters
+    ----------
+    Ver euler. buf = [a0, a1, a2, tmp]: acelerações do passo anterior, atual e do próximo passo.
+    As acelerações são rodadas dentro de buf (sem cópias).
+    """
+    a0, a1, a2, tmp = buf
+    passo = 0
+
+    while passo < nPassos:
+        np.multiply(a1, 4, out = tmp) # Posições: x + v dt + (4 a1 - a0) dt^2 / 6
+        tmp -= a0
+        tmp *= dt ** 2 / 6
+        x += tmp
+        np.multiply(v, dt, out = tmp)
+        x += tmp
+        aFun(x, a2) # Atualiza a nova aceleração
+        np.multiply(a1, 5, out = tmp) # Velocidades: v + (2 a2 + 5 a1 - a0) dt / 6
+        tmp += a2
+        tmp += a2
+        tmp -= a0
+        tmp *= dt / 6
+        v += tmp
+
+        a0, a1, a2 = a1, a2, a0  # A atual passa a anterior e a próxima a atual
+
+        passo += 1
+
+    buf[0], buf[1], buf[2] = a0, a1, a2
+
+#%%
+
+def rk4(x, v, aFun, buf, nPassos, dt):
+    """
+    Função:
+    ---------
+    Executa nPassos do método de Runge-Kutta de Ordem 4
+
+    Parameters
+    ----------
+    Ver euler. buf = [a, xs, kx, kv, sx, sv]: aceleração, posição intermédia, dx e dv da iteração RK e as suas somas pesadas
+    """
+    a, xs, kx, kv, sx, sv = buf
+    passo = 0
+
+    while passo < nPassos:
+        np.multiply(v, dt, out = kx) # dx e dv da 1a iteração RK
+        aFun(x, a)
+        np.multiply(a, dt, out = kv)
+        sx[...] = kx
+        sv[...] = kv
+
+        for c, w in ((0.5, 2), (0.5, 2), (1, 1)): # 2a, 3a e 4a iterações RK
+            np.multiply(kx, c, out = xs) # Posição intermédia
+            xs += x
+            np.multiply(kv, c, out = kx) # Novo dx, calculado com o dv anterior
+            kx += v
+            kx *= dt
+            aFun(xs, a) # Aceleração intermédia
+            np.multiply(a, dt, out = kv)
+            np.multiply(kx, w, out = xs)
+            sx += xs
+            np.multiply(kv, w, out = xs)
+            sv += xs
+
+        sx /= 6
+        sv /= 6
+        x += sx
+        v += sv
+
+        passo += 1
+
+#%%
+
+def _dois(x, v, aFun, dt, *extra):
+    return [np.zeros_like(x), np.zeros_like(x)]
+
+def _verlet(x, v, aFun, dt, *extra):
+    return [np.zeros_like(x), x - v * dt]
+
+def _beeman(x, v, aFun, dt, *extra):
+    a1 = np.zeros_like(x)
+    aFun(x, a1)
+    return [a1.copy(), a1, np.zeros_like(x), np.zeros_like(x)]
+
+def _rk4(x, v, aFun, dt, *extra):
+    return [np.zeros_like(x) for i in range(6)]
+
+steppers = {'Euler': euler, 'Euler-Cromer': eulerCromer, 'Verlet': verlet, 'Beeman': beeman, 'RK4': rk4}
+bufferMakers = {'Euler': _dois, 'Euler-Cromer': _dois, 'Verlet': _verlet, 'Beeman': _beeman, 'RK4': _rk4}
+
+#%%
+
+def registar(nome, stepper, buffers):
+    """
+    Função:
+    ---------
+    Junta um método de uma simulação aos disponíveis (por exemplo um método implícito próprio de um modelo)
+
+    Parameters
+    ----------
+    nome : String
+        Nome do método
+    stepper : Função
+        stepper(x, v, aFun, buf, nPassos, dt), como os restantes
+    buffers : Função
+        buffers(x, v, aFun, dt, *extra) que devolve a lista buf (extra são dados próprios do modelo)
+    """
+    steppers[nome] = stepper
+    bufferMakers[nome] = buffers
+
+#%%
+
+def initBuffers(alg, x, v, aFun, dt, *extra):
+    """
+    Função:
+    ---------
+    Cria os arrays auxiliares do método alg para o estado x, v
+
+    Returns
+    -------
+    buf : Lista de arrays
+        Arrays a passar em todos os passos de steppers[alg]
+    """
+    return bufferMakers[alg](x, v, aFun, dt, *extra)
+
+#%%
+
+class Resultado:            #   Resultado uniforme dos integradores: amostragens de tempo, posição e velocidade
+    def __init__(self, tAmostra, size, x, v, n):
+        self.tAmostra = tAmostra #   Tempo entre amostragens
+        self.size = size    #   Número de amostragens pedidas (sem contar o estado inicial)
+        self.x = x          #   Posições amostradas (amostragens, ...)
+        self.v = v          #   Velocidades amostradas
+        self.n = n          #   Número de amostragens feitas (pode ser menor que size se for interrompido)
+
+    @property
+    def t(self):            #   Tempo de cada amostragem, criado só quando é pedido (a memória não cresce com size)
+        return np.arange(self.size + 1) * self.tAmostra
+
+#%%
+
+def integrar(x, v, aFun, dt, nPassos, size, alg = 'RK4', amostra = None, xOut = None, vOut = None, proj = None, buf = None):
+    """
+    Função:
+    ---------
+    Integra o estado x, v durante size amostragens de nPassos passos cada, guardando as amostragens em arrays pré-alocados
+
+    Parameters
+    ----------
+    x, v : Arrays de floats
+        Estado inicial, atualizado no lugar até ao estado final
+    aFun : Função
+        Função de aceleração aFun(x, out)
+    dt : Float
+        Tempo entre passos
+    nPassos : Int
+        Passos entre amostragens
+    size : Int
+        Número de amostragens (sem contar o estado inicial)
+    alg : String
+        Chave de steppers
+    amostra : Função (opcional)
+        amostra(i, x, v), chamada após cada amostragem i (energia, progresso, ...). Se devolver False a integração pára.
+    xOut, vOut : Arrays (opcional)
+        Onde guardar as amostragens. Se tiverem uma só linha, guarda-se apenas a mais recente (memória constante).
+        Por defeito são alocados com size + 1 linhas.
+    proj : Função (opcional)
+        proj(x) escolhe a parte do estado a guardar (por exemplo só alguns corpos)
+    buf : Lista de arrays (opcional)
+        Arrays auxiliares já criados por initBuffers
+
+    Returns
+    -------
+    res : Resultado
+        Com t, x, v das amostragens e o número de amostragens feitas
+    """
+    proj = (lambda y: y) if proj is None else proj
+    step = steppers[alg]
+    buf = initBuffers(alg, x, v, aFun, dt) if buf is None else buf
+
+    if xOut is None:
+        xOut = np.zeros((size + 1,) + np.shape(proj(x)), dtype = float)
+    if vOut is None:
+        vOut = np.zeros((size + 1,) + np.shape(proj(v)), dtype = float)
+    xOut[0] = proj(x)
+    vOut[0] = proj(v)
+    ultima = xOut.shape[0] == 1 # Guarda apenas a amostragem mais recente
+
+    for i in range(1, size + 1):
+        step(x, v, aFun, buf, nPassos, dt)
+        j = 0 if ultima else i
+        xOut[j] = proj(x)
+        vOut[j] = proj(v)
+
+        if amostra is not None and amostra(i, x, v) is False:
+            return Resultado(nPassos * dt, size, xOut, vOut, i)
+
+    return Resultado(nPassos * dt, size, xOut, vOut, size)
+
+#%%
+
+def stumpff(z):
+    """
+    Função:
+    ---------
+    Calcula as funções de Stumpff C(z) e S(z)
+
+    Parameters
+    ----------
+    z : Array de floats
+        Valores de alpha * chi^2
+
+    Returns
+    -------
+    C, S : Arrays de floats
+        Com a mesma forma de z
+    """
+    z = np.asarray(z, dtype = float)
+    C = np.empty_like(z)
+    S = np.empty_like(z)
+
+    # Perto de zero usa-se a série de Taylor para evitar cancelamento
+    pos = z > 1e-6
+    neg = z < -1e-6
+    zero = ~(pos | neg)
+
+    sz = np.sqrt(z[pos])
+    C[pos] = (1 - np.cos(sz)) / z[pos]
+    S[pos] = (sz - np.sin(sz)) / sz ** 3
+
+    sz = np.sqrt(-z[neg])
+    C[neg] = (np.cosh(sz) - 1) / -z[neg]
+    S[neg] = (np.sinh(sz) - sz) / sz ** 3
+
+    C[zero] = 1 / 2 - z[zero] / 24
+    S[zero] = 1 / 6 - z[zero] / 120
+
+    return C, S
+
+#%%
+
+def kepler(r0, v0, dt, GM = 4. * np.pi ** 2, tol = 1e-12, maxIter = 100):
+    """
+    Função:
+    ---------
+    Propaga órbitas keplerianas à volta de um corpo fixo na origem, resolvendo a equação de Kepler
+    universal para todas as órbitas e tempos de uma vez (elípticas, parabólicas e hiperbólicas).
+
+    A função de Kepler é crescente em chi (a derivada é o raio), por isso a raiz é primeiro isolada
+    num intervalo e sempre que o passo de Halley sai do intervalo faz-se uma bisseção, o que mantém
+    a convergência em órbitas muito excêntricas. Se alguma solução não convergir é emitido um aviso.
+    Nas órbitas ligadas o raio está entre o periélio e o afélio, o que dá o intervalo diretamente;
+    só as restantes precisam de o procurar.
+
+    Os passos curtos em relação ao período (como nos integradores simpléticos, que chamam esta
+    função em cada passo) começam da série de chi em potências de dt e convergem em duas iterações.
+
+    Parameters
+    ----------
+    r0, v0 : Arrays de floats (..., dim)
+        Posições e velocidades iniciais
+    dt : Float ou array
+        Tempo a propagar, com forma compatível com r0.shape[:-1]
+    GM : Float
+        Parâmetro gravitacional do corpo central
+    tol : Float
+        Tolerância relativa na variável universal chi
+    maxIter : Int
+        Número máximo de iterações
+
+    Returns
+    -------
+    r, v : Arrays de floats
+        Posições e velocidades ao fim de dt, com a forma de r0 e dt combinadas
+    """
+    r0 = np.asarray(r0, dtype = float)
+    v0 = np.asarray(v0, dtype = float)
+    forma = np.broadcast_shapes(r0.shape[:-1], np.shape(dt))
+    dim = r0.shape[-1]
+    r0 = np.broadcast_to(r0, forma + (dim,)).reshape(-1, dim)
+    v0 = np.broadcast_to(v0, forma + (dim,)).reshape(-1, dim)
+    dt = np.broadcast_to(np.asarray(dt, dtype = float), forma).reshape(-1).copy()
+
+    sqGM = np.sqrt(GM)
+    r0Norm = np.sqrt((r0 * r0).sum(axis = 1))
+    rv0 = (r0 * v0).sum(axis = 1)
+    alpha = 2 / r0Norm - (v0 * v0).sum(axis = 1) / GM # Inverso do semi-eixo maior
+
+    # Nas órbitas elípticas só interessa o tempo módulo o período
+    eli = alpha > 1e-12
+    dt[eli] = np.fmod(dt[eli], 2 * np.pi / (sqGM * alpha[eli] ** 1.5))
+
+    # Estimativa inicial: elíptica, hiperbólica (Vallado) ou parabólica
+    chi = sqGM * dt / r0Norm
+    chi[eli] = sqGM * alpha[eli] * dt[eli]
+    hip = alpha < -1e-12
+    if hip.any():
+        a = 1 / alpha[hip]
+        sinal = np.sign(dt[hip])
+        with np.errstate(divide = 'ignore', invalid = 'ignore'): # dt = 0 dá 0/0, tratado abaixo
+            arg = -2 * GM * alpha[hip] * dt[hip] / (rv0[hip] + sinal * np.sqrt(-GM * a) * (1 - r0Norm[hip] * alpha[hip]))
+            chiHip = sinal * np.sqrt(-a) * np.log(np.abs(arg))
+        chi[hip] = np.where(np.isfinite(chiHip) & (arg != 0), chiHip, chi[hip])
+
+    k1 = rv0 / sqGM
+    k2 = 1 - alpha * r0Norm
+
+    # Passos curtos: inversão da série F = r0 chi + k1 chi^2 / 2 + k2 chi^3 / 6 + ..., com erro O(x^4)
+    x = sqGM * dt / r0Norm
+    curto = np.abs(x) < 0.5
+    chi[curto] = (x - k1 / (2 * r0Norm) * x ** 2 + (k1 ** 2 / (2 * r0Norm ** 2) - k2 / (6 * r0Norm)) * x ** 3)[curto]
+
+    def funcao(chi, j = slice(None)):
+        # Função de Kepler e as duas primeiras derivadas (a primeira é o raio r), nas soluções j
+        z = alpha[j] * chi ** 2
+        C, S = stumpff(z)
+        F = k1[j] * chi ** 2 * C + k2[j] * chi ** 3 * S + r0Norm[j] * chi - sqGM * dt[j]
+        dF = k1[j] * chi * (1 - z * S) + k2[j] * chi ** 2 * C + r0Norm[j]
+        d2F = k1[j] * (1 - z * C) + k2[j] * chi * (1 - z * S)
+        return F, dF, d2F
+
+    # Intervalo com a raiz: F(0) = -sqGM dt, por isso a raiz tem o sinal de dt.
+    # Nas órbitas ligadas dF/dchi = r está entre o periélio e o afélio, logo
+    # sqGM |dt| / rMax <= |chi| <= sqGM |dt| / rMin (alargado pelos arredondamentos)
+    lado = np.where(dt < 0, -1., 1.)
+    h2 = np.maximum((r0Norm * r0Norm) * (v0 * v0).sum(axis = 1) - rv0 * rv0, 0)
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        e = np.sqrt(np.maximum(1 - alpha * h2 / GM, 0))
+        rMin = h2 / (GM * (1 + e))
+        bMin = sqGM * np.abs(dt) * alpha / (1 + e) * (1 - 1e-8)
+        b = sqGM * np.abs(dt) / rMin * (1 + 1e-8)
+    fechado = eli & (rMin > 0) & np.isfinite(b)
+    bMin = np.where(fechado, bMin, 0.)
+
+    # Nas restantes duplica-se |chi| até F mudar de sinal (ou deixar de ser finito nas hiperbólicas)
+    aberto = np.flatnonzero(~fechado)
+    if aberto.size > 0:
+        bA = np.maximum(np.abs(chi[aberto]), sqGM * np.abs(dt[aberto]) / r0Norm[aberto]) + 1e-300
+        with np.errstate(over = 'ignore', invalid = 'ignore'):
+            for it in range(2000):
+                F, dF, d2F = funcao(lado[aberto] * bA, aberto)
+                falta = np.isfinite(F) & (lado[aberto] * F < 0)
+                if not falta.any():
+                    break
+                bA[falta] *= 2
+        b[aberto] = bA
+    lo = np.where(lado > 0, bMin, -b)
+    hi = np.where(lado > 0, b, -bMin)
+    chi = np.clip(chi, lo, hi)
+
+    ativo = dt != 0
+    chi[~ativo] = 0
+    it = 0
+    while ativo.any() and it < maxIter:
+        with np.errstate(over = 'ignore', invalid = 'ignore', divide = 'ignore'):
+            F, dF, d2F = funcao(chi)
+            passou = ~np.isfinite(F) # Como no intervalo: F não finito está para lá da raiz
+            lo = np.where((F < 0) | (passou & (lado < 0)), chi, lo)
+            hi = np.where((F > 0) | (passou & (lado > 0)), chi, hi)
+            novo = chi - 2 * F * dF / (2 * dF * dF - F * d2F) # Halley (convergência cúbica)
+            fora = ~((novo >= lo) & (novo <= hi)) # Inclui os passos não finitos
+            novo[fora] = 0.5 * (lo[fora] + hi[fora])
+            passo = np.where(ativo, novo - chi, 0)
+            chi += passo
+            # Perto da raiz (passo já pequeno), depois de um passo que não foi bisseção, o erro que resta é
+            # da ordem de passo^2 d2F / (2 dF): evita-se uma iteração só para ver que o passo seguinte é nulo
+            escala = tol * np.maximum(1, np.abs(chi))
+            perto = ~fora & (np.abs(passo) <= np.sqrt(escala))
+            resto = np.where(perto, passo * passo * np.abs(d2F / (2 * dF)), np.abs(passo))
+        ativo &= ~(resto <= escala) & (hi - lo > escala) # Estimativas não finitas continuam
+        it += 1
+
+    if ativo.any():
+        warnings.warn('kepler: ' + str(ativo.sum()) + ' soluções não convergiram em ' + str(maxIter) + ' iterações', RuntimeWarning)
+
+    # Coeficientes de Lagrange
+    z = alpha * chi ** 2
+    C, S = stumpff(z)
+    f = 1 - chi ** 2 / r0Norm * C
+    g = dt - chi ** 3 / sqGM * S
+    r = f[:, None] * r0 + g[:, None] * v0
+    rNorm = np.sqrt((r * r).sum(axis = 1))
+    fDot = sqGM / (rNorm * r0Norm) * (z * chi * S - chi)
+    gDot = 1 - chi ** 2 / rNorm * C
+    v = fDot[:, None] * r0 + gDot[:, None] * v0
+
+    return r.reshape(forma + (dim,)), v.reshape(forma + (dim,))
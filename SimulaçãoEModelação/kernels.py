@@ -0,0 +1,725 @@
+"""
+Kernels compilados (opcionais) dos ciclos escalares das simulações
+
+Os ciclos de Metropolis em ordem aleatória (ferroMagGoncalo), os turnos dos predadores (Ecossis),
+a soma direta das forças gravíticas e a equação de Kepler do Wisdom-Holman (multiPlanetas) e o RK4
+da cadeia de molas (mola) são sequenciais e cheios de ramos, ou chamados em cada passo com arrays
+tão pequenos que o custo está todo no NumPy, pelo que a vetorização não os cobre por completo. Se o Numba estiver
+instalado estes ciclos são compilados; caso contrário usam-se as versões em NumPy.
+
+A escolha é feita em cada chamada (argumento kernels = 'numba' ou 'numpy') ou, por defeito, pela
+variável de ambiente SIMUL_KERNELS. Sem nenhuma das duas usa-se o Numba se estiver disponível.
+Pedir 'numba' sem o Numba instalado recai em 'numpy'.
+
+compararBackends() verifica que os dois backends dão resultados estatisticamente iguais.
+"""
+import os
+import warnings
+import numpy as np
+import integradores as ig
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+#%%
+
+def _jit(f):
+    # Compila f se o Numba estiver disponível (a versão Python fica em f.py_func)
+    if numba is None:
+        return f
+    return numba.njit(cache = True)(f)
+
+def _python(f):
+    return getattr(f, 'py_func', f)
+
+#%%
+
+def escolher(kernels = None):
+    """
+    Função:
+    ---------
+    Decide o backend a usar
+
+    Parameters
+    ----------
+    kernels : String ou None
+        'numba' ou 'numpy'. Se None, usa a variável de ambiente SIMUL_KERNELS e, sem esta,
+        'numba' se estiver instalado
+
+    Returns
+    -------
+    backend : String
+        'numba' ou 'numpy' (este último sempre que o Numba não está instalado)
+    """
+    if kernels is None:
+        kernels = os.environ.get('SIMUL_KERNELS', 'numba')
+    kernels = kernels.lower()
+    if kernels not in ('numba', 'numpy'):
+        raise ValueError("Backend desconhecido: '" + kernels + "' (use 'numba' ou 'numpy')")
+    if numba is None:
+        return 'numpy'
+    return kernels
+
+#%%
+
+@_jit
+def _metropolisSeq(spins, ordem, u, t, h):
+    nx, ny = spins.shape
+    for z in range(ordem.size):
+        i = ordem[z] // ny
+        j = ordem[z] % ny
+        delta = spins[i - 1, j] + spins[i, j - 1] + spins[(i + 1) % nx, j] + spins[i, (j + 1) % ny]
+        deltaE = (2 * delta + h) * spins[i, j]
+        if deltaE <= 0 or u[z] < np.exp(-deltaE / t):
+            spins[i, j] = -spins[i, j]
+
+def _metropolisXadrez(spins, u, t, h):
+    nx, ny = spins.shape
+    cor = np.add.outer(np.arange(nx), np.arange(ny)) % 2
+    for c in (0, 1): # Os pontos de uma cor só têm vizinhos da outra, por isso são atualizados todos juntos
+        delta = np.roll(spins, 1, 0) + np.roll(spins, -1, 0) + np.roll(spins, 1, 1) + np.roll(spins, -1, 1)
+        deltaE = (2 * delta + h) * spins
+        with np.errstate(over = 'ignore'):
+            aceita = (deltaE <= 0) | (u < np.exp(-deltaE / t))
+        spins[aceita & (cor == c)] *= -1
+
+def metropolis(spins, t, h, kernels = None):
+    """
+    Função:
+    ---------
+    Faz uma passagem de Metropolis por todos os pontos da rede de spins (fronteiras periódicas).
+    A variação de energia de inverter o spin s com soma dos vizinhos delta é (2 delta + h) s.
+
+    Com o Numba os pontos são visitados um a um, numa ordem aleatória, como em runCycleRnd.
+    Em NumPy a rede é dividida em xadrez e cada metade é atualizada de uma vez; a dinâmica é outra,
+    mas a distribuição de equilíbrio é a mesma. Com dimensões ímpares o xadrez não é válido nas
+    fronteiras periódicas e usa-se o ciclo sequencial em Python.
+
+    Parameters
+    ----------
+    spins : Array de floats (nx, ny)
+        Estados (+1 ou -1), atualizados no lugar
+    t : Float
+        Temperatura
+    h : Float
+        Campo externo
+    kernels : String ou None
+        Ver escolher
+    """
+    nx, ny = spins.shape
+    if escolher(kernels) == 'numba':
+        _metropolisSeq(spins, np.random.permutation(nx * ny), np.random.random(nx * ny), t, h)
+    elif nx % 2 or ny % 2:
+        _python(_metropolisSeq)(spins, np.random.permutation(nx * ny), np.random.random(nx * ny), t, h)
+    else:
+        _metropolisXadrez(spins, np.random.random(spins.shape), t, h)
+
+#%%
+
+@_jit
+def _turno(typ, siz, pos, cnt, vivo, idx, tipo, perms):
+    # Listas de posições em arrays: pos[c, :cnt[c]] são as posições do tipo c e vivo[c] indica as que
+    # ainda estão na lista (as removidas são marcadas e só retiradas no fim, mantendo a ordem).
+    # idx[i, j] é o índice da célula (i, j) na lista do seu tipo.
+    nx, ny = typ.shape
+    di = np.array((-1, 0, 1, 0))
+    dj = np.array((0, -1, 0, 1))
+    n = cnt[tipo]
+
+    for k in range(n):
+        i = pos[tipo, k, 0]
+        j = pos[tipo, k, 1]
+
+        fi = -1 # Procura de alimento (tipo - 1) nos vizinhos, em ordem aleatória
+        fj = -1
+        for d in perms[k, 0]:
+            a = (i + di[d]) % nx
+            b = (j + dj[d]) % ny
+            if typ[a, b] == tipo - 1:
+                fi = a
+                fj = b
+                break
+
+        if fi >= 0:
+            expande = siz[i, j] == 2
+            if siz[i, j] < 2:
+                siz[i, j] += 1
+            if siz[fi, fj] > 0:
+                siz[fi, fj] -= 1
+            else: # O alimento morreu
+                typ[fi, fj] = 0
+                vivo[tipo - 1, idx[fi, fj]] = False
+                c = cnt[0]
+                pos[0, c, 0] = fi
+                pos[0, c, 1] = fj
+                vivo[0, c] = True
+                idx[fi, fj] = c
+                cnt[0] = c + 1
+            if not expande:
+                continue
+            novo = 0 # Um novo ser vivo de nível 0
+        else:
+            if siz[i, j] > 0:
+                siz[i, j] -= 1
+            else: # Morreu ao enfraquecer
+                typ[i, j] = 0
+                vivo[tipo, k] = False
+                c = cnt[0]
+                pos[0, c, 0] = i
+                pos[0, c, 1] = j
+                vivo[0, c] = True
+                idx[i, j] = c
+                cnt[0] = c + 1
+                continue
+            novo = siz[i, j] # Muda-se para outra célula
+
+        ei = -1 # Procura de espaço: células de tipo inferior
+        ej = -1
+        for d in perms[k, 1]:
+            a = (i + di[d]) % nx
+            b = (j + dj[d]) % ny
+            if typ[a, b] < tipo:
+                ei = a
+                ej = b
+                break
+        if ei < 0:
+            continue
+
+        vivo[typ[ei, ej], idx[ei, ej]] = False
+        typ[ei, ej] = tipo
+        siz[ei, ej] = novo
+        c = cnt[tipo]
+        pos[tipo, c, 0] = ei
+        pos[tipo, c, 1] = ej
+        vivo[tipo, c] = True
+        idx[ei, ej] = c
+        cnt[tipo] = c + 1
+
+        if fi < 0: # A célula antiga fica vazia
+            typ[i, j] = 0
+            vivo[tipo, k] = False
+            c = cnt[0]
+            pos[0, c, 0] = i
+            pos[0, c, 1] = j
+            vivo[0, c] = True
+            idx[i, j] = c
+            cnt[0] = c + 1
+
+def turnoBuffers(nx, ny):
+    """
+    Função:
+    ---------
+    Cria os arrays de trabalho de turno para uma rede nx x ny, para serem reutilizados em todos os turnos
+
+    Parameters
+    ----------
+    nx, ny : Ints
+        Dimensões da rede
+
+    Returns
+    -------
+    buffers : Tuplo (pos, vivo, cnt, idx)
+        Listas de posições de cada tipo e respetivos índices na rede (ver _turno)
+    """
+    cap = 2 * nx * ny # Cada indivíduo acrescenta no máximo uma posição a cada lista
+    return (np.zeros((4, cap, 2), dtype = np.int64), np.zeros((4, cap), dtype = np.bool_),
+            np.zeros(4, dtype = np.int64), np.zeros((nx, ny), dtype = np.int64))
+
+def turno(typ, siz, listas, tipo, kernels = None, buffers = None):
+    """
+    Função:
+    ---------
+    Joga o turno dos seres vivos do tipo indicado (herbívoros ou carnívoros), com as mesmas regras
+    de turn em Ecossis, sobre a rede guardada em arrays
+
+    Parameters
+    ----------
+    typ, siz : Arrays de ints (nx, ny)
+        Tipo e nível de cada célula, atualizados no lugar
+    listas : Lista de 4 listas/arrays de posições [i, j]
+        Posições das células vazias, plantas, herbívoros e carnívoros (pela ordem dos tipos)
+    tipo : Int
+        2 (herbívoros) ou 3 (carnívoros)
+    kernels : String ou None
+        Ver escolher. Em 'numpy' o mesmo ciclo corre interpretado.
+    buffers : Tuplo (opcional)
+        Arrays de trabalho criados por turnoBuffers, para não os alocar em cada turno
+
+    Returns
+    -------
+    listas : Lista de 4 arrays (k, 2)
+        Novas posições de cada tipo, pela ordem em que ficariam nas listas de turn (cópias, não vistas dos buffers)
+    """
+    if buffers is None:
+        buffers = turnoBuffers(*typ.shape)
+    pos, vivo, cnt, idx = buffers
+
+    for c in range(4): # Só as primeiras cnt[c] entradas são lidas; as seguintes são escritas antes de serem usadas
+        lista = np.asarray(listas[c], dtype = np.int64).reshape(-1, 2)
+        cnt[c] = lista.shape[0]
+        pos[c, :cnt[c]] = lista
+        vivo[c, :cnt[c]] = True
+        idx[lista[:, 0], lista[:, 1]] = np.arange(cnt[c])
+
+    # Ordens aleatórias dos vizinhos para a procura de alimento e de espaço de cada indivíduo
+    perms = np.argsort(np.random.random((cnt[tipo], 2, 4)), axis = 2)
+
+    f = _turno if escolher(kernels) == 'numba' else _python(_turno)
+    f(typ, siz, pos, cnt, vivo, idx, tipo, perms)
+
+    return [pos[c, :cnt[c]][vivo[c, :cnt[c]]] for c in range(4)]
+
+#%%
+
+@_jit
+def _gravidade(pos, m, eps, a, r2Min):
+    GM = 4. * np.pi ** 2
+    n, dim = pos.shape
+    r = np.zeros(dim)
+    guardar = r2Min.shape[0] > 0
+    a[:] = 0.
+    for i in range(n): # Cada par é calculado uma só vez
+        for j in range(i + 1, n):
+            r2 = eps * eps
+            for d in range(dim):
+                r[d] = pos[i, d] - pos[j, d]
+                r2 += r[d] * r[d]
+            if guardar:
+                r2Min[i] = min(r2Min[i], r2)
+                r2Min[j] = min(r2Min[j], r2)
+            w = GM / (r2 * np.sqrt(r2))
+            for d in range(dim):
+                a[i, d] -= w * m[j] * r[d]
+                a[j, d] += w * m[i] * r[d]
+
+def gravidade(pos, m, eps = 0, out = None, r2Min = None):
+    """
+    Função:
+    ---------
+    Acelerações gravíticas (G M_sol = 4 pi^2) de todos os corpos por soma direta dos pares, compilada.
+    O equivalente em NumPy é aCalc em multiPlanetas.
+
+    Parameters
+    ----------
+    pos : Array de floats (n, dim)
+        Posições dos corpos
+    m : Array de floats (n,)
+        Massas
+    eps : Float
+        Comprimento de suavização de Plummer
+    out : Array de floats (opcional)
+        Onde escrever as acelerações
+    r2Min : Array de floats (n,) contíguo (opcional)
+        Atualizado no lugar com o menor r^2 + eps^2 de cada corpo a qualquer outro
+
+    Returns
+    -------
+    a : Array de floats (n, dim)
+    """
+    a = np.zeros(pos.shape, dtype = float) if out is None else out
+    r2Min = np.zeros(0) if r2Min is None else r2Min
+    _gravidade(np.ascontiguousarray(pos, dtype = float), np.ascontiguousarray(m, dtype = float), float(eps), a, r2Min)
+    return a
+
+#%%
+
+@_jit
+def _stumpff(z):
+    # Funções de Stumpff C(z) e S(z) de um só valor, como integradores.stumpff
+    if z > 1e-6:
+        sz = np.sqrt(z)
+        return (1 - np.cos(sz)) / z, (sz - np.sin(sz)) / sz ** 3
+    if z < -1e-6:
+        sz = np.sqrt(-z)
+        return (np.cosh(sz) - 1) / -z, (np.sinh(sz) - sz) / sz ** 3
+    return 1 / 2 - z / 24, 1 / 6 - z / 120
+
+@_jit
+def _kepler(r0, v0, dt, GM, tol, maxIter, r, v):
+    # O algoritmo de integradores.kepler, uma órbita de cada vez. Devolve o número de soluções que não convergiram
+    n, dim = r0.shape
+    sqGM = np.sqrt(GM)
+    falhas = 0
+    for o in range(n):
+        r02 = 0.
+        v2 = 0.
+        rv0 = 0.
+        for d in range(dim):
+            r02 += r0[o, d] * r0[o, d]
+            v2 += v0[o, d] * v0[o, d]
+            rv0 += r0[o, d] * v0[o, d]
+        r0Norm = np.sqrt(r02)
+        alpha = 2 / r0Norm - v2 / GM
+        t = dt[o]
+        eli = alpha > 1e-12
+        if eli:
+            t = np.fmod(t, 2 * np.pi / (sqGM * alpha ** 1.5))
+        k1 = rv0 / sqGM
+        k2 = 1 - alpha * r0Norm
+
+        # Estimativa inicial: série nos passos curtos, senão elíptica, hiperbólica (Vallado) ou parabólica
+        x = sqGM * t / r0Norm
+        chi = x
+        if abs(x) < 0.5:
+            chi = x - k1 / (2 * r0Norm) * x ** 2 + (k1 ** 2 / (2 * r0Norm ** 2) - k2 / (6 * r0Norm)) * x ** 3
+        elif eli:
+            chi = sqGM * alpha * t
+        elif alpha < -1e-12:
+            a = 1 / alpha
+            sinal = 1. if t > 0 else -1.
+            den = rv0 + sinal * np.sqrt(-GM * a) * (1 - r0Norm * alpha)
+            if den != 0:
+                arg = -2 * GM * alpha * t / den
+                if arg != 0 and np.isfinite(arg):
+                    chi = sinal * np.sqrt(-a) * np.log(abs(arg))
+
+        # Intervalo com a raiz: direto nas órbitas ligadas, por duplicação nas restantes
+        lado = -1. if t < 0 else 1.
+        h2 = max(r02 * v2 - rv0 * rv0, 0.)
+        e = np.sqrt(max(1 - alpha * h2 / GM, 0.))
+        rMin = h2 / (GM * (1 + e))
+        bMin = 0.
+        b = np.inf
+        if eli and rMin > 0:
+            bMin = sqGM * abs(t) * alpha / (1 + e) * (1 - 1e-8)
+            b = sqGM * abs(t) / rMin * (1 + 1e-8)
+        if not np.isfinite(b):
+            bMin = 0.
+            b = max(abs(chi), sqGM * abs(t) / r0Norm) + 1e-300
+            for it in range(2000):
+                c = lado * b
+                C, S = _stumpff(alpha * c * c)
+                F = k1 * c * c * C + k2 * c ** 3 * S + r0Norm * c - sqGM * t
+                if not (np.isfinite(F) and lado * F < 0):
+                    break
+                b *= 2
+        lo = bMin if lado > 0 else -b
+        hi = b if lado > 0 else -bMin
+        chi = min(max(chi, lo), hi)
+
+        ativo = t != 0
+        if not ativo:
+            chi = 0.
+        it = 0
+        while ativo and it < maxIter:
+            z = alpha * chi * chi
+            C, S = _stumpff(z)
+            F = k1 * chi * chi * C + k2 * chi ** 3 * S + r0Norm * chi - sqGM * t
+            dF = k1 * chi * (1 - z * S) + k2 * chi * chi * C + r0Norm
+            d2F = k1 * (1 - z * C) + k2 * chi * (1 - z * S)
+            passou = not np.isfinite(F)
+            if F < 0 or (passou and lado < 0):
+                lo = chi
+            if F > 0 or (passou and lado > 0):
+                hi = chi
+            den = 2 * dF * dF - F * d2F
+            novo = chi - 2 * F * dF / den if den != 0 else np.nan
+            fora = not (novo >= lo and novo <= hi)
+            if fora:
+                novo = 0.5 * (lo + hi)
+            passo = novo - chi
+            chi = novo
+            escala = tol * max(1., abs(chi))
+            perto = not fora and dF != 0 and abs(passo) <= np.sqrt(escala)
+            resto = passo * passo * abs(d2F / (2 * dF)) if perto else abs(passo)
+            ativo = not (resto <= escala) and hi - lo > escala
+            it += 1
+        if ativo:
+            falhas += 1
+
+        # Coeficientes de Lagrange
+        z = alpha * chi * chi
+        C, S = _stumpff(z)
+        f = 1 - chi * chi / r0Norm * C
+        g = t - chi ** 3 / sqGM * S
+        rNorm = 0.
+        for d in range(dim):
+            r[o, d] = f * r0[o, d] + g * v0[o, d]
+            rNorm += r[o, d] * r[o, d]
+        rNorm = np.sqrt(rNorm)
+        fDot = sqGM / (rNorm * r0Norm) * (z * chi * S - chi)
+        gDot = 1 - chi * chi / rNorm * C
+        for d in range(dim):
+            v[o, d] = fDot * r0[o, d] + gDot * v0[o, d]
+    return falhas
+
+def kepler(r0, v0, dt, GM = 4. * np.pi ** 2, tol = 1e-12, maxIter = 100, kernels = None):
+    """
+    Função:
+    ---------
+    Propaga órbitas keplerianas como integradores.kepler (ver os detalhes aí). Com o Numba cada
+    órbita é resolvida num ciclo compilado, sem o custo fixo das operações de NumPy em arrays com
+    poucos elementos, que domina quando a função é chamada em cada passo (Wisdom-Holman).
+
+    Parameters
+    ----------
+    r0, v0 : Arrays de floats (..., dim)
+        Posições e velocidades iniciais
+    dt : Float ou array
+        Tempo a propagar, com forma compatível com r0.shape[:-1]
+    GM : Float
+        Parâmetro gravitacional do corpo central
+    tol : Float
+        Tolerância relativa na variável universal chi
+    maxIter : Int
+        Número máximo de iterações
+    kernels : String ou None
+        Ver escolher
+
+    Returns
+    -------
+    r, v : Arrays de floats
+        Posições e velocidades ao fim de dt, com a forma de r0 e dt combinadas
+    """
+    if escolher(kernels) != 'numba':
+        return ig.kepler(r0, v0, dt, GM, tol, maxIter)
+    r0 = np.asarray(r0, dtype = float)
+    v0 = np.asarray(v0, dtype = float)
+    forma = np.broadcast_shapes(r0.shape[:-1], np.shape(dt))
+    dim = r0.shape[-1]
+    if r0.shape[:-1] != forma: # Só se faz o broadcast quando é preciso (chamada em cada passo)
+        r0 = np.broadcast_to(r0, forma + (dim,))
+        v0 = np.broadcast_to(v0, forma + (dim,))
+    r0 = np.ascontiguousarray(r0.reshape(-1, dim))
+    v0 = np.ascontiguousarray(v0.reshape(-1, dim))
+    dt = np.full(r0.shape[0], float(dt)) if np.ndim(dt) == 0 else np.ascontiguousarray(np.broadcast_to(np.asarray(dt, dtype = float), forma).reshape(-1))
+    r = np.empty_like(r0)
+    v = np.empty_like(v0)
+    falhas = _kepler(r0, v0, dt, float(GM), float(tol), int(maxIter), r, v)
+    if falhas:
+        warnings.warn('kepler: ' + str(falhas) + ' soluções não convergiram em ' + str(maxIter) + ' iterações', RuntimeWarning)
+    return r.reshape(forma + (dim,)), v.reshape(forma + (dim,))
+
+#%%
+
+@_jit
+def _aCadeia(x, k, xEq, m, a):
+    # Aceleração de cada corpo: força da mola da direita menos a da esquerda (a última mola não existe)
+    n = x.shape[0]
+    fEsq = k[0] * (x[0] - xEq[0])
+    for i in range(n):
+        fDir = k[i + 1] * (x[i + 1] - x[i] - xEq[i + 1]) if i + 1 < n else 0.
+        a[i] = (fDir - fEsq) / m[i]
+        fEsq = fDir
+
+@_jit
+def rk4Cadeia(x, v, m, k, xEq, nPassos, dt):
+    """
+    Função:
+    ---------
+    Executa nPassos do método de Runge-Kutta de Ordem 4 para B cadeias de molas, com a aceleração
+    calculada no mesmo ciclo (sem arrays intermédios). Equivale a integradores.rk4 com a aceleração
+    acceCalc de mola.
+
+    Parameters
+    ----------
+    x, v : Arrays de floats (B, n)
+        Posições e velocidades, atualizadas no lugar
+    m, k, xEq : Arrays de floats (B, n)
+        Massas, constantes e distâncias de equilíbrio das molas de cada cadeia
+    nPassos : Int
+        Número de passos a executar
+    dt : Float
+        Tempo entre passos
+    """
+    B, n = x.shape
+    a = np.zeros(n)
+    xs = np.zeros(n)
+    kx = np.zeros(n)
+    kv = np.zeros(n)
+    sx = np.zeros(n)
+    sv = np.zeros(n)
+
+    for b in range(B): # As cadeias são independentes: cada uma faz todos os passos de seguida
+        for passo in range(nPassos):
+            _aCadeia(x[b], k[b], xEq[b], m[b], a)
+            for i in range(n):
+                kx[i] = v[b, i] * dt
+                kv[i] = a[i] * dt
+                sx[i] = kx[i]
+                sv[i] = kv[i]
+            for c, w in ((0.5, 2.), (0.5, 2.), (1., 1.)): # 2a, 3a e 4a iterações RK
+                for i in range(n):
+                    xs[i] = x[b, i] + c * kx[i]
+                    kx[i] = (v[b, i] + c * kv[i]) * dt
+                _aCadeia(xs, k[b], xEq[b], m[b], a)
+                for i in range(n):
+                    kv[i] = a[i] * dt
+                    sx[i] += w * kx[i]
+                    sv[i] += w * kv[i]
+            for i in range(n):
+                x[b, i] += sx[i] / 6
+                v[b, i] += sv[i] / 6
+
+#%%
+
+def compararMedias(amostra, nSeeds = 8, tol = 4.):
+    """
+    Função:
+    ---------
+    Compara estatisticamente os dois backends: corre uma simulação por semente em cada um e mede a
+    diferença entre as médias das grandezas em erros padrão
+
+    Parameters
+    ----------
+    amostra : Função
+        amostra(kernels, s) corre a simulação da semente s (0 <= s < nSeeds) com o backend kernels e
+        devolve as grandezas a comparar (float ou array (k,)). Escolhe ela própria as sementes aleatórias.
+    nSeeds : Int
+        Número de simulações por backend
+    tol : Float
+        Diferença máxima entre médias, em erros padrão
+
+    Returns
+    -------
+    d : Array de floats (k,)
+        Diferença entre as médias de cada grandeza, em erros padrão
+    ok : Array de bools (k,)
+        d < tol
+    """
+    res = {}
+    for kernels in ('numba', 'numpy'):
+        res[kernels] = np.array([np.atleast_1d(amostra(kernels, s)) for s in range(nSeeds)], dtype = float)
+    a, b = res['numba'], res['numpy']
+    erro = np.sqrt((a.var(axis = 0, ddof = 1) + b.var(axis = 0, ddof = 1)) / nSeeds) + 1e-12
+    d = np.abs(a.mean(axis = 0) - b.mean(axis = 0)) / erro
+    return d, d < tol
+
+#%%
+
+def compararBackends(nSeeds = 8, tol = 4., verbose = True):
+    """
+    Função:
+    ---------
+    Verifica que os backends 'numba' e 'numpy' dão os mesmos resultados:
+        - Metropolis: médias da magnetização e energia no equilíbrio, para várias sementes, iguais
+          dentro de tol erros padrão (as dinâmicas são diferentes, só a estatística é comparável);
+        - turno: com as mesmas ordens aleatórias o ciclo compilado (com buffers reutilizados) e o
+          interpretado são idênticos, e as populações médias ao longo de vários turnos coincidem;
+        - gravidade, kepler e rk4Cadeia: iguais às versões vetorizadas até ao arredondamento.
+
+    Parameters
+    ----------
+    nSeeds : Int
+        Número de sementes por backend nos testes estatísticos
+    tol : Float
+        Diferença máxima entre médias, em erros padrão
+    verbose : Bool
+        Escreve o resultado de cada teste
+
+    Returns
+    -------
+    ok : Bool
+        True se todos os testes passaram
+    """
+    if numba is None:
+        print('Numba não está instalado: só o backend numpy está disponível')
+        return True
+
+    testes = {}
+    estado = np.random.get_state()
+
+    # Metropolis numa rede 32 x 32, a uma temperatura acima e outra abaixo da crítica
+    for t, h in ((3., 1.), (1.5, 0.5)):
+        def equilibrio(kernels, s, t = t, h = h):
+            np.random.seed(s)
+            spins = np.where(np.random.random((32, 32)) < 0.5, -1., 1.)
+            mag = en = 0.
+            for i in range(100):
+                metropolis(spins, t, h, kernels)
+            for i in range(200):
+                metropolis(spins, t, h, kernels)
+                delta = np.roll(spins, 1, 0) + np.roll(spins, -1, 0) + np.roll(spins, 1, 1) + np.roll(spins, -1, 1)
+                mag += spins.mean() / 200
+                en += (-spins * (delta + 2 * h)).mean() / 400
+            return mag, en
+        ok = compararMedias(equilibrio, nSeeds, tol)[1]
+        testes['Metropolis t=' + str(t) + ' magnetização'] = ok[0]
+        testes['Metropolis t=' + str(t) + ' energia'] = ok[1]
+
+    # Turnos do ecossistema numa rede 30 x 30: igualdade com as mesmas ordens e populações médias
+    def ecossistema(s):
+        rng = np.random.default_rng(s)
+        typ = rng.choice(4, size = (30, 30), p = (0., 9 / 13, 3 / 13, 1 / 13))
+        siz = rng.integers(0, 3, size = (30, 30))
+        listas = [np.argwhere(typ == c) for c in range(4)]
+        return typ, siz, [rng.permutation(l) for l in listas]
+
+    typ, siz, listas = ecossistema(0)
+    res = {}
+    for kernels in ('numba', 'numpy'):
+        np.random.seed(1)
+        ty, si = typ.copy(), siz.copy()
+        buffers = turnoBuffers(30, 30) if kernels == 'numba' else None # Buffers reutilizados ou novos em cada turno
+        novas = turno(ty, si, listas, 2, kernels, buffers)
+        novas = turno(ty, si, novas, 3, kernels, buffers)
+        res[kernels] = ty, si, novas
+    testes['turno idêntico'] = (np.array_equal(res['numba'][0], res['numpy'][0]) and np.array_equal(res['numba'][1], res['numpy'][1])
+                                and all(np.array_equal(a, b) for a, b in zip(res['numba'][2], res['numpy'][2])))
+
+    def populacoes(kernels, s):
+        np.random.seed(100 + s + (kernels == 'numpy') * nSeeds) # Sementes diferentes em cada backend
+        ty, si, listas = ecossistema(s)
+        buffers = turnoBuffers(30, 30)
+        pop = np.zeros(3)
+        for i in range(20):
+            listas = turno(ty, si, listas, 2, kernels, buffers)
+            listas = turno(ty, si, listas, 3, kernels, buffers)
+            ty[ty == 0] = 1 # As plantas nascem nas células vazias
+            si[listas[0][:, 0], listas[0][:, 1]] = 0
+            listas = [listas[0][:0], np.concatenate((listas[1], listas[0])), listas[2], listas[3]]
+            pop += np.bincount(ty.ravel(), minlength = 4)[1:] / ty.size / 20
+        return pop
+    testes['turno populações'] = bool(np.all(compararMedias(populacoes, nSeeds, tol)[1]))
+
+    # Gravidade: soma direta vetorizada
+    rng = np.random.default_rng(2)
+    pos = rng.normal(size = (200, 2))
+    m = rng.random(200)
+    r = pos[:, None, :] - pos[None, :, :]
+    r2 = (r * r).sum(axis = 2) + 0.01
+    np.fill_diagonal(r2, np.inf)
+    aRef = -4 * np.pi ** 2 * (r * (m / (r2 * np.sqrt(r2)))[:, :, None]).sum(axis = 1)
+    testes['gravidade'] = np.allclose(gravidade(pos, m, 0.1), aRef, rtol = 1e-10, atol = 1e-12)
+
+    # Kepler: órbitas elípticas, quase parabólicas e hiperbólicas, para a frente e para trás no tempo
+    r0 = rng.normal(size = (300, 2))
+    v0 = rng.normal(size = (300, 2)) * rng.uniform(0.5, 12, size = (300, 1))
+    dt = rng.uniform(-3, 3, size = 300) * rng.choice((1e-3, 1., 1e3), size = 300)
+    rN, vN = kepler(r0, v0, dt, kernels = 'numba')
+    rP, vP = kepler(r0, v0, dt, kernels = 'numpy')
+    escala = np.sqrt((rP * rP).sum(axis = 1, keepdims = True))
+    testes['kepler'] = np.allclose(rN / escala, rP / escala, rtol = 0, atol = 1e-8) and np.allclose(vN, vP, rtol = 1e-8, atol = 1e-8)
+
+    # RK4 da cadeia: integradores.rk4 com a aceleração vetorizada
+    x = np.cumsum(rng.uniform(4, 6, size = (3, 10)), axis = 1)
+    v = rng.normal(size = (3, 10))
+    m = rng.uniform(0.5, 2, size = (3, 10))
+    k = rng.uniform(5, 20, size = (3, 10))
+    xEq = np.full((3, 10), 5.)
+
+    def aFun(x, out):
+        f = np.zeros((3, 11))
+        f[:, 0] = k[:, 0] * (x[:, 0] - xEq[:, 0])
+        f[:, 1:-1] = k[:, 1:] * (np.diff(x, axis = 1) - xEq[:, 1:])
+        out[...] = (f[:, 1:] - f[:, :-1]) / m
+
+    x1, v1 = x.copy(), v.copy()
+    ig.rk4(x1, v1, aFun, ig.initBuffers('RK4', x1, v1, aFun, 1e-3), 2000, 1e-3)
+    rk4Cadeia(x, v, m, k, xEq, 2000, 1e-3)
+    testes['rk4Cadeia'] = np.allclose(x, x1, rtol = 1e-10, atol = 1e-10) and np.allclose(v, v1, rtol = 1e-10, atol = 1e-10)
+
+    np.random.set_state(estado)
+
+    if verbose:
+        for nome, ok in testes.items():
+            print(('OK    ' if ok else 'FALHA ') + nome)
+
+    return all(testes.values())
+
+#%%
+
+if __name__ == '__main__':
+    compararBackends()